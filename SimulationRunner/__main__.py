@@ -0,0 +1,4 @@
+"""python -m SimulationRunner: the simrunner command line, see cli.py"""
+from .cli import main
+
+raise SystemExit(main())
@@ -1,49 +1,150 @@
 """Module containing a stand-alone script which compares the power spectrum of ICs
 to the power spectrum fed into MP-GenIC, read from CLASS format files."""
 import argparse
+import json
 import os
+import re
+import tempfile
 import scipy.interpolate as interp
 import numpy as np
-import matplotlib
-matplotlib.use("PDF")
-import matplotlib.pyplot as plt
-from nbodykit.lab import BigFileCatalog,FFTPower
 
 def modecount_rebin(kk, pk, modes, pkc, minmodes=250, ndesired=200):
-    """Rebins a power spectrum so that there are sufficient modes in each bin"""
+    """Rebins a power spectrum so that there are sufficient modes in each bin.
+    kk must be increasing, as from FFTPower. A bin is closed at the first k
+    where it has at least minmodes modes and spans 1/ndesired of the log k
+    range. The first k is kept as is, the last is never used, and an
+    incomplete final bin is dropped.
+    The bin ends are found with searchsorted on the cumulative mode count,
+    so the cost is O(n) for the sums plus O(log n) per output bin."""
     assert np.all(kk) > 0
     logkk=np.log10(kk)
     mdlogk = (np.max(logkk) - np.min(logkk))/ndesired
-    istart=iend=1
-    count=0
     pk_div = pk /pkc(kk)
-    k_list=[kk[0]]
-    pk_list=[pk_div[0]]
-    targetlogk=mdlogk+logkk[istart]
-    while iend < np.size(logkk)-1:
-        count+=modes[iend]
-        iend+=1
-        if count >= minmodes and logkk[iend-1] >= targetlogk:
-            pk1 = np.sum(modes[istart:iend]*pk_div[istart:iend])/count
-            kk1 = np.sum(modes[istart:iend]*kk[istart:iend])/count
-            k_list.append(kk1)
-            pk_list.append(pk1)
-            istart=iend
-            targetlogk=mdlogk+logkk[istart]
-            count=0
-    k_list = np.array(k_list)
-    pk_list = np.array(pk_list) * pkc(k_list)
+    #cummodes[i] is the number of modes below bin i
+    cummodes = np.concatenate([[0], np.cumsum(modes)])
+    ilast = np.size(logkk)-1
+    edges = [1]
+    while edges[-1] < ilast:
+        istart = edges[-1]
+        #First end with enough modes, and first end wide enough in log k
+        iend = max(np.searchsorted(cummodes, cummodes[istart] + minmodes, side='left'),
+                   np.searchsorted(logkk, mdlogk + logkk[istart], side='left') + 1,
+                   istart + 1)
+        if iend > ilast:
+            break
+        edges.append(iend)
+    k_list = np.array([kk[0]])
+    pk_list = np.array([pk_div[0]])
+    if len(edges) > 1:
+        starts = np.array(edges[:-1])
+        iend = edges[-1]
+        count = np.add.reduceat(modes[:iend], starts)
+        k_list = np.concatenate([k_list, np.add.reduceat(modes[:iend]*kk[:iend], starts)/count])
+        pk_list = np.concatenate([pk_list, np.add.reduceat(modes[:iend]*pk_div[:iend], starts)/count])
+    pk_list = pk_list * pkc(k_list)
     return (k_list, pk_list)
 
+def load_class_table(filename):
+    """Load a CLASS text file, ics_transfer_*.dat or ics_matterpow_*.dat.
+    The text file is what MP-GenIC read, perhaps changed by _alter_power:
+    only if it was not written is the table read from the class_output.npz
+    written by cambfile in the same folder.
+    This script is copied into each simulation folder, so it cannot use
+    SimulationRunner.classio."""
+    npzfile = os.path.join(os.path.dirname(filename), "class_output.npz")
+    match = re.match(r"ics_(transfer|matterpow)_(.*)\.dat$", os.path.basename(filename))
+    if match is None or os.path.exists(filename) or not os.path.exists(npzfile):
+        return np.loadtxt(filename)
+    with np.load(npzfile) as data:
+        ii = [str(zstr) for zstr in data["zstrs"]].index(match.group(2))
+        trans = data["transfer_"+str(ii)]
+        if match.group(1) == "transfer":
+            return np.column_stack([trans[name] for name in trans.dtype.names])
+        return np.column_stack([trans["k"], data["pklin_"+str(ii)]])
+
+def class_zstr(zz):
+    """Redshift string of the CLASS files, as SimulationICs._camb_zstr"""
+    if zz > 10:
+        return str(int(zz))
+    return '%.1g' % zz
+
+class LogLogSpline(object):
+    """Cubic spline of log P against log k, evaluated vectorized over k arrays.
+    Returns NaN outside the tabulated k range, where interp1d raised.
+    coeffs and logk are those of scipy's PPoly, so the spline can be saved and rebuilt."""
+    def __init__(self, logk, coeffs):
+        self.ppoly = interp.PPoly(coeffs, logk, extrapolate=False)
+
+    @classmethod
+    def fit(cls, kk, pk):
+        """Spline through the (k, P) table"""
+        spline = interp.CubicSpline(np.log(kk), np.log(pk), extrapolate=False)
+        return cls(spline.x, spline.c)
+
+    def __call__(self, kk):
+        return np.exp(self.ppoly(np.log(kk)))
+
+def _spline_cache_key(camb_matter, camb_transfer, omega0, omegab, omeganu):
+    """Everything the splines depend on: the parameters and the (size, mtime)
+    of the CLASS files, or of class_output.npz when they are read from it"""
+    npzfile = os.path.join(os.path.dirname(camb_matter), "class_output.npz")
+    key = [omega0, omegab, omeganu]
+    for fn in (camb_matter, camb_transfer, npzfile):
+        if os.path.exists(fn):
+            stat = os.stat(fn)
+            key += [os.path.basename(fn), stat.st_size, stat.st_mtime_ns]
+    return np.array([str(kk) for kk in key])
+
 class CLASSPowerSpectrum(object):
-    """Class to store some routines for manipulating and storing power spectra as generated by CLASS."""
-    def __init__(self, camb_matter, camb_transfer, omega0, omegab, omeganu=0):
-        pk_camb = np.loadtxt(camb_matter)
+    """Class to store some routines for manipulating and storing power spectra as generated by CLASS.
+    The power spectra are log-log cubic splines. If cache is True they are saved
+    to camb_linear/ic_splines_<zstr>.npz and reused while the CLASS files and
+    the parameters are unchanged."""
+    #Species of the splines: -1 is the total matter
+    species = (-1, 0, 1, 3)
+
+    def __init__(self, camb_matter, camb_transfer, omega0, omegab, omeganu=0, cache=True):
+        cachefile = None
+        match = re.match(r"ics_matterpow_(.*)\.dat$", os.path.basename(camb_matter))
+        if cache and match is not None:
+            cachefile = os.path.join(os.path.dirname(camb_matter), "ic_splines_"+match.group(1)+".npz")
+        key = _spline_cache_key(camb_matter, camb_transfer, omega0, omegab, omeganu)
+        if cachefile is not None and os.path.exists(cachefile):
+            with np.load(cachefile) as data:
+                if np.array_equal(data["key"], key):
+                    self.dtk = {sp: LogLogSpline(data["logk_"+str(sp)], data["coeffs_"+str(sp)])
+                                for sp in self.species}
+                    self.dpk = self.dtk.pop(-1)
+                    return
+        self._fit(camb_matter, camb_transfer, omega0, omegab, omeganu)
+        if cachefile is not None:
+            splines = dict(self.dtk)
+            splines[-1] = self.dpk
+            arrays = {}
+            for sp in self.species:
+                arrays["logk_"+str(sp)] = splines[sp].ppoly.x
+                arrays["coeffs_"+str(sp)] = splines[sp].ppoly.c
+            #Atomic, as several checks (or MPI ranks) may share a folder:
+            #each writer has its own temporary file
+            fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(cachefile),
+                                           prefix=os.path.basename(cachefile)+".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, key=key, **arrays)
+                os.chmod(tmpfile, 0o644)
+                os.replace(tmpfile, cachefile)
+            except BaseException:
+                os.remove(tmpfile)
+                raise
+
+    def _fit(self, camb_matter, camb_transfer, omega0, omegab, omeganu):
+        """Build the splines from the CLASS files"""
+        pk_camb = load_class_table(camb_matter)
         assert np.shape(pk_camb)[1] == 2
         # Build an interpolator for the matter power spectrum
-        self.dpk = interp.interp1d(pk_camb[:, 0], pk_camb[:, 1], kind='cubic')
+        self.dpk = LogLogSpline.fit(pk_camb[:, 0], pk_camb[:, 1])
         # Build interpolators for various species of transfer functions.
-        tk_camb = np.loadtxt(camb_transfer)
+        tk_camb = load_class_table(camb_transfer)
         self.dtk = {}
         omegacdm = omega0 - omegab - omeganu
         tdmby = (omegab * tk_camb[:,2] + omegacdm * tk_camb[:,3])
@@ -53,11 +154,25 @@ class CLASSPowerSpectrum(object):
         ttot /= omega0
         tdmby /= (omegab + omegacdm)
 
-        self.dtk[1] = interp.interp1d(tk_camb[:,0], pk_camb[:,1] * (tk_camb[:, 3]/ttot)**2, kind='cubic')
+        self.dtk[1] = LogLogSpline.fit(tk_camb[:,0], pk_camb[:,1] * (tk_camb[:, 3]/ttot)**2)
         #Baryons
-        self.dtk[0] = interp.interp1d(tk_camb[:,0], pk_camb[:,1] * (tk_camb[:, 2]/ttot)**2, kind='cubic')
+        self.dtk[0] = LogLogSpline.fit(tk_camb[:,0], pk_camb[:,1] * (tk_camb[:, 2]/ttot)**2)
         #DM + baryon
-        self.dtk[3] = interp.interp1d(tk_camb[:,0], pk_camb[:,1] * (tdmby/ttot)**2, kind='cubic')
+        self.dtk[3] = LogLogSpline.fit(tk_camb[:,0], pk_camb[:,1] * (tdmby/ttot)**2)
+
+    @classmethod
+    def from_simulation_dir(cls, simdir, camb_zstr=None, cache=True):
+        """The power spectra of a simulation folder, from its SimulationICs.json,
+        at camb_zstr (by default the initial redshift). Reuses the saved splines."""
+        with open(os.path.join(simdir, "SimulationICs.json"), "r") as f:
+            params = json.load(f)
+        if camb_zstr is None:
+            camb_zstr = class_zstr(params["redshift"])
+        camb_outdir = os.path.join(simdir, "camb_linear")
+        omeganu = params.get("m_nu", 0) / 93.14 / params["hubble"]**2
+        return cls(os.path.join(camb_outdir, "ics_matterpow_"+camb_zstr+".dat"),
+                   os.path.join(camb_outdir, "ics_transfer_"+camb_zstr+".dat"),
+                   omega0=params["omega0"], omegab=params["omegab"], omeganu=omeganu, cache=cache)
 
     def get_class_power(self, species=-1):
         """Get a matter power spectrum for DM, baryons from CAMB."""
@@ -65,13 +180,27 @@ class CLASSPowerSpectrum(object):
             return self.dpk
         return self.dtk[species]
 
+def _checked_range(kk_ic, npart):
+    """Indices of the checked k range: between 4 k_f and 1/4 the nyquist frequency"""
+    mink = np.min(kk_ic)
+    imax = np.searchsorted(kk_ic, npart*mink/4)
+    imin = np.searchsorted(kk_ic, mink*4)
+    return imin, imax
+
+def ic_power_error(kk_ic, Pk_ic, Pk_camb, npart):
+    """Fractional error of the IC power in the checked k range"""
+    imin, imax = _checked_range(kk_ic, npart)
+    return Pk_ic[imin:imax]/Pk_camb[imin:imax] -1
+
 def plot_ic_power(kk_ic, Pk_ic, Pk_camb, npart, sp=1, outdir="."):
     """Make the plot"""
+    #matplotlib is slow to import: only load it to plot
+    import matplotlib
+    matplotlib.use("PDF")
+    import matplotlib.pyplot as plt
     #Make some useful figures
     #Check that they agree between 1/4 the box and 1/4 the nyquist frequency
-    mink = np.min(kk_ic)
-    imax = np.searchsorted(kk_ic, npart*mink/4)
-    imin = np.searchsorted(kk_ic, mink*4)
+    imin, imax = _checked_range(kk_ic, npart)
     plt.semilogx(kk_ic, Pk_ic/Pk_camb,linewidth=2)
     plt.semilogx([kk_ic[0]*0.9,kk_ic[-1]*1.1], [0.95,0.95], ls="--",linewidth=2)
     plt.semilogx([kk_ic[0]*0.9,kk_ic[-1]*1.1], [1.05,1.05], ls="--",linewidth=2)
@@ -85,12 +214,124 @@ def plot_ic_power(kk_ic, Pk_ic, Pk_camb, npart, sp=1, outdir="."):
     plt.ylim(ymax=Pk_camb[0]*10)
     plt.savefig(os.path.join(outdir,"ICS/PK-IC-"+str(sp)+"-abs.pdf"))
     plt.clf()
-    error = Pk_ic[imin:imax]/Pk_camb[imin:imax] -1
-    return error
+    return ic_power_error(kk_ic, Pk_ic, Pk_camb, npart)
+
+#The accuracy check allows this many bins above the tolerance
+max_failing_bins = 3
+
+#Bytes per mesh cell of a painted, interlaced and FFTed mesh
+#(two f4 real meshes and the c8 half-complex transform)
+mesh_bytes_per_cell = 16
+
+#Particles nbodykit paints at a time, and the bytes of each while painted:
+#the f8 position, its interlaced shift and their copies exchanged between ranks
+paint_chunk_size = 1024 * 1024 * 4
+paint_bytes_per_particle = 4 * 24
+
+def mesh_memory(nmesh):
+    """Memory of a mesh of nmesh^3 cells for the power spectrum, in GB"""
+    return nmesh**3 * mesh_bytes_per_cell / 1024**3
+
+def particle_memory(npart, subsample=1.):
+    """Memory of the npart^3 particles alongside the mesh, in GB: a chunk of
+    painted positions (the catalogue is read a chunk at a time) and, for a
+    subsample, its mask and a chunk of the random draws."""
+    nchunk = min(npart**3, paint_chunk_size)
+    nbytes = nchunk * paint_bytes_per_particle
+    if subsample < 1:
+        nbytes += npart**3 + nchunk * 8
+    return nbytes / 1024**3
+
+def _fft_power(cat, boxsize, nmesh, fold=1, position='Position'):
+    """Power spectrum (k in h/Mpc, P in (Mpc/h)^3, modes) of a catalogue with
+    BoxSize in kpc/h, folded fold times along each side: the positions are
+    wrapped into a box of boxsize/fold, so the mesh reaches fold times
+    smaller scales. The folded power is at the k of the folded box and is
+    scaled back by fold^3."""
+    from nbodykit.lab import FFTPower
+    if fold > 1:
+        cat['FoldedPosition'] = cat[position] % (boxsize / fold)
+        position = 'FoldedPosition'
+    mesh = cat.to_mesh(Nmesh=nmesh, BoxSize=boxsize / fold, position=position,
+                       window='cic', compensated=True, interlaced=True)
+    pk = FFTPower(mesh, mode='1d')
+    #Convert units from kpc/h to Mpc/h
+    kk = pk.power['k'][1:]*1e3
+    power = pk.power['power'][1:].real/1e9 * fold**3
+    modes = pk.power['modes'][1:]
+    ii = np.isfinite(kk) * (modes > 0)
+    return kk[ii], power[ii], modes[ii]
+
+def folded_mesh_sizes(npart, memory_gb, subsample=1.):
+    """Mesh size and fold of folded_power: the largest even mesh within
+    memory_gb with the particles (see particle_memory; at most the 2 npart of
+    the full check) and the fold which takes its half Nyquist frequency to
+    npart/4 k_f, preferably a divisor of npart."""
+    mesh_gb = max(memory_gb - particle_memory(npart, subsample), 0)
+    nmesh = int((mesh_gb * 1024**3 / mesh_bytes_per_cell)**(1./3)) // 2 * 2
+    nmesh = min(nmesh, 2*npart)
+    if nmesh < 16:
+        raise ValueError("memory_gb = "+str(memory_gb)+" is too small for a 16^3 mesh and the particles")
+    fold_min = int(np.ceil(npart / nmesh))
+    divisors = [ff for ff in range(fold_min, 2*fold_min+1) if npart % ff == 0]
+    fold = divisors[0] if divisors else fold_min
+    return nmesh, fold
 
-def check_ic_power_spectra(genicfileout, camb_zstr, outdir=".", accuracy=0.07, m_nu=0):
+def folded_power(cat, npart, boxsize, memory_gb=8., subsample=1., seed=42):
+    """Power spectrum of the ICs within a memory budget, without the
+    (2 npart)^3 mesh of the full check.
+
+    Large scales come from the largest mesh fitting in memory_gb, up to half
+    its Nyquist frequency. Small scales, up to the 1/4 mesh Nyquist frequency
+    of the full check (npart/4 k_f), come from the same mesh with the box
+    folded by the smallest divisor of npart large enough, so the folded
+    particle grid stays regular.
+
+    Optionally only a random fraction subsample of the particles (drawn with
+    seed) is painted, and the extra shot noise, V (1/N_sub - 1/N), is subtracted.
+
+    Returns (k in h/Mpc, P in (Mpc/h)^3, modes), sorted in k."""
+    nmesh, fold = folded_mesh_sizes(npart, memory_gb, subsample=subsample)
+    npart_total = float(npart)**3
+    #Extra shot noise of the subsample, in (Mpc/h)^3
+    shotnoise = 0.
+    if subsample < 1:
+        #Different streams on each rank: cat.size is the local size.
+        #Drawn a chunk at a time, so only the mask is of the catalogue size.
+        rng = np.random.default_rng([seed, cat.comm.rank])
+        mask = np.empty(cat.size, dtype=bool)
+        for start in range(0, cat.size, paint_chunk_size):
+            end = min(start + paint_chunk_size, cat.size)
+            mask[start:end] = rng.uniform(size=end - start) < subsample
+        cat = cat[mask]
+        shotnoise = (boxsize/1e3)**3 * (1. / (subsample * npart_total) - 1. / npart_total)
+
+    kf = 2 * np.pi / boxsize * 1e3
+    #Mesh accurate to half its Nyquist frequency with compensation and interlacing
+    kcut = nmesh / 4 * kf
+    kk, power, modes = _fft_power(cat, boxsize, nmesh)
+    ii = kk < kcut
+    kk, power, modes = kk[ii], power[ii], modes[ii]
+
+    if fold > 1:
+        kkf, powerf, modesf = _fft_power(cat, boxsize, nmesh, fold=fold)
+        ii = (kkf >= kcut) * (kkf < fold * kcut)
+        kk = np.concatenate([kk, kkf[ii]])
+        power = np.concatenate([power, powerf[ii]])
+        modes = np.concatenate([modes, modesf[ii]])
+    return kk, power - shotnoise, modes
+
+def ic_power_errors(genicfileout, camb_zstr, outdir=".", m_nu=0,
+                    method="auto", memory_gb=8., subsample=1., plot=True):
     """Generate the power spectrum for each particle type from the generated simulation files
-    and check that it matches the input. This is a consistency test on each simulation output."""
+    and compare it to the input. Returns the fractional error in the checked k range
+    of each particle type, {type: error}.
+    method is "full", a mesh of (2 npart)^3 as always, "folded" (see folded_power), which
+    stays within memory_gb, or "auto": full if it fits in memory_gb. memory_gb
+    counts the meshes and the particles painted onto them (see particle_memory).
+    If plot is True the comparison is also plotted to ICS/PK-IC-<type>-*.pdf."""
+    from nbodykit import set_options
+    from nbodykit.lab import BigFileCatalog,FFTPower
     #Generate power spectra
     output = os.path.join(outdir, genicfileout)
     #Now check that they match what we put into the simulation, from CAMB
@@ -108,18 +349,32 @@ def check_ic_power_spectra(genicfileout, camb_zstr, outdir=".", accuracy=0.07, m
     hubble = cats[1].attrs['HubbleParam']
     npart = int(np.round(np.cbrt(cats[1].attrs['TotNumPart'][1])))
     assert npart > 0
+    if method == "auto":
+        method = "full" if mesh_memory(npart*2) + particle_memory(npart) <= memory_gb \
+            and subsample >= 1 else "folded"
+    assert method in ("full", "folded")
     cambpow = CLASSPowerSpectrum(matterpow, transfer,omega0=omega0, omegab=omegab, omeganu=m_nu/93.14/hubble**2)
+    errors = {}
     for sp in cats.keys():
-        #GenPK output is at PK-[nu,by,DM]-basename(genicfileout)
-        cats[sp].to_mesh(Nmesh=npart*2, window='cic', compensated=True, interlaced=True)
-        pk = FFTPower(cats[sp], mode='1d', Nmesh=npart*2, dk=5.0e-6)
-        #GenPK output is at PK-[nu,by,DM]-basename(genicfileout)
-        #Load the power spectra
-        #Convert units from kpc/h to Mpc/h
-        kk_ic = pk.power['k'][1:]*1e3
-        Pk_ic = pk.power['power'][1:].real/1e9
-        modes_ic = pk.power['modes'][1:]
-        ii = np.isfinite(kk_ic)
+        if method == "folded":
+            boxsize = np.ravel(cats[sp].attrs['BoxSize'])[0]
+            #The chunks particle_memory counts
+            with set_options(paint_chunk_size=paint_chunk_size):
+                kk_ic, Pk_ic, modes_ic = folded_power(cats[sp], npart, boxsize,
+                    memory_gb=memory_gb, subsample=subsample)
+            ii = np.isfinite(kk_ic)
+        else:
+            #GenPK output is at PK-[nu,by,DM]-basename(genicfileout)
+            cats[sp].to_mesh(Nmesh=npart*2, window='cic', compensated=True, interlaced=True)
+            with set_options(paint_chunk_size=paint_chunk_size):
+                pk = FFTPower(cats[sp], mode='1d', Nmesh=npart*2, dk=5.0e-6)
+            #GenPK output is at PK-[nu,by,DM]-basename(genicfileout)
+            #Load the power spectra
+            #Convert units from kpc/h to Mpc/h
+            kk_ic = pk.power['k'][1:]*1e3
+            Pk_ic = pk.power['power'][1:].real/1e9
+            modes_ic = pk.power['modes'][1:]
+            ii = np.isfinite(kk_ic)
         kk_ic = kk_ic[ii]
         Pk_ic = Pk_ic[ii]
         #Load the power spectrum. Note that DM may be total.
@@ -130,9 +385,26 @@ def check_ic_power_spectra(genicfileout, camb_zstr, outdir=".", accuracy=0.07, m
                 ccsp = 3
         Pk_camb = cambpow.get_class_power(species=ccsp)
         (kk_ic, Pk_ic) = modecount_rebin(kk_ic, Pk_ic, modes_ic[ii], Pk_camb, ndesired=npart//2)
-        error = plot_ic_power(kk_ic, Pk_ic, Pk_camb(kk_ic), sp=sp, npart=npart, outdir=outdir)
+        if plot:
+            error = plot_ic_power(kk_ic, Pk_ic, Pk_camb(kk_ic), sp=sp, npart=npart, outdir=outdir)
+        else:
+            error = ic_power_error(kk_ic, Pk_ic, Pk_camb(kk_ic), npart=npart)
+        #The splines are NaN outside the CLASS k range
+        if not np.all(np.isfinite(error)):
+            raise RuntimeError("IC k range is outside the CLASS k range for "+str(sp))
+        errors[sp] = error
+    return errors
+
+def check_ic_power_spectra(genicfileout, camb_zstr, outdir=".", accuracy=0.07, m_nu=0,
+                           method="auto", memory_gb=8., subsample=1., plot=True):
+    """Generate the power spectrum for each particle type from the generated simulation files
+    and check that it matches the input. This is a consistency test on each simulation output.
+    See ic_power_errors for the options."""
+    errors = ic_power_errors(genicfileout, camb_zstr, outdir=outdir, m_nu=m_nu, method=method,
+                             memory_gb=memory_gb, subsample=subsample, plot=plot)
+    for sp, error in errors.items():
         #Don't worry too much about one failing mode.
-        if np.size(np.where(error > accuracy)) > 3:
+        if np.size(np.where(error > accuracy)) > max_failing_bins:
             raise RuntimeError("Pk accuracy check failed for "+str(sp)+". Max error: "+str(np.max(error)))
 
 if __name__ == "__main__":
@@ -140,5 +412,10 @@ if __name__ == "__main__":
     parser.add_argument('genicfile', type=str, help='File with generated ICs')
     parser.add_argument('--czstr', type=str, help='Redshift string used in class files',required=True)
     parser.add_argument('--mnu', default=0, type=float,help='Sum of neutrino masses',required=False)
+    parser.add_argument('--method', default="auto", type=str, choices=["auto", "full", "folded"],
+                        help='full: (2 npart)^3 mesh; folded: within memory_gb; auto: full if it fits')
+    parser.add_argument('--memory_gb', default=8., type=float, help='Memory budget of the meshes and the painted particles in GB')
+    parser.add_argument('--subsample', default=1., type=float, help='Fraction of particles to paint')
     args = parser.parse_args()
-    check_ic_power_spectra(args.genicfile, camb_zstr = args.czstr, m_nu=args.mnu)
+    check_ic_power_spectra(args.genicfile, camb_zstr = args.czstr, m_nu=args.mnu,
+                           method=args.method, memory_gb=args.memory_gb, subsample=args.subsample)
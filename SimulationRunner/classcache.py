@@ -0,0 +1,220 @@
+"""
+Content-addressed on-disk cache for the CLASS outputs written by
+SimulationICs.cambfile().
+
+The simulations of one Latin hypercube point at different fidelities
+(LF/HF box and npart) share the same cosmology, so they can share a single
+CLASS run. The key is a canonical hash of the final CLASS parameter dict
+and the list of output redshifts. P_k_max is deliberately left out of the
+key: an entry computed to a larger maximum k serves every request with a
+smaller one, because CLASS samples the transfer functions on the same
+logarithmic k grid and each k mode is solved independently.
+
+Layout of the cache directory:
+----
+<cache_dir>/<key>/cache_meta.json
+<cache_dir>/<key>/ics_transfer_*.dat
+<cache_dir>/<key>/ics_matterpow_*.dat
+
+Entries are evicted least-recently-used first once the total size exceeds
+the size bound. The mtime of cache_meta.json records the last access.
+"""
+from typing import Any, List, Optional
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# the parameters which only bound the k or z range computed by CLASS
+_range_keys = ("P_k_max_h/Mpc", "z_max_pk")
+
+_meta_file = "cache_meta.json"
+
+
+def _canonical(val: Any) -> Any:
+    """
+    Convert a value from a CLASS parameter dict into something json can
+    write deterministically: numpy scalars and arrays become python floats
+    and lists, floats are kept at full precision.
+    """
+    if isinstance(val, dict):
+        return {str(key): _canonical(v) for key, v in val.items()}
+    if isinstance(val, (list, tuple, np.ndarray)):
+        return [_canonical(v) for v in val]
+    if isinstance(val, (bool, np.bool_)):
+        return bool(val)
+    if isinstance(val, (int, np.integer)):
+        return int(val)
+    if isinstance(val, (float, np.floating)):
+        # repr round-trips exactly, and integral floats stay distinct from
+        # ints so that 1 and 1.0 do not silently collide in CLASS
+        return repr(float(val))
+    return str(val)
+
+
+def canonical_hash(pre_params: dict, redshifts: Optional[List[float]] = None) -> str:
+    """
+    sha256 of the canonical json form of a CLASS parameter dict, excluding
+    the parameters which only set the computed k or z range.
+
+    Parameters:
+    ----
+    pre_params (dict) : parameters fed into CLASS.ClassEngine
+    redshifts (list)  : the z_pk output redshifts
+    """
+    params = {key: val for key, val in pre_params.items() if key not in _range_keys}
+    if redshifts is not None:
+        params["z_pk"] = list(redshifts)
+
+    txt = json.dumps(_canonical(params), sort_keys=True, separators=(",", ":"))
+
+    return hashlib.sha256(txt.encode("utf-8")).hexdigest()
+
+
+class ClassCache(object):
+    """
+    A size-bounded LRU cache of CLASS output directories.
+
+    Parameters:
+    ----
+    cache_dir (str)   : where to keep the cache; created if absent.
+    max_gb (float)    : size bound of the whole cache in GB.
+    hardlink (bool)   : materialise files by hard link when possible,
+        otherwise copy. Hard-linked files share their contents with the
+        cache, so they should never be modified in place.
+    """
+
+    def __init__(self, cache_dir: str, max_gb: float = 10., hardlink: bool = True) -> None:
+        self.cache_dir = os.path.realpath(os.path.expanduser(cache_dir))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        assert max_gb > 0
+        self.max_bytes = int(max_gb * 1024**3)
+        self.hardlink  = hardlink
+
+    @staticmethod
+    def key(pre_params: dict, redshifts: Optional[List[float]] = None) -> str:
+        """Cache key of a CLASS run, see canonical_hash."""
+        return canonical_hash(pre_params, redshifts)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        """The metadata of an entry, or None if there is no complete entry."""
+        try:
+            with open(os.path.join(self._entry(key), _meta_file), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _materialise(self, src: str, dst: str) -> None:
+        """Hard link src to dst, falling back to a copy across filesystems."""
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if self.hardlink:
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+        shutil.copy2(src, dst)
+
+    def fetch(self, key: str, maxk: float, outdir: str) -> bool:
+        """
+        Materialise a cached CLASS output into outdir.
+
+        Parameters:
+        ----
+        key (str)     : cache key from self.key
+        maxk (float)  : the P_k_max_h/Mpc the caller needs
+        outdir (str)  : directory to place the files in, e.g. camb_linear/
+
+        Returns:
+        ----
+        hit (bool) : False if there is no entry reaching maxk
+        """
+        meta = self._read_meta(key)
+        # tiny tolerance for the fp-roundoff of the computed maxk
+        if meta is None or meta["maxk"] < maxk * (1 - 1e-10):
+            return False
+
+        entry = self._entry(key)
+        try:
+            for fn in meta["files"]:
+                self._materialise(os.path.join(entry, fn), os.path.join(outdir, fn))
+        except FileNotFoundError:
+            # evicted by another process while we were reading it
+            return False
+
+        # record the access time for LRU eviction
+        try:
+            os.utime(os.path.join(entry, _meta_file))
+        except FileNotFoundError:
+            pass
+
+        return True
+
+    def store(self, key: str, maxk: float, outdir: str, files: List[str]) -> None:
+        """
+        Add the CLASS output files in outdir to the cache, replacing an
+        existing entry with a smaller maxk. Safe against other processes
+        storing the same key at the same time: the entry is assembled in a
+        temporary directory and renamed into place.
+        """
+        meta = self._read_meta(key)
+        if meta is not None and meta["maxk"] >= maxk:
+            return
+
+        tmpdir = tempfile.mkdtemp(prefix=".tmp-" + key[:16], dir=self.cache_dir)
+        try:
+            for fn in files:
+                self._materialise(os.path.join(outdir, fn), os.path.join(tmpdir, fn))
+            with open(os.path.join(tmpdir, _meta_file), "w") as f:
+                json.dump({"maxk": float(maxk), "files": list(files)}, f)
+
+            entry = self._entry(key)
+            if os.path.exists(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmpdir, entry)
+        except OSError:
+            # lost a race with another process storing the same key
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def entries(self) -> List[dict]:
+        """List the complete entries with their size and last access time."""
+        out = []
+        for key in os.listdir(self.cache_dir):
+            entry = self._entry(key)
+            meta_path = os.path.join(entry, _meta_file)
+            if key.startswith(".") or not os.path.exists(meta_path):
+                continue
+            try:
+                size = sum(
+                    os.stat(os.path.join(entry, fn)).st_size for fn in os.listdir(entry))
+                atime = os.stat(meta_path).st_mtime
+            except FileNotFoundError:
+                continue
+            out.append({"key": key, "size": size, "atime": atime})
+        return out
+
+    def size(self) -> int:
+        """Total size of the cache in bytes."""
+        return sum(ee["size"] for ee in self.entries())
+
+    def evict(self) -> None:
+        """Remove least-recently-used entries until the cache fits max_bytes."""
+        entries = sorted(self.entries(), key=lambda ee: ee["atime"])
+        total = sum(ee["size"] for ee in entries)
+
+        # always keep the most recent entry, even if it alone is too big
+        for ee in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry(ee["key"]), ignore_errors=True)
+            total -= ee["size"]
@@ -0,0 +1,266 @@
+"""
+Read and write the CLASS outputs of a simulation.
+
+cambfile() stores the transfer functions and the linear matter power of
+every output redshift in a single binary file, camb_linear/class_output.npz.
+The CLASS formatted text files (ics_transfer_*.dat, ics_matterpow_*.dat)
+are only written for the redshifts which need them, e.g., the initial
+redshift read by MP-GenIC, and can be emitted from the binary file on
+demand with write_class_text.
+
+Layout of class_output.npz:
+----
+zstrs        : redshift strings used in the text file names
+transfer_{i} : structured array from CLASS.Spectra.get_transfer at zstrs[i]
+pklin_{i}    : linear matter power on transfer_{i}['k']
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+import shutil
+import tempfile
+import numpy as np
+
+class_npz = "class_output.npz"
+
+# get the CLASS text filenames using the redshift string
+transfer_fn  = lambda zstr: "ics_transfer_" + zstr + ".dat"
+matterpow_fn = lambda zstr: "ics_matterpow_" + zstr + ".dat"
+
+
+def replace_file(filename: str, write: Callable) -> None:
+    """
+    Write filename anew: write(f) fills a temporary file in the same folder,
+    which is then renamed over filename. A hard link at filename, e.g.
+    into the CLASS cache, keeps its old contents, and a reader never sees
+    a half written file.
+    """
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+        prefix=os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(tmpfile, 0o644)
+        os.replace(tmpfile, filename)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+
+
+def detach_file(filename: str) -> None:
+    """
+    Give filename an inode of its own if it is hard linked (see
+    ClassCache), so writing into it does not change the other links.
+    """
+    def copy(f) -> None:
+        with open(filename, "rb") as src:
+            shutil.copyfileobj(src, f)
+
+    if os.stat(filename).st_nlink > 1:
+        replace_file(filename, copy)
+
+
+def save_transfer(transfer: np.ndarray, transferfile: str) -> None:
+    """
+    Save a transfer function. Note we save the CLASS FORMATTED transfer functions.
+    The transfer functions differ from CAMB by:
+        T_CAMB(k) = -T_CLASS(k)/k^2
+    """
+    header="""Transfer functions T_i(k) for adiabatic (AD) mode (normalized to initial curvature=1)
+d_i   stands for (delta rho_i/rho_i)(k,z) with above normalization
+d_tot stands for (delta rho_tot/rho_tot)(k,z) with rho_Lambda NOT included in rho_tot
+(note that this differs from the transfer function output from CAMB/CMBFAST, which gives the same
+ quantities divided by -k^2 with k in Mpc^-1; use format=camb to match CAMB)
+t_i   stands for theta_i(k,z) with above normalization
+t_tot stands for (sum_i [rho_i+p_i] theta_i)/(sum_i [rho_i+p_i]))(k,z)
+%s""" % " ".join(f"{index}. {item} " for index, item in enumerate(transfer.dtype.names, start=1))
+    #This format matches the default output by CLASS command line.
+    replace_file(transferfile, lambda f: np.savetxt(f, transfer, header=header))
+
+
+def save_matterpow(kk: np.ndarray, pk_lin: np.ndarray, pkfile: str) -> None:
+    """Save a linear matter power spectrum in the two column text format."""
+    replace_file(pkfile, lambda f: np.savetxt(f, np.vstack([kk, pk_lin]).T))
+
+
+def save_class_npz(filename: str, zstrs: List[str], transfers: List[np.ndarray],
+        pklins: List[np.ndarray], compressed: bool = False) -> None:
+    """
+    Save the CLASS outputs of all redshifts into a single npz file.
+
+    Parameters:
+    ----
+    filename (str)  : path to the npz file
+    zstrs (list)    : redshift strings, as in SimulationICs._camb_zstr
+    transfers (list): structured transfer arrays, one per redshift
+    pklins (list)   : linear matter power on the k of each transfer array
+    compressed (bool) : use zip compression; smaller but slower to read.
+    """
+    assert len(zstrs) == len(transfers) == len(pklins)
+
+    arrays = {"zstrs": np.array(zstrs, dtype=str)}
+    for i, (trans, pk_lin) in enumerate(zip(transfers, pklins)):
+        assert np.shape(pk_lin) == np.shape(trans["k"])
+        arrays["transfer_{}".format(i)] = trans
+        arrays["pklin_{}".format(i)]    = np.asarray(pk_lin)
+
+    # write and rename, so a reader never sees a half written file
+    replace_file(filename, lambda f: (np.savez_compressed if compressed else np.savez)(f, **arrays))
+
+
+class ClassOutput(object):
+    """
+    The CLASS outputs of one simulation, loaded from class_output.npz.
+
+    Parameters:
+    ----
+    filename (str) : path to class_output.npz
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+
+        with np.load(filename, allow_pickle=False) as data:
+            self.zstrs: List[str] = [str(zstr) for zstr in data["zstrs"]]
+            self._transfers: Dict[str, np.ndarray] = {}
+            self._pklins: Dict[str, np.ndarray] = {}
+
+            for i, zstr in enumerate(self.zstrs):
+                self._transfers[zstr] = data["transfer_{}".format(i)]
+                self._pklins[zstr]    = data["pklin_{}".format(i)]
+
+    @property
+    def redshifts(self) -> List[float]:
+        """Redshifts of the outputs, as parsed from the text filenames"""
+        return [float(zstr) for zstr in self.zstrs]
+
+    def transfer(self, zstr: str) -> np.ndarray:
+        """Structured transfer function array at a redshift string"""
+        return self._transfers[zstr]
+
+    def transfer_table(self, zstr: str) -> np.ndarray:
+        """
+        Transfer functions as a 2D array, matching np.loadtxt of the
+        ics_transfer_*.dat file.
+        """
+        trans = self._transfers[zstr]
+        return np.column_stack([trans[name] for name in trans.dtype.names])
+
+    def matterpow(self, zstr: str) -> np.ndarray:
+        """
+        (k, P_lin) as a 2D array, matching np.loadtxt of the
+        ics_matterpow_*.dat file.
+        """
+        return np.column_stack([self._transfers[zstr]["k"], self._pklins[zstr]])
+
+
+def find_class_npz(camb_outdir: str) -> Optional[str]:
+    """Path to class_output.npz in a camb_linear/ folder, or None"""
+    filename = os.path.join(camb_outdir, class_npz)
+    if os.path.exists(filename):
+        return filename
+    return None
+
+
+def write_class_text(class_output: ClassOutput, camb_outdir: str,
+        zstrs: Optional[List[str]] = None, overwrite: bool = False) -> List[str]:
+    """
+    Emit the CLASS formatted text files for some redshifts, e.g., the ones
+    MP-GenIC reads.
+
+    Parameters:
+    ----
+    class_output (ClassOutput) : loaded class_output.npz
+    camb_outdir (str)          : the camb_linear/ folder
+    zstrs (list)               : redshift strings; all if None.
+    overwrite (bool)           : rewrite files which already exist.
+
+    Returns:
+    ----
+    files (list) : names of the files written
+    """
+    if zstrs is None:
+        zstrs = class_output.zstrs
+
+    files = []
+    for zstr in zstrs:
+        trans = class_output.transfer(zstr)
+        pk_lin = class_output.matterpow(zstr)[:, 1]
+        files += save_class_text(camb_outdir, zstr, trans, pk_lin, overwrite=overwrite)
+
+    return files
+
+
+def save_class_text(camb_outdir: str, zstr: str, transfer: np.ndarray,
+        pk_lin: np.ndarray, overwrite: bool = True) -> List[str]:
+    """
+    Write the CLASS formatted text files of one redshift.
+
+    Returns:
+    ----
+    files (list) : names of the files written
+    """
+    files = []
+
+    transferfile = os.path.join(camb_outdir, transfer_fn(zstr))
+    if overwrite or not os.path.exists(transferfile):
+        save_transfer(transfer, transferfile)
+        files.append(transfer_fn(zstr))
+
+    pkfile = os.path.join(camb_outdir, matterpow_fn(zstr))
+    if overwrite or not os.path.exists(pkfile):
+        save_matterpow(transfer["k"], pk_lin, pkfile)
+        files.append(matterpow_fn(zstr))
+
+    return files
+
+
+def load_matterpow(camb_outdir: str, zstr: str) -> np.ndarray:
+    """
+    (k, P_lin) at a redshift string from a camb_linear/ folder: the text
+    file, which MP-GenIC reads and _alter_power may change, or
+    class_output.npz where there is none.
+    """
+    pkfile = os.path.join(camb_outdir, matterpow_fn(zstr))
+    npzfile = find_class_npz(camb_outdir)
+    if npzfile is not None and not os.path.exists(pkfile):
+        return ClassOutput(npzfile).matterpow(zstr)
+    return np.loadtxt(pkfile)
+
+
+def load_transfer(camb_outdir: str, zstr: str) -> np.ndarray:
+    """
+    Transfer function table at a redshift string from a camb_linear/ folder:
+    the text file, or class_output.npz where there is none.
+    """
+    transferfile = os.path.join(camb_outdir, transfer_fn(zstr))
+    npzfile = find_class_npz(camb_outdir)
+    if npzfile is not None and not os.path.exists(transferfile):
+        return ClassOutput(npzfile).transfer_table(zstr)
+    return np.loadtxt(transferfile)
+
+
+def read_all_matterpow(camb_outdir: str) -> Tuple[List[float], np.ndarray]:
+    """
+    All linear matter power spectra of a camb_linear/ folder in a single
+    matrix, in shape (n redshifts, m k-modes, 2 cols), ordered from high
+    to low redshift. The folder must have a class_output.npz; the
+    redshifts with a text file are read from it, as load_matterpow.
+    """
+    npzfile = find_class_npz(camb_outdir)
+    assert npzfile is not None
+
+    class_output = ClassOutput(npzfile)
+    order = np.argsort(class_output.redshifts)[::-1]
+
+    redshifts = [class_output.redshifts[i] for i in order]
+    out = np.stack([class_output.matterpow(class_output.zstrs[i]) for i in order])
+    for j, i in enumerate(order):
+        pkfile = os.path.join(camb_outdir, matterpow_fn(class_output.zstrs[i]))
+        if os.path.exists(pkfile):
+            pk_text = np.loadtxt(pkfile)
+            if pk_text.shape != out[j].shape:
+                raise ValueError("{} has {} rows, not the {} of {}".format(
+                    pkfile, len(pk_text), out.shape[1], npzfile))
+            out[j] = pk_text
+
+    return redshifts, out
@@ -0,0 +1,119 @@
+"""
+Precision presets for CLASS, selected with SimulationICs(class_preset=...).
+
+production : the high precision settings cambfile has always used; for the
+    runs going into an emulator.
+lowres     : BAO sampled more coarsely and lower hierarchy truncations; for
+    low fidelity runs (e.g. npart=75), where the IC power is limited by
+    the particle grid rather than by CLASS.
+preview    : close to CLASS defaults; makes dry runs nearly free. Not for
+    production ICs.
+
+benchmarks/bench_class_presets.py measures the CLASS wall time and the
+P(k) and T(k) deviation from production of each preset.
+"""
+from typing import Dict, Optional, Tuple
+import json
+
+# CLASS precision parameters of each preset
+class_presets: Dict[str, dict] = {
+    "production" : {
+        'tol_background_integration': 1e-9, 'tol_perturb_integration' : 1.e-7,
+        'tol_thermo_integration':1.e-5, 'k_per_decade_for_pk': 50,'k_bao_width': 8,
+        'k_per_decade_for_bao':  200, 'neglect_CMB_sources_below_visibility' : 1.e-30,
+        'transfer_neglect_late_source': 3000., 'l_max_g' : 50,
+        'l_max_ur':150, 'extra metric transfer functions': 'y'},
+    "lowres" : {
+        'tol_background_integration': 1e-7, 'tol_perturb_integration' : 1.e-6,
+        'tol_thermo_integration':1.e-5, 'k_per_decade_for_pk': 20,'k_bao_width': 4,
+        'k_per_decade_for_bao':  70, 'neglect_CMB_sources_below_visibility' : 1.e-10,
+        'transfer_neglect_late_source': 1000., 'l_max_g' : 20,
+        'l_max_ur':50, 'extra metric transfer functions': 'y'},
+    "preview" : {
+        'k_per_decade_for_pk': 10, 'k_per_decade_for_bao': 20,
+        'extra metric transfer functions': 'y'},
+}
+
+# Massive neutrino settings of each preset:
+# tol_ncdm_min : loosest tol_ncdm_synchronous allowed; nu_acc is used if it
+#     is looser. None means nu_acc is used as given.
+# l_max_ncdm   : neutrino hierarchy truncation
+# ncdm_fluid_approximation : 3 disables the fluid approximation, 2 is the
+#     CLASS fluid approximation
+class_nu_presets: Dict[str, dict] = {
+    "production" : {"tol_ncdm_min": None, "l_max_ncdm": 50, "ncdm_fluid_approximation": 3},
+    "lowres"     : {"tol_ncdm_min": 1e-4, "l_max_ncdm": 30, "ncdm_fluid_approximation": 3},
+    "preview"    : {"tol_ncdm_min": 1e-3, "l_max_ncdm": 17, "ncdm_fluid_approximation": 2},
+}
+
+# Placeholder CLASS wall times of each preset in seconds, (massless, massive
+# neutrinos): guesses, not measurements. SimulationSuite.plan uses the
+# timings of benchmarks/bench_class_presets.py --output instead when given.
+class_time_estimates: Dict[str, tuple] = {
+    "production" : (60., 360.),
+    "lowres"     : (20., 90.),
+    "preview"    : (5., 10.),
+}
+
+
+def class_times(timings_file: Optional[str] = None) -> Tuple[Dict[str, tuple], str]:
+    """
+    CLASS wall times of each preset in seconds, (massless, massive neutrinos).
+
+    Parameters:
+    ----
+    timings_file (str) : json written by bench_class_presets.py --output;
+        if None, the placeholder class_time_estimates
+
+    Returns:
+    ----
+    times (dict) : preset -> (massless, massive) seconds
+    source (str) : where they come from, the machine of a measurement
+    """
+    if timings_file is None:
+        return class_time_estimates, "placeholder estimates, not measured"
+    with open(timings_file, "r") as f:
+        timings = json.load(f)
+    times = {preset: tuple(tt) for preset, tt in timings["times"].items()}
+    return times, "measured on {} ({})".format(timings["machine"], timings["date"])
+
+
+def precision_params(preset: str) -> dict:
+    """CLASS precision parameters of a preset, as a new dict"""
+    if preset not in class_presets:
+        raise ValueError("Unknown CLASS preset {}; choose from {}".format(
+            preset, list(class_presets)))
+    return dict(class_presets[preset])
+
+
+def neutrino_params(preset: str, nu_acc: float) -> dict:
+    """
+    Massive neutrino precision parameters of a preset.
+
+    Parameters:
+    ----
+    preset (str)   : name of the preset
+    nu_acc (float) : requested tol_ncdm_synchronous
+
+    Returns:
+    ----
+    CLASS parameters: tol_ncdm_*, l_max_ncdm, ncdm_fluid_approximation
+    """
+    if preset not in class_nu_presets:
+        raise ValueError("Unknown CLASS preset {}; choose from {}".format(
+            preset, list(class_nu_presets)))
+    nu_preset = class_nu_presets[preset]
+
+    #production: newtonian gauge tolerance never looser than 1e-5
+    tol_ncdm, tol_ncdm_newtonian = nu_acc, min(nu_acc, 1e-5)
+    if nu_preset["tol_ncdm_min"] is not None:
+        tol_ncdm = max(nu_acc, nu_preset["tol_ncdm_min"])
+        tol_ncdm_newtonian = tol_ncdm
+
+    return {
+        'tol_ncdm_newtonian'       : tol_ncdm_newtonian,
+        'tol_ncdm_synchronous'     : tol_ncdm,
+        'tol_ncdm_bg'              : 1e-10,
+        'l_max_ncdm'               : nu_preset["l_max_ncdm"],
+        'ncdm_fluid_approximation' : nu_preset["ncdm_fluid_approximation"],
+    }
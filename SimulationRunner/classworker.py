@@ -0,0 +1,214 @@
+"""
+A long-lived local CLASS worker.
+
+Every make_sim_sub.py call pays the python start up and the import of
+classylss before CLASS runs. The worker keeps classylss loaded and runs the
+CLASS jobs of SimulationICs.cambfile() sent to it over a UNIX socket, one
+at a time in the order they arrive; cambfile() delegates to it whenever one
+is running and computes locally otherwise.
+
+Start a worker on the node generating the simulations:
+----
+python -m SimulationRunner.classworker &
+python make_sub/make_sim_sub.py ...   # CLASS runs in the worker
+python -m SimulationRunner.classworker --stop
+
+The socket lives in a directory only the user can read, together with a
+random key the clients authenticate with. The address can be changed with
+$SIMRUNNER_CLASS_WORKER or --address.
+"""
+from typing import Any, List, Optional, Tuple
+import os
+import time
+import socket
+import argparse
+import datetime
+import traceback
+from multiprocessing.connection import Listener, Client, AuthenticationError
+import numpy as np
+
+default_address = "~/.cache/SimulationRunner/class_worker.sock"
+
+# the key file sits next to the socket
+keyfile_fn = lambda address: address + ".key"
+
+
+def worker_address(address: Optional[str] = None) -> str:
+    """The socket path: address, $SIMRUNNER_CLASS_WORKER or the default"""
+    if address is None:
+        address = os.environ.get("SIMRUNNER_CLASS_WORKER", default_address)
+    return os.path.realpath(os.path.expanduser(address))
+
+
+def class_version() -> str:
+    """Import the CLASS binding; the version of classylss"""
+    import classylss
+    import classylss.binding # pylint: disable=unused-import
+
+    return classylss.__version__
+
+
+def run_class(pre_params: dict) -> Any:
+    """Feed in the parameters and generate the powerspec object"""
+    import classylss.binding as CLASS
+
+    engine  = CLASS.ClassEngine(pre_params)
+    powspec = CLASS.Spectra(engine) # powerspec is an object
+
+    return powspec
+
+
+def extract_outputs(powspec: Any, zz: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Transfer functions and linear matter power at a redshift"""
+    trans = powspec.get_transfer(z=zz)
+
+    #fp-roundoff
+    trans['k'][-1] *= 0.9999
+    pk_lin = powspec.get_pklin(k=trans['k'], z=zz)
+
+    return trans, pk_lin
+
+
+def compute_outputs(pre_params: dict,
+        redshifts: List[float]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """(transfer, P_lin) at each redshift, from one CLASS run"""
+    powspec = run_class(pre_params)
+    return [extract_outputs(powspec, zz) for zz in redshifts]
+
+
+class ClassWorkerClient(object):
+    """
+    Send CLASS jobs to a running worker.
+
+    Parameters:
+    ----
+    address (str) : socket path of the worker
+    """
+
+    def __init__(self, address: Optional[str] = None) -> None:
+        # classylss version of the worker, known after the first compute
+        self.version: Optional[str] = None
+        self.address = worker_address(address)
+
+    def running(self) -> bool:
+        """Whether a worker is listening on the socket"""
+        if not (os.path.exists(self.address) and os.path.exists(keyfile_fn(self.address))):
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            # a stale socket from a worker which died
+            return False
+        finally:
+            sock.close()
+        return True
+
+    def _send(self, job: dict) -> dict:
+        with open(keyfile_fn(self.address), "rb") as f:
+            authkey = f.read()
+        with Client(self.address, family="AF_UNIX", authkey=authkey) as conn:
+            conn.send(job)
+            return conn.recv()
+
+    def compute(self, pre_params: dict,
+            redshifts: List[float]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Run CLASS in the worker; waits for the jobs queued before this one.
+
+        Returns:
+        ----
+        (transfer, P_lin) at each redshift, as compute_outputs
+        """
+        reply = self._send({"pre_params": pre_params,
+            "redshifts": [float(zz) for zz in redshifts]})
+        if "error" in reply:
+            raise RuntimeError("CLASS worker failed:\n" + reply["error"])
+        self.version = reply.get("version")
+        return reply["outputs"]
+
+    def stop(self) -> None:
+        """Shut the worker down after the jobs queued before this request"""
+        self._send({"stop": True})
+
+
+def find_worker(address: Optional[str] = None) -> Optional[ClassWorkerClient]:
+    """A client of the running worker, or None if there is none"""
+    client = ClassWorkerClient(address)
+    if client.running():
+        return client
+    return None
+
+
+def serve(address: Optional[str] = None) -> None:
+    """
+    Run the worker until a stop request. Jobs queue on the socket and are
+    run one at a time.
+    """
+    address = worker_address(address)
+    os.makedirs(os.path.dirname(address), mode=0o700, exist_ok=True)
+
+    if ClassWorkerClient(address).running():
+        raise RuntimeError("A CLASS worker is already running at " + address)
+    if os.path.exists(address):
+        os.remove(address)
+
+    # the import we are here to keep warm
+    version = class_version()
+
+    # clients authenticate with a random key only this user can read
+    authkey = os.urandom(32)
+    fd = os.open(keyfile_fn(address), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+
+    print("classworker: listening on", address, datetime.datetime.now())
+    try:
+        with Listener(address, family="AF_UNIX", backlog=64, authkey=authkey) as listener:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    # a bad key, or the liveness check of ClassWorkerClient.running
+                    continue
+
+                with conn:
+                    try:
+                        job = conn.recv()
+                    except (EOFError, OSError):
+                        continue
+                    if job.get("stop"):
+                        conn.send({"stopped": True})
+                        break
+
+                    start = time.time()
+                    try:
+                        reply = {"outputs": compute_outputs(job["pre_params"], job["redshifts"]),
+                            "version": version}
+                    except Exception:
+                        reply = {"error": traceback.format_exc()}
+                    print("classworker: job done in {:.1f}s{}".format(time.time() - start,
+                        ", FAILED" if "error" in reply else ""), datetime.datetime.now())
+
+                    try:
+                        conn.send(reply)
+                    except OSError:
+                        print("classworker: the client went away")
+    finally:
+        for fn in (address, keyfile_fn(address)):
+            if os.path.exists(fn):
+                os.remove(fn)
+        print("classworker: stopped", datetime.datetime.now())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", type=str, default=None,
+        help="socket path; default $SIMRUNNER_CLASS_WORKER or " + default_address)
+    parser.add_argument("--stop", action="store_true", help="stop the running worker")
+    args = parser.parse_args()
+
+    if args.stop:
+        ClassWorkerClient(args.address).stop()
+    else:
+        serve(args.address)
@@ -0,0 +1,280 @@
+"""
+The simrunner command line: one entry point for the everyday tasks.
+
+python -m SimulationRunner <command> [options]
+
+make     : build the simulation folders of a Latin hypercube (SimulationSuite)
+plan     : what make would cost, per fidelity; writes nothing
+status   : which simulations of a suite reached the final redshift
+resub    : resubmit the incomplete simulations (or IC generations)
+power    : check the power spectrum of generated ICs against CLASS
+validate : check the IC power spectra of a whole suite, into one summary
+hmf      : halo mass function of a FOF table (PIG folder)
+hdf5     : collect the power spectra of a suite into one HDF5 file
+
+Only this module and argparse are imported at start up. Each command
+imports what it needs when it runs, so e.g. status checks on a login node
+never load classylss, nbodykit, matplotlib or h5py.
+benchmarks/bench_import_time.py checks the start up time.
+"""
+from typing import List, Optional
+import argparse
+
+
+def add_suite_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options of simrunner make, also used by python -m SimulationRunner.suite"""
+    # load the json file with the cosmological parameters in this format
+    # { 'hubble' : [0.5, 0.6, 0.7], 'omega0' : [0.2, 0.15, 0.17], ... }
+    parser.add_argument("--json_file", type=str, required=True)
+    parser.add_argument("--points", type=str, default=None,
+        help="comma separated Latin indices; all if not given")
+
+    parser.add_argument("--gadget_dir", type=str, default="~/bigdata/MP-Gadget/")
+    parser.add_argument("--cluster_class", type=str, default="clusters.BIOClass")
+    parser.add_argument("--outdir_base", type=str, default="cosmo")
+    parser.add_argument("--python", type=str, default="python")
+
+    # keep a separated flags for boxsize and resolution
+    parser.add_argument("--box", type=int, default=256)
+    parser.add_argument("--npart", type=int, default=128)
+
+    # mpi settings of the simulations
+    parser.add_argument("--nproc", type=int, default=256)
+    parser.add_argument("--cores", type=int, default=32)
+    parser.add_argument("--mpi_ranks", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=16)
+
+    # settings of this run
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--omp_threads", type=int, default=1)
+    parser.add_argument("--class_cache", type=str, default=None)
+    parser.add_argument("--class_preset", type=str, default="production")
+    parser.add_argument("--nu_accuracy", type=float, default=None,
+        help="target P(k) accuracy to tune the CLASS neutrino tolerance for (production preset)")
+    parser.add_argument("--regenerate", action="store_true",
+        help="remake every file of existing folders, even if its inputs are unchanged")
+    parser.add_argument("--cost_model", action="store_true",
+        help="size the memory and walltime requests with SimulationRunner.costmodel")
+    parser.add_argument("--cost_calibration", type=str, default=None,
+        help="cost model calibration json")
+    parser.add_argument("--no_check_ics", action="store_true",
+        help="no IC power check in the IC jobs; run simrunner validate on the suite instead")
+
+
+def _make(args: argparse.Namespace) -> int:
+    from . import suite
+
+    return suite.main(args)
+
+
+def _plan(args: argparse.Namespace) -> int:
+    from . import suite
+
+    fidelities = [(args.box, args.npart)]
+    if args.fidelities is not None:
+        fidelities = [tuple(int(num) for num in fidelity.split(":"))
+            for fidelity in args.fidelities]
+
+    totals = [suite.suite_from_args(args, box, npart).plan(class_timings=args.class_timings)
+        for box, npart in fidelities]
+
+    print("Total: CLASS {:.2f} hours ({}); GenIC {:.1f} node-hours; Gadget {:.1f} node-hours; "
+        "disk {:.1f} GB".format(
+        sum(plan["total"]["class_hours"] for plan in totals), totals[0]["class_source"],
+        sum(plan["total"]["genic_node_hours"] for plan in totals),
+        sum(plan["total"]["gadget_node_hours"] for plan in totals),
+        sum(plan["total"][key] for plan in totals
+            for key in ("disk_ics", "disk_part", "disk_power")) / 1e9))
+    return 1 if any(plan["invalid"] for plan in totals) else 0
+
+
+def _status(args: argparse.Namespace) -> int:
+    from . import remake
+
+    if args.ics:
+        outputs, exists = remake.check_status_ics(args.rundir, icdir=args.icdir)
+        for oo, ee in zip(outputs, exists):
+            print(oo, " : ", "ICS DONE" if ee else "NO ICS")
+        return 0
+
+    remake.print_status(args.rundir, output_file=args.output_file, endz=args.endz)
+    return 0
+
+
+def _resub(args: argparse.Namespace) -> int:
+    from . import remake
+
+    if args.genic:
+        remake.resub_not_complete_genic(args.rundir, icdir=args.icdir,
+            resub_command=args.submit_command)
+        return 0
+
+    remake.resub_not_complete(args.rundir, output_file=args.output_file,
+        endz=args.endz, script_file=args.script_file,
+        resub_command=args.submit_command, restart=args.restart)
+    return 0
+
+
+def _power(args: argparse.Namespace) -> int:
+    from . import cambpower
+
+    try:
+        cambpower.check_ic_power_spectra(args.genicfile, camb_zstr=args.czstr,
+            outdir=args.outdir, accuracy=args.accuracy, m_nu=args.mnu,
+            method=args.method, memory_gb=args.memory_gb, subsample=args.subsample)
+    except RuntimeError as err:
+        print(err)
+        return 1
+    return 0
+
+
+def _validate(args: argparse.Namespace) -> int:
+    import glob
+    from . import icvalidation
+
+    submission_dirs = sorted(glob.glob(args.submission_dirs))
+    rows = icvalidation.validate_suite(submission_dirs, workers=args.workers,
+        omp_threads=args.omp_threads, accuracy=args.accuracy, plot=args.plot,
+        method=args.method, memory_gb=args.memory_gb, subsample=args.subsample)
+    icvalidation.write_summary(rows, args.output)
+
+    failed = sorted({row["submission_dir"] for row in rows if not row["passed"]})
+    print("{} of {} simulations failed; summary in {}".format(
+        len(failed), len(submission_dirs), args.output))
+    for submission_dir in failed:
+        print("FAILED:", submission_dir)
+    return 1 if failed else 0
+
+
+def _hmf(args: argparse.Namespace) -> int:
+    import sys
+    import numpy as np
+    from .hmffromfof import HMFFromFOF
+
+    bins = int(args.bins) if args.bins.isdigit() else args.bins
+    mass, dndm = HMFFromFOF(args.foftable, h0=args.h0, bins=bins)
+
+    units = "(h^4 M_sun/Mpc^3)" if args.h0 else "(M_sun/Mpc^3)"
+    np.savetxt(args.output if args.output is not None else sys.stdout,
+        np.column_stack([mass, dndm]), header="M (M_sun)  dn/dM " + units)
+    return 0
+
+
+def _hdf5(args: argparse.Namespace) -> int:
+    import glob
+    from .multi_sims import MultiPowerSpec
+
+    all_submission_dirs = sorted(glob.glob(args.submission_dirs))
+    if not all_submission_dirs:
+        print("No simulation folders match", args.submission_dirs)
+        return 1
+
+    multips = MultiPowerSpec(all_submission_dirs, Latin_json=args.json_file)
+    if args.update:
+        multips.update_hdf5(args.hdf5_name, workers=args.workers)
+    else:
+        multips.create_hdf5(args.hdf5_name, workers=args.workers, layout=args.layout,
+            compression=args.compression)
+    return 0
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """The simrunner parser, with one sub-parser per command"""
+    parser = argparse.ArgumentParser(prog="simrunner",
+        description="Generate, monitor and post-process MP-Gadget simulation suites.")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    # make: the options of python -m SimulationRunner.suite
+    make = commands.add_parser("make", help="build the simulation folders of a Latin hypercube")
+    add_suite_arguments(make)
+    make.set_defaults(func=_make)
+
+    plan = commands.add_parser("plan", help="validate a suite and predict its cost")
+    add_suite_arguments(plan)
+    plan.add_argument("--fidelities", type=str, nargs="+", default=None,
+        help="box:npart of each fidelity, e.g. 100:75 100:300; default --box:--npart")
+    plan.add_argument("--class_timings", type=str, default=None,
+        help="CLASS wall times saved by benchmarks/bench_class_presets.py --output; "
+        "placeholder estimates if not given")
+    plan.set_defaults(func=_plan)
+
+    status = commands.add_parser("status", help="completion status of a suite")
+    status.add_argument("rundir", type=str, help="parent folder of the simulations")
+    status.add_argument("--output_file", type=str, default="output")
+    status.add_argument("--endz", type=float, default=2.01)
+    status.add_argument("--ics", action="store_true", help="check the ICs instead")
+    status.add_argument("--icdir", type=str, default="ICS")
+    status.set_defaults(func=_status)
+
+    resub = commands.add_parser("resub", help="resubmit the incomplete simulations")
+    resub.add_argument("rundir", type=str, help="parent folder of the simulations")
+    resub.add_argument("--output_file", type=str, default="output")
+    resub.add_argument("--endz", type=float, default=2.01)
+    resub.add_argument("--script_file", type=str, default="mpi_submit")
+    resub.add_argument("--restart", type=int, default=1, help="MP-Gadget RestartFlag")
+    resub.add_argument("--submit_command", type=str, default=None,
+        help="sbatch or qsub; detected if not given")
+    resub.add_argument("--genic", action="store_true",
+        help="resubmit the failed IC generations instead")
+    resub.add_argument("--icdir", type=str, default="ICS")
+    resub.set_defaults(func=_resub)
+
+    power = commands.add_parser("power", help="check the IC power spectrum against CLASS")
+    power.add_argument("genicfile", type=str, help="File with generated ICs")
+    power.add_argument("--czstr", type=str, required=True,
+        help="Redshift string used in class files")
+    power.add_argument("--mnu", type=float, default=0, help="Sum of neutrino masses")
+    power.add_argument("--outdir", type=str, default=".")
+    power.add_argument("--accuracy", type=float, default=0.07)
+    power.add_argument("--method", type=str, default="auto", choices=["auto", "full", "folded"],
+        help="full: (2 npart)^3 mesh; folded: coarse and folded meshes within --memory_gb")
+    power.add_argument("--memory_gb", type=float, default=8., help="memory budget of the meshes and the painted particles")
+    power.add_argument("--subsample", type=float, default=1., help="fraction of particles to paint")
+    power.set_defaults(func=_power)
+
+    validate = commands.add_parser("validate",
+        help="check the IC power spectra of a suite against CLASS, into one summary")
+    validate.add_argument("submission_dirs", type=str,
+        help="glob of the simulation folders, e.g. 'cosmo_Box100_Part75_*'")
+    validate.add_argument("--output", type=str, default="ic_validation.csv",
+        help="summary table: CSV, or HDF5 if it ends in .hdf5 or .h5")
+    validate.add_argument("--workers", type=int, default=None)
+    validate.add_argument("--omp_threads", type=int, default=1)
+    validate.add_argument("--accuracy", type=float, default=0.07)
+    validate.add_argument("--plot", action="store_true", help="also write the ICS/PK-IC-*.pdf plots")
+    validate.add_argument("--method", type=str, default="auto", choices=["auto", "full", "folded"])
+    validate.add_argument("--memory_gb", type=float, default=8.,
+        help="memory budget of the meshes and the painted particles of each worker")
+    validate.add_argument("--subsample", type=float, default=1.)
+    validate.set_defaults(func=_validate)
+
+    hmf = commands.add_parser("hmf", help="halo mass function of a FOF table")
+    hmf.add_argument("foftable", type=str, help="PIG folder")
+    hmf.add_argument("--bins", type=str, default="auto",
+        help="number of bins or a numpy.histogram bin rule")
+    hmf.add_argument("--h0", action="store_true", help="dn/dM in h^4 M_sun/Mpc^3")
+    hmf.add_argument("--output", type=str, default=None, help="text file; stdout if not given")
+    hmf.set_defaults(func=_hmf)
+
+    hdf5 = commands.add_parser("hdf5", help="collect the power spectra of a suite into HDF5")
+    hdf5.add_argument("submission_dirs", type=str,
+        help="glob of the simulation folders, e.g. 'cosmo_Box100_Part75_*'")
+    hdf5.add_argument("--json_file", type=str, required=True, help="Latin hypercube json")
+    hdf5.add_argument("--hdf5_name", type=str, default="MultiPowerSpecs.hdf5")
+    hdf5.add_argument("--update", action="store_true",
+        help="only write the simulations new or changed since the file was made")
+    hdf5.add_argument("--workers", type=int, default=1, help="processes loading the simulations")
+    hdf5.add_argument("--layout", type=str, default="groups", choices=["groups", "columnar"],
+        help="a group per simulation, or one dataset per array with a row per simulation")
+    hdf5.add_argument("--compression", type=str, default=None, choices=["gzip", "lzf"],
+        help="compression of the columnar datasets")
+    hdf5.set_defaults(func=_hdf5)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run simrunner; returns the exit code"""
+    args = get_parser().parse_args(argv)
+    return args.func(args)
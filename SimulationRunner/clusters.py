@@ -6,6 +6,11 @@ from typing import List, Union, Any, TextIO
 import os.path
 import math
 import numpy as np
+from . import costmodel
+
+#MP-Gadget MaxMemSizePerNode, in MB, per GB asked from SLURM: 225000 MB of
+#a 230 GB request leaves the rest to MPI and the OS
+mb_per_requested_gb = 978.2608
 
 class ClusterClass:
     """
@@ -33,6 +38,10 @@ class ClusterClass:
 
         #Maximum memory available for an MPI task
         self.memory      = 1800
+        #Longest walltime the queue allows, in hours; None if unknown
+        self.max_timelimit: Union[float, int, None] = None
+        #Space for particles per rank over the mean
+        self.part_alloc_factor = 2.
         self.gadgetexe   = os.path.join( self.gadget_dir, 'gadget', gadget )
         self.gadgetparam = param
         self.genicexe    = os.path.join( self.gadget_dir, 'genic', genic   )
@@ -185,6 +194,49 @@ class ClusterClass:
         """Runtime options for cluster. Applied to both MP-GenIC and MP-Gadget."""
         return {}
 
+    def nodes(self) -> int:
+        """Number of nodes of a job"""
+        return math.ceil(self.nproc / self.cores)
+
+    def size_from_cost_model(self, model: costmodel.CostModel, box: float, npart: int,
+            redshift: float, redend: float, m_nu: float) -> dict:
+        """
+        Set the memory and walltime requests and PartAllocFactor to the
+        predictions of the cost model, instead of the defaults.
+
+        If the walltime is over max_timelimit, the request is max_timelimit
+        and a warning gives the resubmissions the run needs.
+
+        Returns:
+        ----
+        estimate (dict) : costmodel.CostModel.predict, and resubmissions,
+            the jobs after the first one at the timelimit
+        """
+        estimate = model.predict(box, npart, redshift, redend, m_nu,
+            nproc=self.nproc, mpi_ranks=self.mpi_ranks, nodes=self.nodes())
+
+        self.memory = self.memory_request(estimate)
+        self.part_alloc_factor = estimate["part_alloc_factor"]
+
+        #Whole quarter hours; MP-Gadget checkpoints before a shorter limit,
+        # and the run then needs resubmitting from the checkpoint
+        timelimit = math.ceil(estimate["walltime"] / 900) / 4
+        estimate["resubmissions"] = 0
+        if self.max_timelimit is not None and timelimit > self.max_timelimit:
+            estimate["resubmissions"] = math.ceil(timelimit / self.max_timelimit) - 1
+            print("Warning: the predicted walltime of {:.1f} h is over the {} h limit of {};"
+                " the run needs {} resubmission(s) from its checkpoints".format(
+                estimate["walltime"] / 3600, self.max_timelimit, self.cluster_name,
+                estimate["resubmissions"]))
+            timelimit = self.max_timelimit
+        self.timelimit = timelimit
+
+        return estimate
+
+    def memory_request(self, estimate: dict) -> int:
+        """self.memory for a cost model estimate: MB per processor"""
+        return math.ceil(estimate["memory_per_rank"] * estimate["mpi_ranks"] / estimate["nproc"])
+
     def cluster_config_options(self, config: str, prefix: str = "") -> None:
         """Config options that might be specific to a particular cluster"""
         _ = (config, prefix)
@@ -303,6 +355,9 @@ class BIOClass(ClusterClass):
             memory = np.min([memory, memory1])  # such that more than 8 jobs could be run simultaneously
         self.memory : int = memory
 
+        #The short partition
+        self.max_timelimit = 2
+
     def _queue_directive(self, name: Union[str, TextIO],
             timelimit: Union[float, int], nproc: int = 8, cores: int = 32, mpi_ranks: int = 8,
             prefix: str = "#SBATCH") -> str:
@@ -374,7 +429,12 @@ class BIOClass(ClusterClass):
         """Runtime options for cluster. Here memory."""
         # return {'MaxMemSizePerNode': 4 * 32 * 950}
         # return {'MaxMemSizePerNode': 24320} # usually works
-        return {'MaxMemSizePerNode': self.memory * 978.2608} # make it to be 225000 for memory=230
+        return {'MaxMemSizePerNode': self.memory * mb_per_requested_gb} # make it to be 225000 for memory=230
+
+    def memory_request(self, estimate: dict) -> int:
+        """self.memory for a cost model estimate: GB per node, the --mem of
+        SLURM, so that MaxMemSizePerNode covers the predicted peak"""
+        return math.ceil(estimate["memory_per_node"] / mb_per_requested_gb)
 
     def cluster_optimize(self) -> str:
         """Compiler optimisation options for a specific cluster.
@@ -510,6 +570,9 @@ class FronteraClass(ClusterClass):
             cluster_name=cluster_name, cores=cores, mpi_ranks=mpi_ranks, threads=threads, **kwargs)
         self.mpi_ranks = mpi_ranks 
 
+        #The normal queue
+        self.max_timelimit = 48
+
     def _queue_directive(self, name: Union[str, TextIO],
             timelimit: Union[float, int], nproc: int = 224, cores: int = 56, mpi_ranks: int = 14,
             prefix: str = "#SBATCH") -> str:
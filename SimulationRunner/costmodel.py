@@ -0,0 +1,283 @@
+"""
+Predict the peak memory and the wall time of an MP-Gadget DM-only run, so
+the submission files ask for what a simulation needs rather than a guess.
+
+The memory model is analytic: the particle and tree storage of each MPI
+rank, scaled by PartAllocFactor for the load imbalance, plus the PM mesh
+(Nmesh = 2 npart) shared between the ranks and a fixed per-rank overhead.
+The wall time is proportional to N log N per PM/tree step, to the number
+of steps, ln(a_end / a_start), and to a clustering factor growing with the
+mass resolution, divided by the cores with an imperfect parallel scaling.
+
+Both are scaled by factors calibrated from completed runs: the wall time
+from output/cpu.txt, the memory from measured peaks (e.g. sacct MaxRSS)
+when available. The requests add safety margins on top.
+
+Calibrate on a finished suite:
+----
+python -m SimulationRunner.costmodel 'cosmo_Box100_Part75_*' --output cost_calibration.json
+"""
+from typing import Dict, List, Optional, Tuple
+import os
+import re
+import glob
+import json
+import math
+import argparse
+import numpy as np
+
+# bytes per particle slot: MP-Gadget particle_data and the DM slots
+bytes_per_particle = 120
+# bytes of tree nodes per particle slot
+tree_bytes_per_particle = 80
+# bytes per PM mesh cell: the real and complex field and the FFT workspace
+bytes_per_mesh_cell = 24
+# fixed overhead per rank in MB: code, MPI buffers, neutrino tables
+rank_overhead_mb = 300.
+
+# core-seconds per unit of work, N log2(N) ln(a_end / a_start), before calibration
+core_seconds_per_work = 4e-4
+# speed up with the number of cores: cores**parallel_scaling
+parallel_scaling = 0.9
+# the massive neutrino linear response adds a little work at each PM step
+neutrino_cost = 0.1
+
+# MP-GenIC core-seconds per N log2(N): the 2LPT FFTs and writing the ICs
+genic_core_seconds_per_work = 1e-6
+
+# bytes per particle on disc: ICs (Position f8, Velocity f4, ID u8) and
+# PART snapshots (also Mass f4 and GroupID u4)
+ic_bytes_per_particle   = 44
+part_bytes_per_particle = 52
+# one powerspectrum-*.txt per PM step: about 40 bytes per k bin, with
+# Nmesh / 2 bins, and ~40 PM steps per e-fold of the scale factor
+power_bytes_per_bin = 40
+pm_steps_per_efold  = 40
+
+_cpu_regex = re.compile(
+    r"Step (\d+), Time: ([0-9.eE+-]+),? MPIs: (\d+),? Threads: (\d+),? Elapsed: ([0-9.eE+-]+)")
+
+
+def part_alloc_factor(mpi_ranks: int) -> float:
+    """
+    Space for particles per rank over the mean: the load imbalance grows
+    with the number of domains.
+    """
+    return float(np.clip(1.2 + 0.3 * math.log10(max(mpi_ranks, 1)), 1.3, 3.))
+
+
+def read_cpu_txt(filename: str) -> Tuple[float, float, int, int]:
+    """
+    The last step of an MP-Gadget cpu.txt.
+
+    Returns:
+    ----
+    time (float)    : scale factor reached
+    elapsed (float) : wall time of the run, in seconds
+    mpis (int)      : MPI ranks
+    threads (int)   : OpenMP threads per rank
+    """
+    last = None
+    with open(filename, "r") as f:
+        for line in f:
+            match = _cpu_regex.match(line.strip())
+            if match:
+                last = match
+    if last is None:
+        raise ValueError("No steps in " + filename)
+
+    return float(last.group(2)), float(last.group(5)), int(last.group(3)), int(last.group(4))
+
+
+def read_run(submission_dir: str, peak_memory_mb: Optional[float] = None) -> dict:
+    """
+    What a completed (or interrupted) simulation folder tells the cost model.
+
+    Parameters:
+    ----
+    submission_dir (str)   : folder made by SimulationICs, with output/cpu.txt*
+    peak_memory_mb (float) : measured peak memory per rank, if known
+
+    Returns:
+    ----
+    run (dict) : box, npart, redshift, a_reached, m_nu, mpi_ranks, threads,
+        walltime in seconds (summed over restarts) and peak_memory_mb
+    """
+    with open(os.path.join(submission_dir, "SimulationICs.json"), "r") as f:
+        param_dict = json.load(f)
+
+    # one cpu.txt per restart, each starting its elapsed time at zero
+    cpu_files = sorted(glob.glob(os.path.join(submission_dir, "output", "cpu.txt*")))
+    if not cpu_files:
+        raise ValueError("No cpu.txt in " + submission_dir)
+    steps = [read_cpu_txt(fn) for fn in cpu_files]
+
+    a_reached, _, mpis, threads = max(steps)
+    return {
+        "box"            : param_dict["box"],
+        "npart"          : param_dict["npart"],
+        "redshift"       : param_dict["redshift"],
+        "a_reached"      : a_reached,
+        "m_nu"           : param_dict["m_nu"],
+        "mpi_ranks"      : mpis,
+        "threads"        : threads,
+        "walltime"       : sum(step[1] for step in steps),
+        "peak_memory_mb" : peak_memory_mb,
+    }
+
+
+class CostModel(object):
+    """
+    Memory and wall time of an MP-Gadget run.
+
+    Parameters:
+    ----
+    wall_scale (float)    : calibration factor of the wall time
+    memory_scale (float)  : calibration factor of the memory
+    wall_safety (float)   : margin of the walltime requests
+    memory_safety (float) : margin of the memory requests
+    n_runs (int)          : number of runs the calibration used
+    """
+
+    def __init__(self, wall_scale: float = 1., memory_scale: float = 1.,
+            wall_safety: float = 1.5, memory_safety: float = 1.2, n_runs: int = 0) -> None:
+        self.wall_scale    = wall_scale
+        self.memory_scale  = memory_scale
+        self.wall_safety   = wall_safety
+        self.memory_safety = memory_safety
+        self.n_runs        = n_runs
+
+    @staticmethod
+    def _work(box: float, npart: int, a_start: float, a_end: float, m_nu: float) -> float:
+        """N log2 N per step, times the number of steps and the clustering"""
+        npart_total = float(npart)**3
+        # finer mass resolution resolves more nonlinear structure: more steps
+        clustering  = 1 + math.sqrt(npart / box)
+        return (npart_total * math.log2(npart_total) * math.log(a_end / a_start)
+            * clustering * (1 + neutrino_cost * (m_nu > 0)))
+
+    def memory_per_rank(self, npart: int, mpi_ranks: int,
+            alloc_factor: Optional[float] = None) -> float:
+        """Peak memory of one rank in MB, without the safety margin"""
+        if alloc_factor is None:
+            alloc_factor = part_alloc_factor(mpi_ranks)
+        npart_rank = float(npart)**3 / mpi_ranks * alloc_factor
+        nmesh      = 2 * npart
+
+        memory = (npart_rank * (bytes_per_particle + tree_bytes_per_particle)
+            + float(nmesh)**3 * bytes_per_mesh_cell / mpi_ranks) / 1024**2
+        return self.memory_scale * (memory + rank_overhead_mb)
+
+    def walltime(self, box: float, npart: int, redshift: float, redend: float,
+            m_nu: float, nproc: int) -> float:
+        """Wall time in seconds, without the safety margin"""
+        work = self._work(box, npart, 1 / (1 + redshift), 1 / (1 + redend), m_nu)
+        return self.wall_scale * core_seconds_per_work * work / nproc**parallel_scaling
+
+    def genic_walltime(self, npart: int, nproc: int) -> float:
+        """MP-GenIC wall time in seconds, without the safety margin"""
+        npart_total = float(npart)**3
+        return (self.wall_scale * genic_core_seconds_per_work
+            * npart_total * math.log2(npart_total) / nproc**parallel_scaling)
+
+    @staticmethod
+    def disk_usage(npart: int, redshift: float, redend: float,
+            n_snapshots: int) -> Dict[str, float]:
+        """
+        Bytes written by a run.
+
+        Returns:
+        ----
+        usage (dict) : ics, part (all the PART snapshots) and power (the
+            MP-Gadget power spectrum files)
+        """
+        npart_total = float(npart)**3
+        n_power = pm_steps_per_efold * math.log((1 + redshift) / (1 + redend))
+        return {
+            "ics"   : npart_total * ic_bytes_per_particle,
+            "part"  : npart_total * part_bytes_per_particle * n_snapshots,
+            "power" : n_power * npart * power_bytes_per_bin,
+        }
+
+    def predict(self, box: float, npart: int, redshift: float, redend: float,
+            m_nu: float, nproc: int, mpi_ranks: int, nodes: int) -> Dict[str, float]:
+        """
+        The requests of a run, safety margins included.
+
+        Parameters:
+        ----
+        nproc (int)     : cores of the job
+        mpi_ranks (int) : MPI ranks of the job
+        nodes (int)     : nodes of the job
+
+        Returns:
+        ----
+        estimate (dict) : memory_per_rank and memory_per_node (MB),
+            walltime (s), part_alloc_factor, and the inputs
+        """
+        alloc_factor    = part_alloc_factor(mpi_ranks)
+        memory_per_rank = self.memory_safety * self.memory_per_rank(npart, mpi_ranks, alloc_factor)
+        return {
+            "box"               : box,
+            "npart"             : npart,
+            "nproc"             : nproc,
+            "mpi_ranks"         : mpi_ranks,
+            "nodes"             : nodes,
+            "part_alloc_factor" : alloc_factor,
+            "memory_per_rank"   : memory_per_rank,
+            "memory_per_node"   : memory_per_rank * math.ceil(mpi_ranks / nodes),
+            "walltime"          : self.wall_safety * self.walltime(
+                box, npart, redshift, redend, m_nu, nproc),
+        }
+
+    def calibrate(self, runs: List[dict]) -> None:
+        """
+        Fit the scale factors to completed runs, as from read_run: the
+        geometric mean of measured over predicted.
+        """
+        assert len(runs) > 0
+        self.wall_scale, self.memory_scale = 1., 1.
+
+        wall_ratios = [run["walltime"] / self.walltime(run["box"], run["npart"],
+            run["redshift"], 1 / run["a_reached"] - 1, run["m_nu"],
+            run["mpi_ranks"] * run["threads"]) for run in runs]
+        memory_ratios = [run["peak_memory_mb"] / self.memory_per_rank(
+            run["npart"], run["mpi_ranks"]) for run in runs
+            if run.get("peak_memory_mb") is not None]
+
+        self.wall_scale = float(np.exp(np.mean(np.log(wall_ratios))))
+        if memory_ratios:
+            self.memory_scale = float(np.exp(np.mean(np.log(memory_ratios))))
+        self.n_runs = len(runs)
+
+    def save(self, filename: str) -> None:
+        """Write the calibration as json"""
+        with open(filename, "w") as f:
+            json.dump(self.__dict__, f, indent=2)
+
+    @classmethod
+    def load(cls, filename: str) -> "CostModel":
+        """Load a calibration written by save"""
+        with open(os.path.expanduser(filename), "r") as f:
+            return cls(**json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the cost model from completed runs")
+    parser.add_argument("submission_dirs", type=str,
+        help="glob of the simulation folders, e.g. 'cosmo_Box100_Part75_*'")
+    parser.add_argument("--output", type=str, default="cost_calibration.json")
+    args = parser.parse_args()
+
+    all_runs = []
+    for submission_dir in sorted(glob.glob(args.submission_dirs)):
+        try:
+            all_runs.append(read_run(submission_dir))
+        except (ValueError, OSError) as err:
+            print("Skipping", submission_dir, ":", err)
+
+    model = CostModel()
+    model.calibrate(all_runs)
+    model.save(args.output)
+    print("Calibrated on {} runs: wall time x {:.3f}, memory x {:.3f}".format(
+        model.n_runs, model.wall_scale, model.memory_scale))
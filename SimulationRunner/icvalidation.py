@@ -0,0 +1,152 @@
+"""
+Check the IC power spectra of a whole suite on one analysis node, with a
+pool of processes, and write a single summary table.
+
+The check_ics command at the end of each mpi_submit_one runs the serial
+cambpower.py check inside the MPI allocation of the IC job, and writes two
+PDFs per particle type. With SimulationICs(check_ics_in_job=False) the IC
+jobs skip it, and this module validates every ICS/ output afterwards.
+Plotting is off by default.
+
+Summary columns:
+----
+submission_dir, species (-1 if the check itself failed), max_error and
+n_failing (bins above the accuracy, in the checked k range), n_bins,
+passed, seconds (wall time of the whole simulation) and error (the
+exception message, if any).
+
+python -m SimulationRunner validate 'cosmo_Box100_Part75_*' --workers 8 --output ic_validation.csv
+"""
+from typing import List, Optional
+import os
+import csv
+import time
+import json
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from . import utils
+
+summary_columns = ["submission_dir", "species", "max_error", "n_failing", "n_bins",
+    "passed", "seconds", "error"]
+
+
+def genic_output(submission_dir: str) -> str:
+    """The IC file of a simulation folder, from its _genic_params.ini"""
+    import configobj
+
+    config = configobj.ConfigObj(os.path.join(submission_dir, "_genic_params.ini"))
+    return os.path.join(config["OutputDir"], config["FileBase"])
+
+
+def validate_simulation(submission_dir: str, accuracy: float = 0.07,
+        plot: bool = False, **kwargs) -> List[dict]:
+    """
+    Check the IC power spectra of one simulation folder against CLASS.
+
+    Parameters:
+    ----
+    submission_dir (str) : folder made by SimulationICs, with ICS/ generated
+    accuracy (float)     : tolerance of the fractional error
+    plot (bool)          : also write the ICS/PK-IC-*.pdf plots
+    **kwargs             : method, memory_gb or subsample of
+        cambpower.ic_power_errors
+
+    Returns:
+    ----
+    rows (list) : one summary row per particle type, or a single row with
+        species -1 and the error message if the check could not run
+    """
+    from . import cambpower
+
+    start = time.time()
+    try:
+        with open(os.path.join(submission_dir, "SimulationICs.json"), "r") as f:
+            params = json.load(f)
+        errors = cambpower.ic_power_errors(genic_output(submission_dir),
+            cambpower.class_zstr(params["redshift"]), outdir=submission_dir,
+            m_nu=params["m_nu"], plot=plot, **kwargs)
+    except Exception as err:
+        return [{"submission_dir": submission_dir, "species": -1, "max_error": np.nan,
+            "n_failing": 0, "n_bins": 0, "passed": False,
+            "seconds": time.time() - start, "error": repr(err)}]
+
+    rows = []
+    for species, error in sorted(errors.items()):
+        n_failing = int(np.sum(error > accuracy))
+        rows.append({"submission_dir": submission_dir, "species": species,
+            "max_error": float(np.max(error)), "n_failing": n_failing,
+            "n_bins": int(np.size(error)),
+            "passed": n_failing <= cambpower.max_failing_bins,
+            "seconds": time.time() - start, "error": ""})
+    return rows
+
+
+def validate_suite(submission_dirs: List[str], workers: Optional[int] = None,
+        omp_threads: int = 1, **kwargs) -> List[dict]:
+    """
+    Validate the ICs of many simulation folders with a pool of processes.
+    A failing folder does not stop the others.
+
+    Parameters:
+    ----
+    submission_dirs (list) : folders made by SimulationICs
+    workers (int)          : number of processes; defaults to the cores
+        available to this job.
+    omp_threads (int)      : OpenMP threads of each process
+    **kwargs               : passed to validate_simulation
+
+    Returns:
+    ----
+    rows (list) : the summary rows of all the folders, in the order given
+    """
+    if workers is None:
+        workers = utils.available_cores()
+    workers = max(1, min(workers, len(submission_dirs)))
+
+    print("validate_suite: checking {} simulations with {} workers,".format(
+        len(submission_dirs), workers), datetime.datetime.now())
+
+    results = {}
+    # keep each FFT from spreading over the whole node
+    with ProcessPoolExecutor(max_workers=workers, initializer=utils.limit_threads,
+            initargs=(omp_threads,)) as pool:
+        futures = {pool.submit(validate_simulation, submission_dir, **kwargs): submission_dir
+            for submission_dir in submission_dirs}
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            submission_dir = futures[future]
+            try:
+                results[submission_dir] = future.result()
+            except Exception as err:
+                # e.g. the worker was killed: BrokenProcessPool
+                results[submission_dir] = [{"submission_dir": submission_dir, "species": -1,
+                    "max_error": np.nan, "n_failing": 0, "n_bins": 0, "passed": False,
+                    "seconds": np.nan, "error": repr(err)}]
+            print("validate_suite: [{}/{}] {} {}".format(done, len(submission_dirs),
+                submission_dir, "passed" if all(row["passed"]
+                for row in results[submission_dir]) else "FAILED"))
+
+    return [row for submission_dir in submission_dirs for row in results[submission_dir]]
+
+
+def write_summary(rows: List[dict], filename: str) -> None:
+    """Write the summary rows as CSV, or as HDF5 (one dataset per column) if filename ends in .hdf5 or .h5"""
+    if filename.endswith((".hdf5", ".h5")):
+        import h5py
+
+        with h5py.File(filename, "w") as f:
+            for column in summary_columns:
+                values = [row[column] for row in rows]
+                if values and isinstance(values[0], str):
+                    f.create_dataset(column, data=np.array(values, dtype=h5py.string_dtype()))
+                else:
+                    f.create_dataset(column, data=np.array(values))
+        return
+
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=summary_columns)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,261 @@
+"""
+An interpolator of the linear matter power over cosmological parameters,
+built from the CLASS outputs already computed for a suite.
+
+For pre-flight validation and dry runs we do not need a CLASS run per Latin
+point. LinearPowerEmulator reads the camb_linear/ outputs and
+SimulationICs.json of existing simulation folders, compresses
+log P_lin(k, z) with a PCA, and interpolates the PCA coefficients with a
+radial basis function over the (normalised) parameters. Predictions take
+milliseconds; the error estimate is the leave-one-out error over the
+training simulations.
+
+Example:
+----
+emu = LinearPowerEmulator.from_simulation_dirs(glob.glob("cosmo_Box100_Part75_*"))
+kk, pk, err = emu.predict({"omega0": 0.3, "omegab": 0.05, ...}, redshift=0)
+emu.save("linear_emulator.npz")
+"""
+from typing import Dict, List, Optional, Tuple
+import os
+import json
+import numpy as np
+
+from . import classio
+
+# SimulationICs attributes which change the linear power
+default_parameter_names = ["omega0", "omegab", "hubble", "scalar_amp", "ns",
+    "w0_fld", "wa_fld", "m_nu", "N_ur", "alpha_s"]
+
+
+def tophat_sigma(kk: np.ndarray, pk: np.ndarray, radius: float = 8.) -> float:
+    """
+    rms fluctuation in spheres of radius (Mpc/h) from a linear power spectrum,
+    k in h/Mpc, P(k) in (Mpc/h)^3: sigma8 if radius = 8.
+    """
+    xx = kk * radius
+    window = 3 * (np.sin(xx) - xx * np.cos(xx)) / xx**3
+    # trapezoid rule in ln k
+    integrand = kk**3 * pk * window**2 / (2 * np.pi**2)
+    lnk = np.log(kk)
+    return float(np.sqrt(np.sum((integrand[1:] + integrand[:-1]) * np.diff(lnk) / 2)))
+
+
+def read_simulation(submission_dir: str) -> Tuple[dict, List[str], List[np.ndarray]]:
+    """
+    The parameters and the linear power of one simulation folder.
+
+    Returns:
+    ----
+    param_dict (dict) : SimulationICs.json
+    zstrs (list)      : redshift strings of the CLASS outputs
+    matterpows (list) : (k, P_lin) arrays, one per redshift
+    """
+    with open(os.path.join(submission_dir, "SimulationICs.json"), "r") as f:
+        param_dict = json.load(f)
+
+    camb_outdir = os.path.join(submission_dir, "camb_linear")
+    npzfile = classio.find_class_npz(camb_outdir)
+    if npzfile is not None:
+        class_output = classio.ClassOutput(npzfile)
+        zstrs = class_output.zstrs
+        return param_dict, zstrs, [class_output.matterpow(zstr) for zstr in zstrs]
+
+    # older folders: the text files only
+    prefix = "ics_matterpow_"
+    zstrs = sorted((fn[len(prefix):-len(".dat")] for fn in os.listdir(camb_outdir)
+        if fn.startswith(prefix)), key=float, reverse=True)
+    return param_dict, zstrs, [classio.load_matterpow(camb_outdir, zstr) for zstr in zstrs]
+
+
+class LinearPowerEmulator(object):
+    """
+    PCA + RBF interpolator of log P_lin(k, z) over cosmological parameters.
+
+    Parameters:
+    ----
+    params (array)        : training parameters, in shape (n simulations, n parameters)
+    parameter_names (list): names of the columns of params, as in SimulationICs
+    kk (array)            : k in h/Mpc, shared by all the training spectra
+    redshifts (array)     : redshifts of the training spectra
+    log_pk (array)        : log P_lin, in shape (n simulations, n redshifts, n k)
+    n_components (int)    : number of PCA components; by default enough to
+        keep all but 1e-10 of the variance.
+    kernel (str)          : scipy.interpolate.RBFInterpolator kernel
+    """
+
+    def __init__(self, params: np.ndarray, parameter_names: List[str],
+            kk: np.ndarray, redshifts: np.ndarray, log_pk: np.ndarray,
+            n_components: Optional[int] = None,
+            kernel: str = "thin_plate_spline") -> None:
+        self.params          = np.asarray(params, dtype=np.float64)
+        self.parameter_names = list(parameter_names)
+        self.kk              = np.asarray(kk)
+        self.redshifts       = np.asarray(redshifts, dtype=np.float64)
+        self.log_pk          = np.asarray(log_pk)
+        self.kernel          = kernel
+
+        n_sims = self.params.shape[0]
+        assert self.params.shape[1] == len(self.parameter_names)
+        assert self.log_pk.shape == (n_sims, len(self.redshifts), len(self.kk))
+        # the RBF has a linear polynomial term, and leave-one-out drops one
+        assert n_sims > self.params.shape[1] + 1, "need at least n parameters + 2 simulations"
+
+        # normalise the parameters to the unit cube of the training set
+        self.bounds = np.stack([self.params.min(axis=0), self.params.max(axis=0)], axis=1)
+        assert np.all(self.bounds[:, 1] > self.bounds[:, 0]), "a parameter does not vary"
+
+        self.n_components = n_components
+        self._fit(np.arange(n_sims))
+
+        # leave-one-out fractional error of P(k, z), (n simulations, n redshifts, n k)
+        self.loo_errors = self._leave_one_out()
+
+    def _normalise(self, params: np.ndarray) -> np.ndarray:
+        return (params - self.bounds[:, 0]) / (self.bounds[:, 1] - self.bounds[:, 0])
+
+    def _fit(self, train: np.ndarray) -> None:
+        """Fit the PCA and the RBF to the training simulations train"""
+        from scipy.interpolate import RBFInterpolator
+
+        yy = self.log_pk[train].reshape(len(train), -1)
+        self._mean = yy.mean(axis=0)
+        _, svals, vh = np.linalg.svd(yy - self._mean, full_matrices=False)
+
+        n_components = self.n_components
+        if n_components is None:
+            explained = np.cumsum(svals**2) / np.sum(svals**2)
+            n_components = int(np.searchsorted(explained, 1 - 1e-10) + 1)
+        n_components = min(n_components, len(svals))
+        self._basis = vh[:n_components]
+
+        coeffs = (yy - self._mean) @ self._basis.T
+        self._rbf = RBFInterpolator(self._normalise(self.params[train]), coeffs,
+            kernel=self.kernel)
+
+    def _predict_log_pk(self, params: np.ndarray) -> np.ndarray:
+        """log P_lin for rows of parameters, (n points, n redshifts, n k)"""
+        coeffs = self._rbf(self._normalise(np.atleast_2d(params)))
+        yy = self._mean + coeffs @ self._basis
+        return yy.reshape(-1, len(self.redshifts), len(self.kk))
+
+    def _leave_one_out(self) -> np.ndarray:
+        n_sims = self.params.shape[0]
+        errors = np.zeros_like(self.log_pk)
+        for i in range(n_sims):
+            self._fit(np.delete(np.arange(n_sims), i))
+            errors[i] = np.exp(self._predict_log_pk(self.params[i])[0] - self.log_pk[i]) - 1
+        # back to all the simulations
+        self._fit(np.arange(n_sims))
+        return errors
+
+    def _param_array(self, param_dict: Dict[str, float]) -> np.ndarray:
+        return np.array([param_dict[name] for name in self.parameter_names], dtype=np.float64)
+
+    def _z_index(self, redshift: float) -> int:
+        ii = int(np.argmin(np.abs(self.redshifts - redshift)))
+        if not np.isclose(self.redshifts[ii], redshift, rtol=1e-3, atol=1e-3):
+            raise ValueError("redshift {} is not one of the training redshifts {}".format(
+                redshift, self.redshifts))
+        return ii
+
+    def in_bounds(self, param_dict: Dict[str, float]) -> bool:
+        """Whether a point is inside the box spanned by the training set"""
+        params = self._param_array(param_dict)
+        return bool(np.all(params >= self.bounds[:, 0]) and np.all(params <= self.bounds[:, 1]))
+
+    def predict(self, param_dict: Dict[str, float],
+            redshift: float = 0.) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Linear matter power at a new point.
+
+        Parameters:
+        ----
+        param_dict (dict) : cosmological parameters, SimulationICs names
+        redshift (float)  : one of the training redshifts
+
+        Returns:
+        ----
+        kk (array)  : k in h/Mpc
+        pk (array)  : P_lin(k) in (Mpc/h)^3
+        err (array) : estimated fractional error of pk, the rms leave-one-out
+            error of the training set. Larger outside the training box.
+        """
+        ii = self._z_index(redshift)
+        log_pk = self._predict_log_pk(self._param_array(param_dict))[0, ii]
+        err = np.sqrt(np.mean(self.loo_errors[:, ii]**2, axis=0))
+        return self.kk, np.exp(log_pk), err
+
+    def sigma8(self, param_dict: Dict[str, float], redshift: float = 0.) -> Tuple[float, float]:
+        """
+        sigma8 at a new point and its estimated error, from the leave-one-out
+        sigma8 errors of the training set.
+        """
+        ii = self._z_index(redshift)
+        kk, pk, _ = self.predict(param_dict, redshift)
+
+        sigma8_err = [tophat_sigma(kk, np.exp(self.log_pk[j, ii]) * (1 + self.loo_errors[j, ii]))
+            / tophat_sigma(kk, np.exp(self.log_pk[j, ii])) - 1
+            for j in range(self.params.shape[0])]
+
+        sigma8 = tophat_sigma(kk, pk)
+        return sigma8, sigma8 * float(np.sqrt(np.mean(np.square(sigma8_err))))
+
+    @classmethod
+    def from_simulation_dirs(cls, all_submission_dirs: List[str],
+            parameter_names: Optional[List[str]] = None, nk: int = 200,
+            **kwargs) -> "LinearPowerEmulator":
+        """
+        Train on the camb_linear/ outputs of simulation folders.
+
+        Parameters:
+        ----
+        all_submission_dirs (list) : simulation folders made by SimulationICs
+        parameter_names (list)     : parameters to interpolate over; by default
+            the ones of default_parameter_names which vary in the folders.
+        nk (int)                   : number of k bins of the common k grid
+        **kwargs                   : passed to LinearPowerEmulator
+        """
+        sims = [read_simulation(submission_dir) for submission_dir in all_submission_dirs]
+
+        # the redshifts all the folders have
+        zstrs = [zstr for zstr in sims[0][1] if all(zstr in sim[1] for sim in sims)]
+        assert len(zstrs) > 0
+
+        # common log k grid, inside the k range of every folder
+        kmin = max(sim[2][0][0, 0] for sim in sims)
+        kmax = min(sim[2][0][-1, 0] for sim in sims)
+        kk = np.logspace(np.log10(kmin), np.log10(kmax), nk)
+
+        log_pk = np.zeros((len(sims), len(zstrs), nk))
+        for i, (_, sim_zstrs, matterpows) in enumerate(sims):
+            for j, zstr in enumerate(zstrs):
+                matterpow = matterpows[sim_zstrs.index(zstr)]
+                log_pk[i, j] = np.interp(np.log(kk), np.log(matterpow[:, 0]),
+                    np.log(matterpow[:, 1]))
+
+        if parameter_names is None:
+            parameter_names = [name for name in default_parameter_names
+                if all(name in sim[0] for sim in sims)
+                and len({sim[0][name] for sim in sims}) > 1]
+        params = np.array([[sim[0][name] for name in parameter_names] for sim in sims])
+
+        return cls(params, parameter_names, kk, [float(zstr) for zstr in zstrs], log_pk, **kwargs)
+
+    def save(self, filename: str) -> None:
+        """Save the training set; load refits, which takes well under a second"""
+        np.savez(filename, params=self.params,
+            parameter_names=np.array(self.parameter_names, dtype=str),
+            kk=self.kk, redshifts=self.redshifts, log_pk=self.log_pk,
+            n_components=-1 if self.n_components is None else self.n_components,
+            kernel=self.kernel)
+
+    @classmethod
+    def load(cls, filename: str) -> "LinearPowerEmulator":
+        """Load an emulator written by save"""
+        with np.load(filename, allow_pickle=False) as data:
+            n_components = int(data["n_components"])
+            return cls(data["params"], [str(name) for name in data["parameter_names"]],
+                data["kk"], data["redshifts"], data["log_pk"],
+                n_components=None if n_components < 0 else n_components,
+                kernel=str(data["kernel"]))
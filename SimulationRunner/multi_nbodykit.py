@@ -2,27 +2,128 @@
 Loading derived summary statistics from nbodykit
 from multiple simulations.
 """
-from SimulationRunner.multi_sims import MultiPowerSpec, PowerSpec
-from typing import Tuple, List, Optional, Generator
+from SimulationRunner.multi_sims import MultiPowerSpec, PowerSpec, load_in_order
+from SimulationRunner import fftpower
+from SimulationRunner import powercache
+from SimulationRunner import classio
+from typing import Dict, Tuple, List, Optional, Generator
 
 import os
+import glob
+import functools
 
 import numpy as np
 import h5py
-
-import nbodykit
-from nbodykit.lab import ArrayCatalog, FFTPower
 import bigfile
 
+# particles read at a time by the streaming reader: 96 MB of f8 positions
+default_chunk_size = 2**22
+
+# bytes per mesh cell while measuring a power spectrum: the f4 mesh, its
+# 1 + delta copy, the c8 half-complex transform and the scratch of the FFT
+mesh_bytes_per_cell = 16
+
+# bytes per particle of a chunk of f8 positions
+position_bytes = 24
+
+def _compensate_cic_aliasing(w, v):
+    """
+    CIC window compensation with the aliasing correction of Jing (2005),
+    as nbodykit applies to non-interlaced CIC meshes.
+    """
+    for i in range(3):
+        s = np.sin(0.5 * w[i])**2
+        v = v / (1 - 2. / 3 * s)**0.5
+    return v
+
+def paint_bigfile_chunks(column, Ng: int, boxsize: float, chunk_size: int = default_chunk_size,
+        unit: float = 0.001, compensated: bool = True, pm=None, fold: int = 1):
+    """
+    Paint a bigfile Position column onto a CIC mesh a chunk at a time, so the
+    peak memory is the mesh plus one chunk rather than all the particles.
+
+    Parameters:
+    ----
+    column     : bigfile column of positions, e.g. bigfile.File(path).open('1/Position')
+    Ng         : mesh cells per side
+    boxsize    : box size, in the units of the positions times unit
+    chunk_size : particles read at a time
+    unit       : conversion of the positions, applied in place on each chunk
+    pm         : a pmesh ParticleMesh of Ng cells and boxsize / fold to reuse
+    fold       : wrap the positions into a box of boxsize / fold
+
+    Returns:
+    ----
+    mesh (FieldMesh) : the 1 + delta field, CIC compensated if compensated
+    npart (int)      : number of particles painted
+    """
+    from pmesh.pm import ParticleMesh
+    from nbodykit.lab import FieldMesh
+
+    if pm is None:
+        pm = ParticleMesh(Nmesh=[Ng] * 3, BoxSize=boxsize / fold, dtype='f4')
+    real = pm.create(type='real', value=0)
+
+    # each rank reads its share of the chunks
+    comm = pm.comm
+    for start in range(comm.rank * chunk_size, column.size, comm.size * chunk_size):
+        pos = column[start:start + chunk_size]
+        pos *= unit
+        if fold > 1:
+            pos %= boxsize / fold
+        real.paint(pos, mass=1.0, resampler='cic', hold=True)
+
+    # normalise to 1 + delta
+    real.value[...] /= real.csum() / Ng**3
+
+    mesh = FieldMesh(real)
+    if compensated:
+        mesh = mesh.apply(_compensate_cic_aliasing, kind='circular', mode='complex')
+    return mesh, column.size
+
 def load_nbodykit_power(path: str, scale_factor: int, k_max = None,
         subtract_shotnoise: bool = True, times_kcubic: bool = False, compensated=True,
-        Ng=None,) -> Tuple[float, np.ndarray]:
+        Ng=None, chunk_size: Optional[int] = default_chunk_size,
+        engine: str = "nbodykit", mesh=None, cache: bool = False,
+        return_modes: bool = False, fold: int = 1) -> Tuple[np.ndarray, ...]:
     """
     Parameters:
     ----
     path: path to the PART folder
     scale_factor: for double checking
+    chunk_size: particles read and painted at a time (see paint_bigfile_chunks).
+        If None, read all the positions into an ArrayCatalog at once.
+    engine: "nbodykit", or "numpy" for SimulationRunner.fftpower, which
+        does not need nbodykit
+    mesh: to reuse over snapshots, of Ng cells and the box size: a
+        fftpower.Mesh (numpy engine; reset here) or a pmesh ParticleMesh
+        (nbodykit engine, streaming only)
+    cache: reuse the result saved next to the PART folder by an earlier
+        call with the same options, if the snapshot is unchanged (see powercache.py)
+    return_modes: also return the number of modes of each k bin
+    fold: wrap the positions into a box fold times smaller on each side,
+        so the mesh reaches fold times higher k. The folded box only has the
+        modes at multiples of fold times the fundamental mode, whose power,
+        and shot noise, are scaled back to the full box by fold^3. See
+        load_folded_power.
+
+    Returns:
+    ----
+    k0, ps (and modes): in all the bins of the FFT, NaN where there are no modes
     """
+    assert engine in ("nbodykit", "numpy")
+
+    if cache:
+        # chunk_size and mesh do not change the result
+        settings = {"scale_factor": scale_factor, "k_max": k_max,
+            "subtract_shotnoise": subtract_shotnoise, "times_kcubic": times_kcubic,
+            "compensated": compensated, "Ng": Ng, "engine": engine, "fold": fold}
+        k0, ps, modes = powercache.cached_power(path, settings, lambda: load_nbodykit_power(path,
+            scale_factor, k_max=k_max, subtract_shotnoise=subtract_shotnoise,
+            times_kcubic=times_kcubic, compensated=compensated, Ng=Ng,
+            chunk_size=chunk_size, engine=engine, mesh=mesh, return_modes=True, fold=fold))
+        return (k0, ps, modes) if return_modes else (k0, ps)
+
     bigf = bigfile.File(path)
 
     header = bigf.open("Header")
@@ -37,35 +138,211 @@ def load_nbodykit_power(path: str, scale_factor: int, k_max = None,
         Ng = header.attrs['TotNumPart'][1] ** (1/3)
         Ng = int(np.rint(Ng))
 
-    pid_ = bigf.open('1/ID')[:] - 1   # so that particle id starts from 0
-    pos_ = bigf.open('1/Position')[:]
-
-    f = ArrayCatalog({'Position': pos_ * 0.001})
+    # the box of the mesh, in Mpc/h
+    meshbox = boxsize * 0.001 / fold
 
     # compute until 2 times mean particle spacing if k_max not given
     if k_max == None:
-        k_mean_particle = 2 * np.pi / (boxsize * 0.001) * Ng 
+        k_mean_particle = 2 * np.pi / meshbox * Ng 
         k_max = 2 * k_mean_particle
 
     # compute the power spectrum
-    mesh = f.to_mesh(resampler='cic', Nmesh=Ng, position='Position', BoxSize=boxsize*0.001, compensated=compensated)
-    rr = FFTPower(mesh,mode='1d', kmax=k_max)
-    Pk = rr.power
+    if engine == "numpy":
+        if mesh is None:
+            mesh = fftpower.Mesh(Ng, meshbox, resampler='cic', compensated=compensated)
+        assert mesh.Nmesh == Ng and np.isclose(mesh.BoxSize, meshbox)
+        mesh.reset()
+        column = bigf.open('1/Position')
+        step = column.size if chunk_size is None else chunk_size
+        for start in range(0, column.size, step):
+            pos = column[start:start + step]
+            pos *= 0.001
+            if fold > 1:
+                pos %= meshbox
+            mesh.paint(pos)
+        Pk = mesh.power(kmax=k_max)
+        shotnoise = Pk['shotnoise']
+    elif chunk_size is None:
+        # nbodykit is slow to import: only load it to measure a power spectrum
+        from nbodykit.lab import ArrayCatalog, FFTPower
+
+        pos_ = bigf.open('1/Position')[:]
+        pos_ *= 0.001
+        if fold > 1:
+            pos_ %= meshbox
+        f = ArrayCatalog({'Position': pos_})
+        mesh = f.to_mesh(resampler='cic', Nmesh=Ng, position='Position', BoxSize=meshbox, compensated=compensated)
+        rr = FFTPower(mesh,mode='1d', kmax=k_max)
+        shotnoise = rr.power.attrs['shotnoise']
+        Pk = rr.power
+    else:
+        from nbodykit.lab import FFTPower
+
+        mesh, npart = paint_bigfile_chunks(bigf.open('1/Position'), Ng, boxsize*0.001,
+            chunk_size=chunk_size, compensated=compensated, pm=mesh, fold=fold)
+        rr = FFTPower(mesh,mode='1d', kmax=k_max)
+        # shot noise is volume / number
+        shotnoise = meshbox**3 / npart
+        Pk = rr.power
 
     k0 = Pk["k"]
 
-    # original power
-    ps = Pk['power'].real
+    # original power, of the full box: the folded box has 1/fold^3 of the volume
+    power = Pk['power'].real * fold**3
+    shotnoise = shotnoise * fold**3
+    ps = power
 
     if subtract_shotnoise:
-        ps = Pk['power'].real - Pk.attrs['shotnoise']
+        ps = power - shotnoise
     
     if times_kcubic:
-        ps = Pk['power'].real - Pk.attrs['shotnoise']
+        ps = power - shotnoise
         ps = ps*Pk['k']*Pk['k']*Pk['k']/(2*np.pi*np.pi)
     
+    if return_modes:
+        return k0, ps, np.asarray(Pk['modes'])
+    return k0, ps
+
+def folded_mesh_plan(k_max: float, boxsize: float, memory_gb: float,
+        max_Ng: Optional[int] = None, transition: float = 0.5,
+        max_folds: int = 2, chunk_size: int = default_chunk_size) -> Tuple[int, int, int]:
+    """
+    Mesh and folds of load_folded_power to reach k_max within a memory budget.
+
+    The mesh is the largest even one within memory_gb (at most max_Ng, and
+    no larger than needed to reach k_max unfolded). Each box of the sequence
+    L, L / fold, L / fold^2, ... is trusted up to transition times the
+    Nyquist frequency of the mesh in it; the fold is the smallest reaching
+    k_max within max_folds foldings.
+
+    Parameters:
+    ----
+    k_max : the highest k to measure, in h/Mpc
+    boxsize : box side L, in Mpc/h
+    memory_gb : memory for one mesh (see mesh_bytes_per_cell) and the
+        painting of a chunk of particles (see fftpower.paint_bytes)
+    max_Ng : the largest mesh to use
+    transition : fraction of the Nyquist frequency each box is trusted to
+    chunk_size : particles read and painted at a time
+
+    Returns:
+    ----
+    Ng : mesh cells per side
+    fold : ratio of the successive box sizes, 1 if no folding is needed
+    n_folds : number of folded boxes besides L
+    """
+    memory_bytes = lambda Ng: (Ng**3 * mesh_bytes_per_cell + chunk_size * position_bytes
+        + fftpower.paint_bytes(chunk_size, Ng))
+    Ng = int((max(memory_gb * 1024**3 - memory_bytes(0), 0) / mesh_bytes_per_cell)**(1. / 3)) // 2 * 2
+    while Ng > 0 and memory_bytes(Ng) > memory_gb * 1024**3:
+        Ng -= 2
+    if max_Ng is not None:
+        Ng = min(Ng, max_Ng)
+    # the smallest even mesh reaching k_max unfolded
+    Ng_needed = 2 * int(np.ceil(k_max * boxsize / (2 * np.pi * transition)))
+    Ng = min(Ng, Ng_needed)
+    if Ng < 16:
+        raise ValueError("memory_gb = " + str(memory_gb) + " is too small for a 16^3 mesh")
+
+    k_trusted = transition * np.pi * Ng / boxsize
+    ratio = k_max / k_trusted
+    if ratio <= 1:
+        return Ng, 1, 0
+
+    fold = max(2, int(np.ceil(ratio**(1. / max_folds) - 1e-9)))
+    n_folds = int(np.ceil(np.log(ratio) / np.log(fold) - 1e-9))
+    return Ng, fold, n_folds
+
+def load_folded_power(path: str, scale_factor: float, k_max: float, Ng: int, fold: int,
+        n_folds: int, transition: float = 0.5, **kwargs) -> Tuple[np.ndarray, ...]:
+    """
+    Power spectrum up to k_max on an Ng^3 mesh: measured in boxes of
+    L, L / fold, ..., L / fold^n_folds and stitched. Each box gives the bins
+    from the transition k of the previous box, transition times its
+    Nyquist frequency, to its own.
+
+    The shot noise of every box, scaled back to the full box, is the same
+    V / N, so subtract_shotnoise and times_kcubic apply to the stitched
+    spectrum as to an unfolded one. Folded boxes only have the modes at
+    multiples of their fundamental mode: the mode counts are those of the
+    folded boxes, and rebin_power weights them accordingly.
+
+    Parameters:
+    ----
+    path : path to the PART folder
+    k_max, Ng, fold, n_folds : as from folded_mesh_plan
+    **kwargs : the other options of load_nbodykit_power (not mesh or k_max)
+
+    Returns:
+    ----
+    k0, ps (and modes, if return_modes): the bins with modes, in k order
+    """
+    return_modes = kwargs.pop("return_modes", False)
+    with bigfile.File(path) as bigf:
+        boxsize = bigf.open("Header").attrs['BoxSize'][0] * 0.001
+
+    all_k0, all_ps, all_modes = [], [], []
+    k_low = -np.inf
+    for level in range(n_folds + 1):
+        box_fold = fold**level
+        # all the bins of the box: the k bins end below their k_max
+        k0, ps, modes = load_nbodykit_power(path, scale_factor, k_max=None, Ng=Ng,
+            return_modes=True, fold=box_fold, **kwargs)
+        # the last box goes to k_max
+        k_high = transition * np.pi * Ng * box_fold / boxsize if level < n_folds else np.inf
+        # NaN k, the empty bins, are dropped
+        ind = (k0 >= k_low) & (k0 < k_high) & (k0 <= k_max)
+        all_k0.append(k0[ind])
+        all_ps.append(ps[ind])
+        all_modes.append(modes[ind])
+        k_low = k_high
+
+    k0, ps, modes = np.concatenate(all_k0), np.concatenate(all_ps), np.concatenate(all_modes)
+    if return_modes:
+        return k0, ps, modes
     return k0, ps
 
+def rebin_power(k0: np.ndarray, ps: np.ndarray, modes: np.ndarray,
+        edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Mode weighted average of fine-binned power spectra in coarser k bins,
+    vectorized over any leading axes (e.g. simulations and redshifts).
+
+    Parameters:
+    ----
+    k0 : (..., n_k) mean k of the fine bins; NaN in empty bins
+    ps : (..., n_k) power in the fine bins
+    modes : (..., n_k) number of modes of the fine bins
+    edges : (n_bins + 1, ) edges of the new bins. A fine bin goes in the new
+        bin of its mean k: edges[i] <= k0 < edges[i + 1].
+
+    Returns:
+    ----
+    k, ps, modes : (..., n_bins) mode weighted mean k and power and the mode
+        counts; NaN where a new bin has no modes
+    """
+    k0, ps, modes = np.broadcast_arrays(np.asarray(k0, dtype=np.float64),
+        np.asarray(ps, dtype=np.float64), np.asarray(modes, dtype=np.float64))
+    edges = np.asarray(edges)
+    nbins = len(edges) - 1
+    lead = ps.shape[:-1]
+    nrows = int(np.prod(lead))
+
+    # new bin of every fine bin; NaN k go past the last edge
+    bins = np.digitize(k0, edges) - 1
+    valid = (bins >= 0) & (bins < nbins) & (modes > 0) & np.isfinite(ps)
+    rows = np.broadcast_to(np.arange(nrows).reshape(lead + (1,)), ps.shape)
+    index = (rows * nbins + bins)[valid]
+
+    weights = modes[valid]
+    nsum = np.bincount(index, weights=weights, minlength=nrows * nbins)
+    ksum = np.bincount(index, weights=weights * k0[valid], minlength=nrows * nbins)
+    psum = np.bincount(index, weights=weights * ps[valid], minlength=nrows * nbins)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shape = lead + (nbins,)
+        return (ksum / nsum).reshape(shape), (psum / nsum).reshape(shape), nsum.reshape(shape)
+
 class NbodyKitPowerSpec(PowerSpec):
 
     """
@@ -79,17 +356,23 @@ class NbodyKitPowerSpec(PowerSpec):
 
     def __init__(self, 
         submission_dir: str = "test/", srgan: bool = False, z0 : float = 0.0, Ng: int = 512, kmax: float =16.10,
-        srgan_path: str = "super-resl/output/PART_008/powerspec_shotnoise.txt.npy") -> None:
+        srgan_path: str = "super-resl/output/PART_008/powerspec_shotnoise.txt.npy",
+        engine: str = "nbodykit", cache: bool = True, memory_gb: Optional[float] = None) -> None:
         super(PowerSpec, self).__init__(submission_dir)
 
         # read into arrays
-        # Matter power specs from simulations
-        k0, ps = self.read_powerspec(z0=z0, Ng=Ng, kmax=kmax)
+        # Matter power specs from simulations, in all the bins of the FFT
+        k0, ps, modes = self.read_fine_powerspecs([z0], Ng=Ng, engine=engine, cache=cache,
+            memory_gb=memory_gb, kmax=kmax)
+        self._fine_k0 = k0
+        self._fine_powerspecs = ps[0]
+        self._fine_modes = modes
 
         self._scale_factors = np.array([1 / (1 + z0)])
 
+        k0, ps = self.cut_powerspecs(k0, ps, kmax)
         self._k0 = k0
-        self._powerspecs = ps
+        self._powerspecs = ps[0]
 
         # Matter power specs from CAMB linear theory code
         redshifts, out = self.read_camblinear(self.camb_files)
@@ -119,6 +402,33 @@ class NbodyKitPowerSpec(PowerSpec):
         """
         return self._k0
 
+    @property
+    def fine_k0(self) -> np.ndarray:
+        """
+        Mean k of every bin of the FFT, before the kmax cut; NaN in empty bins.
+        """
+        return self._fine_k0
+
+    @property
+    def fine_powerspecs(self) -> np.ndarray:
+        """
+        P(k) in every bin of the FFT, before the kmax cut. The same length as fine_k0.
+        """
+        return self._fine_powerspecs
+
+    @property
+    def fine_modes(self) -> np.ndarray:
+        """
+        Number of modes in every bin of the FFT. The same length as fine_k0.
+        """
+        return self._fine_modes
+
+    def rebin(self, edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        P(k) in coarser k bins, from the fine bins: see rebin_power.
+        """
+        return rebin_power(self.fine_k0, self.fine_powerspecs, self.fine_modes, edges)
+
     @property
     def powerspecs_srgan(self) -> np.ndarray:
         """
@@ -133,7 +443,9 @@ class NbodyKitPowerSpec(PowerSpec):
         """
         return self._k0_sr
 
-    def read_powerspec(self, z0: float, Ng: int, kmax: float) -> Tuple[np.ndarray, np.ndarray]:
+    def read_powerspec(self, z0: float, Ng: int, kmax: float,
+            engine: str = "nbodykit", cache: bool = True,
+            memory_gb: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
         """
         Read power spectrum from a PART/ folder
 
@@ -141,7 +453,119 @@ class NbodyKitPowerSpec(PowerSpec):
         ----
         z0 : the redshift of the power spectrum you want to load.
         Ng : the number of particle per side you want to compute for the power spectrum.
+        engine : "nbodykit" or "numpy", see load_nbodykit_power.
+        cache : reuse the spectra saved next to the PART folders, see powercache.py.
+        memory_gb : see read_fine_powerspecs.
+        """
+        k0, ps = self.read_powerspecs([z0], Ng=Ng, kmax=kmax, engine=engine, cache=cache,
+            memory_gb=memory_gb)
+        return k0, ps[0]
+
+    def read_powerspecs(self, z_list: List[float], Ng: int, kmax: float,
+            engine: str = "nbodykit", cache: bool = True,
+            memory_gb: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Read the power spectra of several redshifts from the PART/ folders,
+        reusing one mesh (and, with the numpy engine, the k bin of every mode).
+
+        Parameters:
+        ----
+        z_list : the redshifts of the power spectra you want to load.
+        Ng : the number of particle per side you want to compute for the power spectrum.
+        engine : "nbodykit" or "numpy", see load_nbodykit_power.
+        cache : reuse the spectra saved next to the PART folders, see powercache.py.
+        memory_gb : see read_fine_powerspecs.
+
+        Returns:
+        ----
+        k0 : (n_k, ) k bins, shared by all the redshifts
+        ps : (n_z, n_k) power spectra, in the order of z_list
+        """
+        k0, ps, _ = self.read_fine_powerspecs(z_list, Ng=Ng, engine=engine, cache=cache,
+            memory_gb=memory_gb, kmax=kmax)
+        return self.cut_powerspecs(k0, ps, kmax)
+
+    @staticmethod
+    def cut_powerspecs(k0: np.ndarray, ps: np.ndarray, kmax: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Keep the bins of k0 and of the last axis of ps with modes,
+        0 < k <= kmax.
+        """
+        # filter out NaN values
+        ind = ~np.isnan(k0)
+        assert np.all(ind == np.all(~np.isnan(ps), axis=0))
+
+        # set the kmax
+        ind = ind & (k0 <= kmax)
+        # remove k = 0 since no power there
+        ind = ind & (k0 != 0.0)
+
+        return k0[ind], ps[:, ind]
+
+    def read_fine_powerspecs(self, z_list: List[float], Ng: int, engine: str = "nbodykit",
+            cache: bool = True, memory_gb: Optional[float] = None,
+            kmax: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        As read_powerspecs, in all the bins of the FFT, with their mode counts.
+
+        Parameters:
+        ----
+        memory_gb : if given, reach kmax with the folded estimator, on a mesh
+            of at most Ng^3 cells within memory_gb (see folded_mesh_plan and
+            load_folded_power), rather than on the Ng^3 mesh alone.
+        kmax : the k to reach with the folded estimator.
+
+        Returns:
+        ----
+        k0 : (n_k, ) mean k of the bins, NaN in empty bins
+        ps : (n_z, n_k) power spectra, in the order of z_list
+        modes : (n_k, ) number of modes of the bins
         """
+        boxsize = self.param_dict["box"]
+        if memory_gb is not None:
+            Ng_fold, fold, n_folds = folded_mesh_plan(kmax, boxsize, memory_gb, max_Ng=Ng)
+            print("Folded power: {}^3 mesh, boxes of {} Mpc/h / {}^0..{}".format(
+                Ng_fold, boxsize, fold, n_folds))
+
+            # one mesh per box, so none is kept between the redshifts
+            all_k0, all_ps = [], []
+            for z0 in z_list:
+                scale_factor, powerspec_path = self._snapshot_path(z0)
+                k0, ps, modes = load_folded_power(powerspec_path, scale_factor, k_max=kmax,
+                    Ng=Ng_fold, fold=fold, n_folds=n_folds, subtract_shotnoise=False,
+                    times_kcubic=False, compensated=True, engine=engine, cache=cache,
+                    return_modes=True)
+                all_k0.append(k0)
+                all_ps.append(ps)
+            k0 = all_k0[0]
+            assert all(np.array_equal(kk, k0) for kk in all_k0)
+            return k0, np.array(all_ps), modes
+
+        mesh = None
+        if engine == "numpy":
+            mesh = fftpower.Mesh(Ng, boxsize, resampler='cic', compensated=True)
+        else:
+            from pmesh.pm import ParticleMesh
+            mesh = ParticleMesh(Nmesh=[Ng] * 3, BoxSize=boxsize, dtype='f4')
+
+        all_k0, all_ps = [], []
+        for z0 in z_list:
+            scale_factor, powerspec_path = self._snapshot_path(z0)
+
+            # the maximum k is controlled by Ng
+            k0, ps, modes = load_nbodykit_power(
+                powerspec_path, scale_factor=scale_factor, k_max=None, subtract_shotnoise=False, times_kcubic=False, compensated=True, Ng=Ng,
+                engine=engine, mesh=mesh, cache=cache, return_modes=True)
+            all_k0.append(k0)
+            all_ps.append(ps)
+
+        # same mesh: same k bins
+        k0 = all_k0[0]
+        assert all(np.array_equal(kk, k0, equal_nan=True) for kk in all_k0)
+        return k0, np.array(all_ps), modes
+
+    def _snapshot_path(self, z0: float) -> Tuple[float, str]:
+        """The scale factor of z0 and the PART folder of the snapshot at it"""
         tol = 1e-4 # tolerance
         # the scale factor you condition on
         scale_factor = 1 / (1 + z0)
@@ -162,24 +586,7 @@ class NbodyKitPowerSpec(PowerSpec):
         powerspec_path = os.path.join(
             self.submission_dir, "output", "PART_{:03d}".format(number)
         )
-
-        # the maximum k is controlled by Ng
-        k0, ps = load_nbodykit_power(
-            powerspec_path, scale_factor=scale_factor, k_max=None, subtract_shotnoise=False, times_kcubic=False, compensated=True, Ng=Ng)
-
-        # filter out NaN values
-        ind = ~np.isnan(k0)
-        assert np.all(ind == ~np.isnan(ps))
-
-        # set the kmax
-        ind = ind & (k0 <= kmax)
-        # remove k = 0 since no power there
-        ind = ind & (k0 != 0.0)
-
-        k0 = k0[ind]
-        ps = ps[ind]
-
-        return k0, ps
+        return scale_factor, powerspec_path
 
 
     def read_srgan_powerspec(self, srgan_path: str, kmax: float, ) -> Tuple[np.ndarray, np.ndarray]:
@@ -222,7 +629,8 @@ class MultiNbodyKitPowerSpec(MultiPowerSpec):
     """
     def __init__(self, all_submission_dirs: List[str], Latin_json: str, selected_ind: Optional[np.ndarray],
         srgan: bool = False, z0 : float = 0.0, Ng: int = 512, kmax: float =16.10,
-        srgan_path: str = "super-resl/output/PART_008/powerspec_shotnoise.txt.npy") -> None:
+        srgan_path: str = "super-resl/output/PART_008/powerspec_shotnoise.txt.npy",
+        engine: str = "nbodykit", cache: bool = True, memory_gb: Optional[float] = None) -> None:
         super().__init__(all_submission_dirs, Latin_json=Latin_json, selected_ind=selected_ind)
 
         # assign attrs for loading Nbodykit power specs
@@ -231,59 +639,89 @@ class MultiNbodyKitPowerSpec(MultiPowerSpec):
         self.Ng = Ng
         self.srgan_path = srgan_path
         self.kmax = kmax
-
-
-    def create_hdf5(self, hdf5_name: str = "MutliPowerSpecs.hdf5") -> None:
-        """
-        - Create a HDF5 file for powerspecs from multiple simulations.
-        - Each simulation stored in subgroup, includeing powerspecs and
-        camb linear power specs.
-        - Each subgroup has their own simulation parameters extracted from
-        SimulationICs.json to reproduce this simulation.
-        - Parameters from Latin HyperCube sampling stored in upper group level,
-        the order of the sampling is the same as the order of simulations.
-
-        TODO: add a method to append new simulations to a created hdf5.
-        """
-        # open a hdf5 file to store simulations
-        with h5py.File(hdf5_name, "w") as f:
-            # store the sampling from Latin Hyper cube dict into datasets:
-            # since the sampling size should be arbitrary, we should use
-            # datasets instead of attrs to stores these sampling arrays
-            for key, val in self.Latin_dict.items():
-                f.create_dataset(key, data=val)
-
-            # using generator to iterate through simulations,
-            # PowerSpec stores big arrays so we don't want to load
-            # everything to memory
-            for i, ps in enumerate(self.load_PowerSpecs(self.all_submission_dirs, srgan=self.srgan, z0=self.z0, Ng=self.Ng, kmax=self.kmax, srgan_path=self.srgan_path)):
-                sim = f.create_group("simulation_{}".format(i))
-
-                # store arrays to sim subgroup
-                # Simulation Power spectra:
-                sim.create_dataset("scale_factors", data=np.array(ps.scale_factors))
-                sim.create_dataset("powerspecs", data=ps.powerspecs)
-                sim.create_dataset("k0", data=ps.k0)
-                # SRGAN power spectra:
-                if self.srgan:
-                    sim.create_dataset("powerspecs_srgan", data=ps.powerspecs_srgan)
-                    sim.create_dataset("k0_sr", data=ps.k0_sr)
-
-                sim.create_dataset("camb_redshifts", data=np.array(ps.camb_redshifts))
-                sim.create_dataset("camb_matters", data=ps.camb_matters)
-
-                # stores param json to metadata attrs
-                for key, val in ps.param_dict.items():
-                    sim.attrs[key] = val
+        self.engine = engine
+        self.cache = cache
+        self.memory_gb = memory_gb
+
+
+    def _write_datasets(self, sim, ps: NbodyKitPowerSpec) -> None:
+        """Store the arrays of a NbodyKitPowerSpec to its sim subgroup"""
+        super()._write_datasets(sim, ps)
+
+        sim.create_dataset("k0", data=ps.k0)
+        # all the bins of the FFT, to rebin later: see HDF5Holder.rebin
+        sim.create_dataset("fine_k0", data=ps.fine_k0)
+        sim.create_dataset("fine_powerspecs", data=ps.fine_powerspecs)
+        sim.create_dataset("fine_modes", data=ps.fine_modes)
+        # SRGAN power spectra:
+        if self.srgan:
+            sim.create_dataset("powerspecs_srgan", data=ps.powerspecs_srgan)
+            sim.create_dataset("k0_sr", data=ps.k0_sr)
+
+    _redshift_columns = ("powerspecs", "fine_powerspecs", "powerspecs_srgan")
+
+    def scale_factors_of(self, submission_dir: str) -> np.ndarray:
+        """The scale factor of z0, the only one measured"""
+        return np.array([1 / (1 + self.z0)])
+
+    def _columns(self, ps: NbodyKitPowerSpec) -> Dict[str, np.ndarray]:
+        """The arrays of a NbodyKitPowerSpec in the columnar layout: powerspecs (n_sim, 1, n_k), of z0"""
+        columns = {
+            "powerspecs"      : ps.powerspecs[np.newaxis],
+            "fine_powerspecs" : ps.fine_powerspecs[np.newaxis],
+            "camb_redshifts"  : np.array(ps.camb_redshifts),
+            "camb_matters"    : ps.camb_matters,
+        }
+        if self.srgan:
+            columns["powerspecs_srgan"] = ps.powerspecs_srgan[np.newaxis]
+        return columns
+
+    def _shared(self, ps: NbodyKitPowerSpec) -> Dict[str, np.ndarray]:
+        """The k bins, the same for every simulation of a catalogue"""
+        shared = {
+            "k0"            : ps.k0,
+            "fine_k0"       : ps.fine_k0,
+            "fine_modes"    : ps.fine_modes,
+        }
+        if self.srgan:
+            shared["k0_sr"] = ps.k0_sr
+        return shared
+
+    def fingerprint_files(self, submission_dir: str) -> List[str]:
+        """The files a simulation is loaded from: the PART snapshots rather than the MP-Gadget power spectra"""
+        output = os.path.join(submission_dir, "output")
+        files = ([os.path.join(submission_dir, "SimulationICs.json"), os.path.join(output, "Snapshots.txt")]
+            + sorted(glob.glob(os.path.join(submission_dir, "camb_linear", "ics_matterpow_*.dat")))
+            + sorted(glob.glob(os.path.join(submission_dir, "camb_linear", classio.class_npz)))
+            + sorted(glob.glob(os.path.join(output, "PART_*", "Header", "*")))
+            + sorted(glob.glob(os.path.join(output, "PART_*", "1", "Position", "*"))))
+        if self.srgan:
+            files.append(os.path.join(submission_dir, self.srgan_path))
+        return files
+
+    def load_settings(self) -> dict:
+        """The options of load_PowerSpecs which change the arrays written"""
+        return {"srgan": self.srgan, "z0": self.z0, "Ng": self.Ng, "kmax": self.kmax,
+            "srgan_path": self.srgan_path, "engine": self.engine, "memory_gb": self.memory_gb}
+
+    def _load_PowerSpecs(self, all_submission_dirs: List[str], workers: int = 1,
+            queue_depth: Optional[int] = None) -> Generator:
+        """load_PowerSpecs with the settings of this catalogue"""
+        return self.load_PowerSpecs(all_submission_dirs, srgan=self.srgan, z0=self.z0, Ng=self.Ng,
+            kmax=self.kmax, srgan_path=self.srgan_path, engine=self.engine, cache=self.cache,
+            memory_gb=self.memory_gb, workers=workers, queue_depth=queue_depth)
 
     @staticmethod
     def load_PowerSpecs(all_submission_dirs: List[str], srgan: bool, z0 : float, Ng: int, kmax: float,
-            srgan_path: str) -> Generator:
+            srgan_path: str, engine: str = "nbodykit", cache: bool = True,
+            memory_gb: Optional[float] = None, workers: int = 1,
+            queue_depth: Optional[int] = None) -> Generator:
         """
         Iteratively load the PowerSpec class
         """
-        for submission_dir in all_submission_dirs:
-            yield NbodyKitPowerSpec(submission_dir, srgan=srgan, z0=z0, Ng=Ng, kmax=kmax, srgan_path=srgan_path)
+        load = functools.partial(NbodyKitPowerSpec, srgan=srgan, z0=z0, Ng=Ng, kmax=kmax,
+            srgan_path=srgan_path, engine=engine, cache=cache, memory_gb=memory_gb)
+        return load_in_order(load, all_submission_dirs, workers=workers, queue_depth=queue_depth)
 
 class HDF5Holder(h5py.File):
     """
@@ -298,6 +736,60 @@ class HDF5Holder(h5py.File):
         self.saved_filename = saved_filename
         self._mode = mode
 
+    @property
+    def layout(self) -> int:
+        """1: a group per simulation; 2: the columnar layout of create_hdf5(layout="columnar")"""
+        return int(self.attrs.get("layout", 1))
+
+    @property
+    def num_simulations(self) -> int:
+        """Number of simulations, in either layout"""
+        if self.layout == 2:
+            return self["params"].shape[0]
+        return sum(1 for name in self.keys() if name.startswith("simulation_"))
+
+    def simulation_arrays(self, name: str) -> np.ndarray:
+        """
+        A dataset of all the simulations, (number of simulations, ...): in
+        the columnar layout one read; powerspecs and fine_powerspecs have a
+        redshift axis there, (number of simulations, 1, number of k).
+        """
+        if self.layout == 2:
+            return self[name][()]
+        return np.stack([self["simulation_{}".format(i)][name][()] for i in range(self.num_simulations)])
+
+    def rebin(self, edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The power spectra of all the simulations in new k bins, from the fine
+        bins stored by MultiNbodyKitPowerSpec.create_hdf5: see rebin_power.
+
+        Returns:
+        ----
+        k, ps, modes : (number of simulations, number of bins)
+        """
+        if self.layout == 2:
+            if "fine_k0" not in self:
+                raise KeyError("no fine bins in " + self.filename + ": remake it with create_hdf5")
+            return rebin_power(self["fine_k0"][()], self["fine_powerspecs"][:, 0, :],
+                self["fine_modes"][()], edges)
+
+        names = sorted((name for name in self.keys() if name.startswith("simulation_")),
+            key=lambda name: int(name.split("_")[-1]))
+        if not all("fine_k0" in self[name] for name in names):
+            raise KeyError("no fine bins in " + self.filename + ": remake it with create_hdf5")
+
+        # pad to the longest, with empty bins
+        n_k = max(self[name]["fine_k0"].shape[0] for name in names)
+        k0 = np.full((len(names), n_k), np.nan)
+        ps = np.full((len(names), n_k), np.nan)
+        modes = np.zeros((len(names), n_k))
+        for i, name in enumerate(names):
+            n = self[name]["fine_k0"].shape[0]
+            k0[i, :n] = self[name]["fine_k0"][()]
+            ps[i, :n] = self[name]["fine_powerspecs"][()]
+            modes[i, :n] = self[name]["fine_modes"][()]
+        return rebin_power(k0, ps, modes, edges)
+
     def interpolate(self, ks: np.ndarray):
         """
         interpolate the log P(k) based on a given ks 
@@ -323,7 +815,12 @@ class HDF5Holder(h5py.File):
         num_simulations, _ = X.shape
 
         # prepare output power spectra
-        if srgan_output: 
+        if self.layout == 2:
+            # the columnar layout: one slice of all the simulations at z0
+            name = "powerspecs_srgan" if srgan_output else "powerspecs"
+            Y = self[name][:, 0, :]
+            k0 = self["k0_sr" if srgan_output else "k0"][()]
+        elif srgan_output: 
             Y = np.stack([self["simulation_{}".format(i)]["powerspecs_srgan"][()] for i in range(num_simulations)])
             k0 = self["simulation_0"]["k0_sr"][()]
             assert np.all(k0 == self["simulation_0"]["k0"][()])
@@ -341,6 +838,8 @@ class HDF5Holder(h5py.File):
         """
         combine two HDF5 files for multi power spectra
         """
+        if self.layout != 1 or other.layout != 1:
+            raise ValueError("only catalogues with a group per simulation can be added")
         if os.path.exists(self.saved_filename):
             os.remove(self.saved_filename)
 
@@ -9,13 +9,18 @@ Class:
 :MultiPowerSpec: a class to generate a single hdf5 catalogue
     for powerspecs in the folder
 """
-from typing import Generator, List, Union, Tuple, Optional
+from typing import Callable, Dict, Generator, List, Union, Tuple, Optional
 import re
 import os
 import json
+import hashlib
 from glob import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import h5py
+
+from . import classio
+from . import utils
 
 # the function I used to generate dm-only tests outdirs
 # outdir auto generated, since we will have many folders
@@ -25,6 +30,55 @@ fn_outdir = lambda i, res, box: "test-{}-{}-dmonly_{}".format(res, box, str(i).z
 powerspec_fn = lambda scale_factor: "powerspectrum-{:.4f}.txt".format(scale_factor)
 
 
+def load_in_order(load: Callable, all_submission_dirs: List[str], workers: int = 1,
+        queue_depth: Optional[int] = None, omp_threads: int = 1) -> Generator:
+    """
+    Yield load(submission_dir) for each folder, in the order given, loading
+    up to queue_depth folders ahead in a pool of worker processes.
+
+    The caller, e.g. the HDF5 writer of create_hdf5, is the only consumer:
+    at most queue_depth loaded objects wait for it, so the memory stays
+    bounded however many folders there are.
+
+    Parameters:
+    ----
+    load (callable)      : picklable, e.g. a class or a functools.partial of it
+    workers (int)        : number of processes; 1 loads serially in this process
+    queue_depth (int)    : folders loaded ahead; defaults to 2 workers
+    omp_threads (int)    : OpenMP (and FFT) threads of each process
+    """
+    if workers <= 1:
+        for submission_dir in all_submission_dirs:
+            yield load(submission_dir)
+        return
+
+    if queue_depth is None:
+        queue_depth = 2 * workers
+    queue_depth = max(queue_depth, 1)
+
+    # keep the FFTs of each loader from spreading over the whole node
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=utils.limit_threads,
+        initargs=(omp_threads,))
+    try:
+        pending = deque()
+        submission_dirs = iter(all_submission_dirs)
+        for submission_dir in submission_dirs:
+            pending.append(pool.submit(load, submission_dir))
+            if len(pending) >= queue_depth:
+                break
+
+        while pending:
+            # the oldest first, to keep the order
+            result = pending.popleft().result()
+            submission_dir = next(submission_dirs, None)
+            if submission_dir is not None:
+                pending.append(pool.submit(load, submission_dir))
+            yield result
+    finally:
+        # a failed load, or a consumer which stopped early: drop the rest
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
 class GadgetLoad(object):
     """
     handle the output filenames generated by MP-Gadget
@@ -37,7 +91,7 @@ class GadgetLoad(object):
     ----
     slurm log
     SimulationICs.json -> dict
-    camb_linear/*
+    camb_linear/* (class_output.npz and/or CLASS text files)
     output/cpu.txt*
     output/sfr.txt*
     output/powerspectrum-*.txt
@@ -75,9 +129,13 @@ class GadgetLoad(object):
         self.camb_files = glob(
             os.path.join(submission_dir, "camb_linear", "ics_matterpow_*.dat")
         )
+        # all redshifts in a single binary file, if cambfile wrote it
+        self.camb_npz = classio.find_class_npz(
+            os.path.join(submission_dir, "camb_linear")
+        )
 
         assert len(self.powerspec_files) > 0
-        assert len(self.camb_files) > 0
+        assert len(self.camb_files) > 0 or self.camb_npz is not None
 
         # these read into strings
         self.slurm_files = glob(
@@ -224,7 +282,17 @@ class PowerSpec(GadgetLoad):
         """
         Read a list of camb files into a single linear powerspec matrix,
         in shape: (n files, m k-modes, 2 cols)
+
+        If camb_linear/class_output.npz exists, it is read instead of the
+        text files, but for the redshifts with a text file, which may have
+        been changed by SimulationICs._alter_power (see
+        classio.read_all_matterpow).
         """
+        if self.camb_npz is not None:
+            redshifts, out = classio.read_all_matterpow(os.path.dirname(self.camb_npz))
+            assert redshifts[-1] == 0.0
+            return redshifts, out
+
         # some loading funcions to make the writing clearer
         load_fn = lambda f: os.path.join(self.submission_dir, "camb_linear", f)
         matterpower_fn = lambda z: "ics_matterpow_{:.2g}.dat".format(z)
@@ -247,7 +315,7 @@ class PowerSpec(GadgetLoad):
         (rows, cols) = self.read_array(load_fn(matterpower_fn(0))).shape
 
         # alloc the array
-        out = np.zeros((length, rows, cols), dtype=np.float)
+        out = np.zeros((length, rows, cols), dtype=np.float64)
 
         for i, this_z in enumerate(redshifts):
             this_matter = self.read_array(load_fn(matterpower_fn(this_z)))
@@ -286,7 +354,7 @@ class PowerSpec(GadgetLoad):
         (rows, cols) = self.read_array(load_fn(powerspec_fn(1))).shape
 
         # alloc the array
-        out = np.zeros((length, rows, cols), dtype=np.float)
+        out = np.zeros((length, rows, cols), dtype=np.float64)
 
         for i, this_scale_factor in enumerate(scale_factors):
             this_powerspec = self.read_array(load_fn(powerspec_fn(this_scale_factor)))
@@ -317,6 +385,18 @@ class MultiPowerSpec(object):
         - **param_dict
     simulation_2
     ...    
+
+    Columnar layout (create_hdf5(layout="columnar"), attrs["layout"] = 2):
+    ----
+    **LatinDict
+    scale_factors  (n_z, ) : all the scale factors of the simulations, sorted
+    powerspecs     (n_sim, n_z, n_k, ...) : one row per simulation, at the
+        scale factors of scale_factors: NaN where a simulation has no power
+        spectrum at one, or fewer k bins
+    camb_redshifts, camb_matters, ... : the other arrays, one row per
+        simulation, NaN padded
+    params         (n_sim, ) : structured table of the param_dicts and
+        the submission_dir of each simulation
     """
 
     def __init__(
@@ -351,13 +431,16 @@ class MultiPowerSpec(object):
             out[key] = np.array(val)
 
         # you need special treatment to handle list of strs in hdf5
+        import h5py
         out["parameter_names"] = np.array(
             out["parameter_names"], dtype=h5py.string_dtype(encoding="utf-8")
         )
 
         return out
 
-    def create_hdf5(self, hdf5_name: str = "MutliPowerSpecs.hdf5") -> None:
+    def create_hdf5(self, hdf5_name: str = "MutliPowerSpecs.hdf5", workers: int = 1,
+            queue_depth: Optional[int] = None, layout: str = "groups",
+            compression: Optional[str] = None) -> None:
         """
         - Create a HDF5 file for powerspecs from multiple simulations.
         - Each simulation stored in subgroup, includeing powerspecs and
@@ -366,41 +449,285 @@ class MultiPowerSpec(object):
         SimulationICs.json to reproduce this simulation.
         - Parameters from Latin HyperCube sampling stored in upper group level,
         the order of the sampling is the same as the order of simulations.
-
-        TODO: add a method to append new simulations to a created hdf5.
+        - With workers > 1 the simulations are loaded by a pool of processes,
+        up to queue_depth ahead of the writer (see load_in_order).
+        - With layout="columnar" each array is a single dataset with one row
+        per simulation instead (see the class docstring), chunked to read
+        all the simulations at one redshift, and compressed with
+        compression ("gzip" or "lzf") if given.
+
+        To add simulations to, or refresh, a created hdf5, see update_hdf5.
         """
-        # open a hdf5 file to store simulations
+        import h5py
+        assert layout in ("groups", "columnar")
+
+        if layout == "groups":
+            # an empty file: update_hdf5 writes every simulation
+            with h5py.File(hdf5_name, "w"):
+                pass
+            self.update_hdf5(hdf5_name, workers=workers, queue_depth=queue_depth)
+            return
+
         with h5py.File(hdf5_name, "w") as f:
-            # store the sampling from Latin Hyper cube dict into datasets:
-            # since the sampling size should be arbitrary, we should use
-            # datasets instead of attrs to stores these sampling arrays
-            for key, val in self.Latin_dict.items():
-                f.create_dataset(key, data=val)
+            f.attrs["layout"] = 2
+            self._write_Latin(f)
+
+            # the redshift axis: powerspecs[:, j] are all at scale_factors[j]
+            scale_factors = np.unique(np.concatenate(
+                [self.scale_factors_of(submission_dir) for submission_dir in self.all_submission_dirs]))
+            f.create_dataset("scale_factors", data=scale_factors)
+
+            n_sim = len(self.all_submission_dirs)
+            rows = []
+            loaded = self._load_PowerSpecs(self.all_submission_dirs, workers=workers,
+                queue_depth=queue_depth)
+            for i, ps in enumerate(loaded):
+                for name, val in self._shared(ps).items():
+                    val = np.asarray(val, dtype=np.float64)
+                    if name not in f:
+                        f.create_dataset(name, data=val)
+                    elif not np.array_equal(f[name][()], val, equal_nan=True):
+                        raise ValueError("{} of {} differs from the other simulations: use layout='groups'".format(
+                            name, self.all_submission_dirs[i]))
+                index = np.searchsorted(scale_factors, ps.scale_factors)
+                assert np.array_equal(scale_factors[np.minimum(index, len(scale_factors) - 1)], ps.scale_factors)
+                for name, val in self._columns(ps).items():
+                    if name in self._redshift_columns:
+                        aligned = np.full((len(scale_factors),) + np.shape(val)[1:], np.nan)
+                        aligned[index] = val
+                        val = aligned
+                    write_column(f, name, i, val, n_sim, compression=compression)
+
+                rows.append(dict(ps.param_dict, submission_dir=os.path.abspath(self.all_submission_dirs[i])))
+
+            f.create_dataset("params", data=params_table(rows))
+            f.attrs["complete"] = True
+
+    def update_hdf5(self, hdf5_name: str, workers: int = 1,
+            queue_depth: Optional[int] = None) -> List[int]:
+        """
+        Bring a HDF5 file made by create_hdf5 up to date: only the simulations
+        without a complete group, or whose files changed since their group was
+        written, are loaded. The Latin HyperCube datasets are rewritten, and
+        the groups past the last simulation removed.
+
+        Each group is marked complete, with its submission_dir and the
+        fingerprint of its files, after everything else is written, and the
+        file is flushed after each group: a run interrupted mid-way leaves the
+        earlier groups whole, and the next update writes the unmarked group again.
+        Files from before these marks are rewritten in full once.
+
+        Returns:
+        ----
+        updated (list) : the indices of the simulations written
+        """
+        import h5py
+
+        # before loading: files changed during the load are seen next time
+        fingerprints = [self.fingerprint(submission_dir) for submission_dir in self.all_submission_dirs]
+
+        with h5py.File(hdf5_name, "a") as f:
+            if f.attrs.get("layout", 1) != 1:
+                raise ValueError(hdf5_name + " has the columnar layout: remake it with create_hdf5")
+            self._write_Latin(f)
+
+            for name in list(f.keys()):
+                if name.startswith("simulation_") and int(name.split("_")[-1]) >= len(self.all_submission_dirs):
+                    del f[name]
+
+            updated = [i for i, submission_dir in enumerate(self.all_submission_dirs)
+                if not self._is_current(f, i, submission_dir, fingerprints[i])]
+            print("update_hdf5: {} of {} simulations to write".format(
+                len(updated), len(self.all_submission_dirs)))
 
             # using generator to iterate through simulations,
             # PowerSpec stores big arrays so we don't want to load
             # everything to memory
-            for i, ps in enumerate(self.load_PowerSpecs(self.all_submission_dirs)):
-                sim = f.create_group("simulation_{}".format(i))
+            loaded = self._load_PowerSpecs([self.all_submission_dirs[i] for i in updated],
+                workers=workers, queue_depth=queue_depth)
+            for i, ps in zip(updated, loaded):
+                self._write_simulation(f, i, self.all_submission_dirs[i], fingerprints[i], ps)
 
-                # store arrays to sim subgroup
-                sim.create_dataset("scale_factors", data=np.array(ps.scale_factors))
-                sim.create_dataset("powerspecs", data=ps.powerspecs)
+        return updated
 
-                sim.create_dataset("camb_redshifts", data=np.array(ps.camb_redshifts))
-                sim.create_dataset("camb_matters", data=ps.camb_matters)
+    def _write_Latin(self, f) -> None:
+        """
+        Store the sampling from Latin Hyper cube dict into datasets:
+        since the sampling size should be arbitrary, we should use
+        datasets instead of attrs to stores these sampling arrays
+        """
+        for key, val in self.Latin_dict.items():
+            if key in f:
+                del f[key]
+            f.create_dataset(key, data=val)
 
-                # stores param json to metadata attrs
-                for key, val in ps.param_dict.items():
-                    sim.attrs[key] = val
+    @staticmethod
+    def _is_current(f, i: int, submission_dir: str, fingerprint: str) -> bool:
+        """Whether simulation_i is complete and written from the files of submission_dir as they are"""
+        name = "simulation_{}".format(i)
+        if name not in f:
+            return False
+        attrs = f[name].attrs
+        return (bool(attrs.get("complete", False))
+            and attrs.get("submission_dir") == os.path.abspath(submission_dir)
+            and attrs.get("fingerprint") == fingerprint)
+
+    def _write_simulation(self, f, i: int, submission_dir: str, fingerprint: str, ps: PowerSpec) -> None:
+        """Write simulation_i from scratch, marking it complete last"""
+        name = "simulation_{}".format(i)
+        if name in f:
+            del f[name]
+        sim = f.create_group(name)
+
+        self._write_datasets(sim, ps)
+
+        # stores param json to metadata attrs: HDF5 has no None, and dicts
+        # and lists (which may be nested or mixed) are kept as json, as in params_table
+        for key, val in ps.param_dict.items():
+            if val is None:
+                continue
+            if isinstance(val, (dict, list, tuple)):
+                val = json.dumps(val)
+            sim.attrs[key] = val
+
+        sim.attrs["submission_dir"] = os.path.abspath(submission_dir)
+        sim.attrs["fingerprint"] = fingerprint
+        # last: a group without it was interrupted
+        sim.attrs["complete"] = True
+        f.flush()
+
+    def _write_datasets(self, sim, ps: PowerSpec) -> None:
+        """Store the arrays of a PowerSpec to its sim subgroup"""
+        sim.create_dataset("scale_factors", data=np.array(ps.scale_factors))
+        sim.create_dataset("powerspecs", data=ps.powerspecs)
+
+        sim.create_dataset("camb_redshifts", data=np.array(ps.camb_redshifts))
+        sim.create_dataset("camb_matters", data=ps.camb_matters)
+
+    # columns whose first axis is along ps.scale_factors
+    _redshift_columns = ("powerspecs",)
+
+    def scale_factors_of(self, submission_dir: str) -> np.ndarray:
+        """The scale factors of the power spectra of a simulation, from the file names alone"""
+        regex = os.path.join(submission_dir, "output", "powerspectrum-(.*).txt")
+        return np.array(sorted(GadgetLoad.get_number(regex, fn)
+            for fn in glob(os.path.join(submission_dir, "output", "powerspectrum-*.txt"))))
+
+    def _columns(self, ps: PowerSpec) -> Dict[str, np.ndarray]:
+        """The arrays of a PowerSpec in the columnar layout, one row per simulation"""
+        return {
+            "powerspecs"     : ps.powerspecs,
+            "camb_redshifts" : np.array(ps.camb_redshifts),
+            "camb_matters"   : ps.camb_matters,
+        }
+
+    def _shared(self, ps: PowerSpec) -> Dict[str, np.ndarray]:
+        """The arrays of a PowerSpec in the columnar layout which are the same for every simulation"""
+        return {}
+
+    def fingerprint_files(self, submission_dir: str) -> List[str]:
+        """The files a simulation is loaded from"""
+        return ([os.path.join(submission_dir, "SimulationICs.json")]
+            + sorted(glob(os.path.join(submission_dir, "output", "powerspectrum-*.txt")))
+            + sorted(glob(os.path.join(submission_dir, "camb_linear", "ics_matterpow_*.dat")))
+            + sorted(glob(os.path.join(submission_dir, "camb_linear", classio.class_npz))))
+
+    def load_settings(self) -> dict:
+        """The options of load_PowerSpecs which change the arrays written"""
+        return {}
+
+    def fingerprint(self, submission_dir: str) -> str:
+        """
+        sha256 of the sizes and mtimes of the files a simulation is loaded
+        from, and of the loading settings: it changes whenever its group
+        should be written again.
+        """
+        files = {}
+        for fn in self.fingerprint_files(submission_dir):
+            stat = os.stat(fn)
+            files[os.path.relpath(fn, submission_dir)] = [stat.st_size, stat.st_mtime_ns]
+        return hashlib.sha256(json.dumps({"files": files, "settings": self.load_settings()},
+            sort_keys=True).encode()).hexdigest()
+
+    def _load_PowerSpecs(self, all_submission_dirs: List[str], workers: int = 1,
+            queue_depth: Optional[int] = None) -> Generator:
+        """load_PowerSpecs with the settings of this catalogue"""
+        return self.load_PowerSpecs(all_submission_dirs, workers=workers, queue_depth=queue_depth)
 
     @staticmethod
-    def load_PowerSpecs(all_submission_dirs: List[str]) -> Generator:
+    def load_PowerSpecs(all_submission_dirs: List[str], workers: int = 1,
+            queue_depth: Optional[int] = None) -> Generator:
         """
         Iteratively load the PowerSpec class
         """
-        for submission_dir in all_submission_dirs:
-            yield PowerSpec(submission_dir)
+        return load_in_order(PowerSpec, all_submission_dirs, workers=workers,
+            queue_depth=queue_depth)
+
+
+def write_column(f, name: str, i: int, val: np.ndarray, n_sim: int,
+        compression: Optional[str] = None) -> None:
+    """
+    Write the array of simulation i into row i of the dataset name of the
+    columnar layout, creating it or growing its other axes, padded with NaN,
+    as needed.
+
+    Chunks hold about 1 MB of rows at one index of the second axis (the
+    redshift): reading all the simulations at one redshift reads only them.
+    """
+    val = np.asarray(val, dtype=np.float64)
+    if name not in f:
+        chunk = (1,) + val.shape[1:] if val.ndim >= 2 else val.shape
+        chunk = tuple(max(n, 1) for n in chunk)
+        n_rows = min(n_sim, max(1, 2**20 // (8 * int(np.prod(chunk)))))
+        f.create_dataset(name, shape=(n_sim,) + val.shape, maxshape=(n_sim,) + (None,) * val.ndim,
+            dtype=np.float64, chunks=(n_rows,) + chunk, fillvalue=np.nan,
+            compression=compression, shuffle=compression is not None)
+
+    dset = f[name]
+    if dset.ndim != val.ndim + 1:
+        raise ValueError("{} has {} dimensions, not {}".format(name, val.ndim, dset.ndim - 1))
+    shape = tuple(max(n, m) for n, m in zip(dset.shape[1:], val.shape))
+    if shape != dset.shape[1:]:
+        dset.resize((n_sim,) + shape)
+    dset[(i,) + tuple(slice(0, n) for n in val.shape)] = val
+
+
+def params_table(rows: List[dict]) -> np.ndarray:
+    """
+    Structured array of param_dicts, one field per key: numbers as i8 (or f8,
+    NaN where missing), booleans as ?, anything else as json strings
+    (strings as themselves, "" where missing).
+    """
+    import h5py
+
+    keys = []
+    for row in rows:
+        keys += [key for key in row if key not in keys]
+
+    columns, dtype = {}, []
+    for key in keys:
+        values = [row.get(key) for row in rows]
+        present = [val for val in values if val is not None]
+        if present and all(isinstance(val, (bool, np.bool_)) for val in present):
+            columns[key] = [bool(val) for val in values]
+            dtype.append((key, "?"))
+        elif present and all(isinstance(val, (int, np.integer)) and not isinstance(val, (bool, np.bool_))
+                for val in values):
+            columns[key] = values
+            dtype.append((key, "i8"))
+        elif present and all(isinstance(val, (int, float, np.integer, np.floating))
+                and not isinstance(val, (bool, np.bool_)) for val in present):
+            columns[key] = [np.nan if val is None else val for val in values]
+            dtype.append((key, "f8"))
+        else:
+            columns[key] = ["" if val is None else val if isinstance(val, str) else json.dumps(val)
+                for val in values]
+            dtype.append((key, h5py.string_dtype()))
+
+    table = np.empty(len(rows), dtype=dtype)
+    for key in keys:
+        table[key] = columns[key]
+    return table
 
 
 def take_params_dict(Latin_dict: dict) -> Generator:
@@ -0,0 +1,183 @@
+"""
+Choose the CLASS massive neutrino tolerance from a target P(k) accuracy.
+
+tol_ncdm_* sets most of the CLASS run time for massive neutrinos
+(1e-10: 45 minutes, 1e-5: 6 minutes), but how loose it can be depends on
+the neutrino mass and on the largest k of the run. A NuToleranceTable is
+calibrated once for a neutrino mass range and kmax: CLASS is run over a few
+masses in the range, at each candidate tolerance and at a tight reference
+tolerance. The table stores the max fractional P(k) error of each
+(mass, tolerance) and is cached as json, so every simulation of a suite
+with mnu_bounds=(0.06, 0.15) looks up the loosest tolerance meeting the
+requested accuracy instead of running at the worst-case setting.
+
+The calibration uses the other cosmological parameters of the simulation
+which first needs the table; the error is dominated by the neutrino mass.
+"""
+from typing import Callable, List, Optional, Tuple
+import os
+import json
+import time
+import numpy as np
+from .classcache import canonical_hash
+
+# candidate tol_ncdm_synchronous, from the loosest to the tightest
+tolerances = [1e-3, 3e-4, 1e-4, 3e-5, 1e-5, 3e-6]
+
+# tolerance of the reference run. 1e-8 is machine accurate but takes 20 minutes
+reference_tolerance = 1e-7
+
+# a calibration whose lock file is older than this is assumed to have died
+lock_timeout = 12 * 3600.
+
+
+class NuToleranceTable(object):
+    """
+    Max fractional P(k) error of each candidate neutrino tolerance over a
+    range of neutrino masses.
+
+    Parameters:
+    ----
+    mnu_bounds (tuple) : (min, max) total neutrino mass of the suite, in eV
+    kmax (float)       : largest k of the comparison, in h/Mpc
+    cache_dir (str)    : where the calibrated tables are kept
+    nu_hierarchy (str) : neutrino mass hierarchy
+    label (str)        : anything else the errors depend on, e.g. the CLASS
+        precision preset
+    n_mnu (int)        : number of masses sampled in mnu_bounds
+    """
+
+    def __init__(self, mnu_bounds: Tuple[float, float], kmax: float,
+            cache_dir: str = "~/.cache/SimulationRunner",
+            nu_hierarchy: str = "normal", label: str = "",
+            n_mnu: int = 3) -> None:
+        assert 0 <= mnu_bounds[0] <= mnu_bounds[1] and mnu_bounds[1] > 0
+        self.mnu_bounds = (float(mnu_bounds[0]), float(mnu_bounds[1]))
+        if self.mnu_bounds[0] == self.mnu_bounds[1]:
+            n_mnu = 1
+        self.m_nus = np.linspace(self.mnu_bounds[0], self.mnu_bounds[1], n_mnu)
+        # massless neutrinos need no tolerance: calibrate a light mass instead
+        self.m_nus[self.m_nus == 0] = 0.01 * self.mnu_bounds[1]
+
+        self.kmax         = kmax
+        self.kk           = np.logspace(-3, np.log10(0.99 * kmax), 200)
+        self.tolerances   = list(tolerances)
+        self.reference    = reference_tolerance
+
+        key = canonical_hash({"mnu_bounds": self.mnu_bounds, "kmax": kmax,
+            "nu_hierarchy": nu_hierarchy, "label": label, "n_mnu": n_mnu,
+            "tolerances": self.tolerances, "reference": self.reference})
+        self.filename = os.path.join(os.path.expanduser(cache_dir),
+            "nu_tolerance_{}.json".format(key[:16]))
+
+        # max |P/P_ref - 1|, in shape (masses, tolerances)
+        self.errors: Optional[np.ndarray] = None
+
+    def load(self) -> bool:
+        """Load the calibration from the cache; True if it was there"""
+        if not os.path.exists(self.filename):
+            return False
+        with open(self.filename, "r") as f:
+            self.errors = np.array(json.load(f)["errors"])
+        assert self.errors.shape == (len(self.m_nus), len(self.tolerances))
+        return True
+
+    def save(self) -> None:
+        """Write the calibration; atomic, so readers never see half a file"""
+        assert self.errors is not None
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+        tmpfile = self.filename + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump({
+                "mnu_bounds" : self.mnu_bounds,
+                "kmax"       : self.kmax,
+                "m_nus"      : self.m_nus.tolist(),
+                "tolerances" : self.tolerances,
+                "reference"  : self.reference,
+                "errors"     : self.errors.tolist(),
+            }, f, indent=2)
+        os.replace(tmpfile, self.filename)
+
+    def calibrate(self, pklin: Callable[[float, float, np.ndarray], np.ndarray]) -> None:
+        """
+        Run the calibration.
+
+        Parameters:
+        ----
+        pklin (callable) : pklin(m_nu, tol_ncdm, kk) -> linear P(k) on kk
+            (one or more redshifts, flattened) from CLASS at this neutrino
+            mass and tolerance.
+        """
+        errors = np.zeros((len(self.m_nus), len(self.tolerances)))
+        for i, m_nu in enumerate(self.m_nus):
+            print("NuToleranceTable: calibrating m_nu = {:.4f}...".format(m_nu))
+            pk_ref = pklin(m_nu, self.reference, self.kk)
+            for j, tol in enumerate(self.tolerances):
+                errors[i, j] = np.max(np.abs(pklin(m_nu, tol, self.kk) / pk_ref - 1))
+
+        self.errors = errors
+
+    def load_or_calibrate(self, pklin: Callable[[float, float, np.ndarray], np.ndarray]) -> None:
+        """
+        Load the table, or calibrate and save it. When several processes need
+        the same table, the first calibrates and the others wait for it.
+        """
+        if self.load():
+            return
+
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        lockfile = self.filename + ".lock"
+        try:
+            fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+        except FileExistsError:
+            print("NuToleranceTable: waiting for the calibration in {}...".format(lockfile))
+            while os.path.exists(lockfile) and not self.load():
+                if time.time() - os.path.getmtime(lockfile) > lock_timeout:
+                    break
+                time.sleep(10)
+            if self.load():
+                return
+
+        # this process holds the lock, or the other calibration died
+        self._calibrate_and_save(pklin, lockfile)
+
+    def _calibrate_and_save(self, pklin: Callable, lockfile: str) -> None:
+        try:
+            self.calibrate(pklin)
+            self.save()
+        finally:
+            if os.path.exists(lockfile):
+                os.remove(lockfile)
+
+    def choose(self, m_nu: float, accuracy: float) -> float:
+        """
+        The loosest tolerance whose P(k) error is below accuracy at the
+        calibrated masses bracketing m_nu. Falls back to the reference
+        tolerance if none is accurate enough.
+        """
+        assert self.errors is not None
+        lo, hi = self.mnu_bounds
+        # a little slack for floating point in the Latin json
+        if not lo * (1 - 1e-6) <= m_nu <= hi * (1 + 1e-6):
+            raise ValueError("m_nu = {} is outside the calibrated range {}".format(
+                m_nu, self.mnu_bounds))
+
+        # the calibrated masses on both sides of m_nu
+        i = np.searchsorted(self.m_nus, m_nu)
+        rows = [max(i - 1, 0), min(i, len(self.m_nus) - 1)]
+        errors = np.max(self.errors[rows], axis=0)
+
+        for tol, err in zip(self.tolerances, errors):
+            if err <= accuracy:
+                return tol
+        return self.reference
+
+    @property
+    def table(self) -> List[Tuple[float, float, float]]:
+        """(m_nu, tolerance, error) of every calibrated run"""
+        assert self.errors is not None
+        return [(m_nu, tol, self.errors[i, j])
+            for i, m_nu in enumerate(self.m_nus)
+            for j, tol in enumerate(self.tolerances)]
@@ -0,0 +1,108 @@
+"""
+On-disk memo of the power spectra measured from PART snapshots, so
+rebuilding a catalogue with MultiNbodyKitPowerSpec only paints and FFTs the
+snapshots which changed.
+
+Each entry sits next to its snapshot, one per estimator setting:
+
+Layout:
+----
+<output>/PART_xxx.power-<settings hash>.npz : the results (e.g. k0, ps, modes),
+    fingerprint, settings
+
+The settings are the options of load_nbodykit_power which change the
+result (Ng, k_max, compensated, shot noise, engine, ...). The fingerprint of
+a snapshot is its header (Time, TotNumPart, BoxSize) and the size and mtime
+of the Header and 1/Position files. An entry whose fingerprint no longer
+matches the snapshot is recomputed and overwritten.
+"""
+from typing import Callable, Optional, Tuple
+import os
+import json
+import tempfile
+import numpy as np
+import bigfile
+
+from .classcache import _canonical, canonical_hash
+
+# bigfile blocks the power spectrum depends on
+_blocks = ("Header", os.path.join("1", "Position"))
+
+
+def snapshot_fingerprint(path: str) -> str:
+    """
+    Canonical json of the header and the file sizes and mtimes of a PART
+    folder: it changes whenever the snapshot is rewritten.
+    """
+    with bigfile.File(path) as bigf:
+        header = bigf.open("Header")
+        attrs = {name: header.attrs[name] for name in ("Time", "TotNumPart", "BoxSize")}
+
+    files = {}
+    for block in _blocks:
+        for fn in sorted(os.listdir(os.path.join(path, block))):
+            stat = os.stat(os.path.join(path, block, fn))
+            files[os.path.join(block, fn)] = [stat.st_size, stat.st_mtime_ns]
+    return json.dumps(_canonical({"header": attrs, "files": files}), sort_keys=True)
+
+
+def cache_filename(path: str, settings: dict) -> str:
+    """The cache file of a PART folder and estimator settings"""
+    key = canonical_hash(settings)[:16]
+    return os.path.normpath(path) + ".power-" + key + ".npz"
+
+
+def cached_power(path: str, settings: dict,
+        compute: Callable[[], Tuple[np.ndarray, ...]]) -> Tuple[np.ndarray, ...]:
+    """
+    The power spectrum arrays of a PART folder, e.g. (k0, ps, modes): from
+    its cache file if the snapshot and the settings are unchanged, else from
+    compute(), which is then saved.
+
+    Parameters:
+    ----
+    path (str)         : PART folder
+    settings (dict)    : everything compute() depends on besides the snapshot
+    compute (callable) : measures the tuple of arrays
+    """
+    filename = cache_filename(path, settings)
+    fingerprint = snapshot_fingerprint(path)
+    settings_json = json.dumps(_canonical(settings), sort_keys=True)
+
+    cached = load_cached(filename, fingerprint, settings_json)
+    if cached is not None:
+        return cached
+
+    results = tuple(compute())
+
+    #Atomic, as several catalogues, or all the MPI ranks, may write it at
+    #once: each writer has its own temporary file
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(filename),
+        prefix=os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, *results, fingerprint=fingerprint, settings=settings_json)
+        os.chmod(tmpfile, 0o644)
+        os.replace(tmpfile, filename)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+    return results
+
+
+def load_cached(filename: str, fingerprint: str,
+        settings_json: str) -> Optional[Tuple[np.ndarray, ...]]:
+    """The arrays of a cache file, or None if it is missing or stale"""
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as data:
+            if str(data["fingerprint"]) != fingerprint or str(data["settings"]) != settings_json:
+                return None
+            n_results = sum(1 for name in data.files if name.startswith("arr_"))
+            if n_results == 0:
+                return None
+            return tuple(data["arr_" + str(i)] for i in range(n_results))
+    except (OSError, ValueError, KeyError):
+        # a truncated or foreign file: recompute
+        return None
@@ -1,6 +1,6 @@
 """This module rebuilds the Gadget binary for all runs in a directory.
 It must be very compatible, as it will run on the cluster.
-Requires python 2.6."""
+Requires python 3.3 (shutil.which)."""
 
 from __future__ import print_function
 import glob
@@ -10,7 +10,6 @@ import shutil
 import re
 import os
 import os.path as path
-import distutils.spawn
 
 def rebuild_MP(rundir, codedir, config_file="Options.mk", binary=["gadget/MP-Gadget", "genic/MP-GenIC"]):
     """rebuild, but with defaults appropriate for MP-Gadget."""
@@ -58,12 +57,12 @@ def rebuild(rundir, codedir, config_file="Config.sh", binary=["P-Gadget3",]):
 
 def detect_submit():
     """Auto-detect the resubmission command. """
-    #Python 3.3 has shutils.which, but we need python 2 compatibility here.
+    #shutil.which: distutils is slow to import and gone in python 3.12.
     #Use sbatch if it exists
-    if distutils.spawn.find_executable('sbatch') is not None:
+    if shutil.which('sbatch') is not None:
         return 'sbatch'
     #Try for qsub
-    if distutils.spawn.find_executable('qsub') is not None:
+    if shutil.which('qsub') is not None:
         return 'qsub'
     #Otherwise not sure what to do.
     raise ValueError("Could not find sbatch or qsub")
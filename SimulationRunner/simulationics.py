@@ -1,20 +1,32 @@
 """Class to generate simulation ICS, separated out for clarity."""
 from __future__ import print_function
-from typing import Tuple, List, Type, Any
+from typing import Tuple, List, Type, Any, Optional, Callable, Sequence
 import os.path
 import math
 import subprocess
+import io
 import json
+import hashlib
 import shutil
+import filecmp
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
 #To do crazy munging of types for the storage format
 import importlib
 import numpy as np
 import configobj
-import classylss
-import classylss.binding as CLASS
 from . import utils
 from . import clusters
-from . import cambpower
+from . import classcache
+from . import classio
+from . import classpresets
+from . import nutolerance
+from . import classworker
+from . import linear_emulator as lemu
+from . import costmodel
+from .classio import save_transfer
+from .stages import StageRecord
 import datetime
 
 # DM-only
@@ -52,6 +64,33 @@ class SimulationICs(object):
     m_nu       - neutrino mass
     unitary    - if true, do not scatter modes, but use a unitary gaussian
         amplitude.
+    class_cache      - directory of a ClassCache shared between simulations.
+        If None, always run CLASS.
+    class_cache_size - size bound of the CLASS cache in GB.
+    all_class_text   - if true, write the CLASS text files for every output
+        redshift. Otherwise only for the initial redshift read by MP-GenIC;
+        all redshifts are always in camb_linear/class_output.npz.
+    nu_accuracy  - if set, choose the loosest CLASS neutrino tolerance giving
+        this fractional P(k) accuracy, instead of nu_acc. See nutolerance.py.
+        Only with the production preset: the others set the tolerance.
+    nu_mnu_bounds - neutrino mass range of the suite, so all its points share
+        one calibration of the tolerance. Default: (m_nu, m_nu).
+    nu_tolerance_cache - where the neutrino tolerance calibrations are kept.
+    class_preset - CLASS precision: "production" (default), "lowres" or
+        "preview". See classpresets.py.
+    class_worker - run CLASS in the classworker.py worker when one is
+        running at $SIMRUNNER_CLASS_WORKER (or the default address).
+        Default: False, CLASS runs in this process.
+    linear_emulator - a LinearPowerEmulator saved file. With the preview
+        preset, cambfile predicts the linear power from it instead of running
+        CLASS; for dry runs, as no transfer functions are written.
+    class_write_workers - threads writing the CLASS output files while the
+        transfer functions of the next redshifts are extracted.
+    cost_model - size the memory and walltime requests and PartAllocFactor
+        with the cost model of costmodel.py, instead of the cluster defaults.
+    cost_calibration - a CostModel calibration json; uncalibrated if None.
+    check_ics_in_job - check the IC power spectrum at the end of the IC job.
+        If False, check the whole suite afterwards with icvalidation.py.
 
     Remove:
     ----
@@ -71,39 +110,39 @@ class SimulationICs(object):
             cluster_class: Type[clusters.StampedeClass] = clusters.StampedeClass, 
             gadget_dir:    str = "~/codes/MP-Gadget/",
             python:        str = "python",
-            nproc:         int = 256,            cores:    int   = 32, mpi_ranks: int = 8, threads: int = 16) -> None:
+            nproc:         int = 256,            cores:    int   = 32, mpi_ranks: int = 8, threads: int = 16,
+            class_cache:   Optional[str] = None, class_cache_size: float = 10.,
+            all_class_text: bool = False, class_write_workers: int = 4,
+            class_preset:  str = "production",
+            nu_accuracy:   Optional[float] = None,
+            nu_mnu_bounds: Optional[Tuple[float, float]] = None,
+            nu_tolerance_cache: str = "~/.cache/SimulationRunner",
+            class_worker:  bool = False,
+            linear_emulator: Optional[str] = None,
+            cost_model:    bool = False,
+            cost_calibration: Optional[str] = None,
+            check_ics_in_job: bool = True) -> None:
         #Check that input is reasonable and set parameters
-        #In Mpc/h
         print("__init__: initializing parameters...", datetime.datetime.now())
-        assert box  < 20000
+        errors = parameter_errors(
+            {name: val for name, val in locals().items() if name != "self"})
+        assert not errors, "; ".join(errors)
+
+        #In Mpc/h
         self.box      = box
 
         #Cube root
-        assert npart > 1 and npart < 16000
         self.npart    = int(npart)
 
         #Physically reasonable
-        assert omega0 <= 1 and omega0 > 0
-        self.omega0   = omega0
-
-        assert omegab > 0 and omegab < 1
-        self.omegab   = omegab
-
-        assert redshift > 1 and redshift < 1100
-        self.redshift = redshift
-
-        assert redend >= 0 and redend < 1100
-        self.redend = redend
-
-        assert hubble < 1 and hubble > 0
-        self.hubble = hubble
-
-        assert scalar_amp < 1e-7 and scalar_amp > 0
+        self.omega0     = omega0
+        self.omegab     = omegab
+        self.redshift   = redshift
+        self.redend     = redend
+        self.hubble     = hubble
         self.scalar_amp = scalar_amp
-
-        assert ns > 0 and ns < 2
-        self.ns      = ns
-        self.unitary = unitary
+        self.ns         = ns
+        self.unitary    = unitary
 
         # assert w0_fld < 0
         self.w0_fld = w0_fld
@@ -111,10 +150,7 @@ class SimulationICs(object):
         # assert wa_fld < 1 and wa_fld > -1
         self.wa_fld = wa_fld
 
-        assert N_ur >= 0
-        self.N_ur = N_ur
-
-        assert alpha_s < 1 and alpha_s > -1
+        self.N_ur    = N_ur
         self.alpha_s = alpha_s
 
         T_CMB = 2.7255  # default cmb temperature
@@ -123,16 +159,42 @@ class SimulationICs(object):
         self.omega_ur = omegag * 0.22710731766023898 * (self.N_ur - 1.013198221453432*3)  # MP-Gadget
         # assert self.omega_ur >= 0
 
-        assert MWDM_therm >= 0
         self.MWDM_therm = MWDM_therm
 
         
         #Neutrino accuracy for CLASS
         self.nu_acc  = nu_acc
 
+        #Target P(k) accuracy to tune nu_acc for, once, before CLASS runs
+        self.nu_accuracy = nu_accuracy
+        self._nu_acc_tuned = False
+        if nu_mnu_bounds is None:
+            nu_mnu_bounds = (m_nu, m_nu)
+        self.nu_mnu_bounds = tuple(nu_mnu_bounds)
+        self.nu_tolerance_cache = nu_tolerance_cache
+
+        #Shared cache of CLASS outputs: only the path goes into the json
+        if class_cache is not None:
+            class_cache = os.path.realpath(os.path.expanduser(class_cache))
+        self.class_cache      = class_cache
+        self.class_cache_size = class_cache_size
+
+        #CLASS text files are only needed by MP-GenIC
+        self.all_class_text = all_class_text
+
+        self.class_preset = class_preset
+
+        self.class_worker = class_worker
+
+        #Skip CLASS in dry runs: only meant for the preview preset
+        if linear_emulator is not None:
+            linear_emulator = os.path.realpath(os.path.expanduser(linear_emulator))
+        self.linear_emulator = linear_emulator
+
+        self.class_write_workers = class_write_workers
+
         #UVB? Only matters if gas
         self.uvb = uvb
-        assert self.uvb == "hm" or self.uvb == "fg" or self.uvb == "sh" or self.uvb == "pu"
 
         self.rscatter = rscatter
 
@@ -170,6 +232,21 @@ class SimulationICs(object):
                                                          # make them optional
         assert self._cluster.gadget_dir == os.path.expanduser(gadget_dir)
 
+        #Ask for what the cost model predicts rather than the defaults
+        self.cost_model       = cost_model
+        self.cost_calibration = cost_calibration
+        self.cost_estimate: Optional[dict] = None
+        if cost_model:
+            model = costmodel.CostModel()
+            if cost_calibration is not None:
+                model = costmodel.CostModel.load(cost_calibration)
+            self.cost_estimate = self._cluster.size_from_cost_model(model,
+                self.box, self.npart, self.redshift, self.redend, self.m_nu)
+            print("__init__: predicted {:.0f} MB per rank, {:.2f} hours".format(
+                self.cost_estimate["memory_per_rank"], self.cost_estimate["walltime"] / 3600))
+
+        self.check_ics_in_job = check_ics_in_job
+
         #For repeatability, we store git hashes of Gadget, GenIC, CAMB and ourselves
         #at time of running.
         self.simulation_git = utils.get_git_hash(os.path.dirname(__file__))
@@ -249,26 +326,20 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         # this is absolute path so make sure binary is there
         self.gadget_dir   = os.path.expanduser(gadget_dir)
 
-    def cambfile(self) -> str:
+    def class_params(self) -> Tuple[dict, np.ndarray, float]:
         """
-        Generate the IC power spectrum using classylss.
-        
-        Basically is using pre_params feed into class and compute the powerspec
-        files based on the range of redshift and redend. All files are stored in
-        the directory camb_out.
+        The CLASS input of this simulation, with nu_acc as it is: the tuning
+        to nu_accuracy is done by _tune_nu_acc, before CLASS runs.
 
         Return:
         ----
-        camb_output (str) : power specs directory. default: "camb_linear/"
+        pre_params (dict) : CLASS parameters, with the precision of class_preset
+        camb_zz (array)   : redshifts at which to save the CLASS outputs
+        maxk (float)      : P_k_max_h/Mpc of the run
         """
-        #Load high precision defaults
-        print("cambfile: loading defaults...", datetime.datetime.now())
-        pre_params = {
-            'tol_background_integration': 1e-9, 'tol_perturb_integration' : 1.e-7,
-            'tol_thermo_integration':1.e-5, 'k_per_decade_for_pk': 50,'k_bao_width': 8,
-            'k_per_decade_for_bao':  200, 'neglect_CMB_sources_below_visibility' : 1.e-30,
-            'transfer_neglect_late_source': 3000., 'l_max_g' : 50,
-            'l_max_ur':150, 'extra metric transfer functions': 'y'}
+        #Load the precision defaults: high precision unless another preset is asked
+        print("cambfile: loading {} defaults...".format(self.class_preset), datetime.datetime.now())
+        pre_params = classpresets.precision_params(self.class_preset)
 
         #Set the neutrino density and subtract it from omega0
         omeganu = self.m_nu/93.14/self.hubble**2
@@ -288,9 +359,12 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
 
         numass = get_neutrino_masses(self.m_nu, self.nu_hierarchy)
 
+        maxk        = self._class_maxk()
+
         #Set up massive neutrinos
         if self.m_nu > 0:
             print("cambfile: setting up massive neutrinos...")
+
             # gparams['m_ncdm'] = '%.8f,%.8f,%.8f' % (numass[2], numass[1], numass[0])
             # gparams['N_ncdm'] = 3
 
@@ -315,14 +389,11 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
             #tol_ncdm_* = 1e-8 takes 20 minutes and is machine-accurate.
             #Default parameters are fast but off by 2%.
             #I chose 1e-5, which takes 6 minutes and is accurate to 1e-5
-            gparams['tol_ncdm_newtonian'] = min(self.nu_acc,1e-5)
-            gparams['tol_ncdm_synchronous'] = self.nu_acc
-            gparams['tol_ncdm_bg'] = 1e-10
-            gparams['l_max_ncdm'] = 50
-            #This disables the fluid approximations, which make P_nu not match 
-            # camb on small scales.
+            #The production preset also disables the fluid approximations,
+            # which make P_nu not match camb on small scales.
             #We need accurate P_nu to initialise our neutrino code.
-            gparams['ncdm_fluid_approximation'] = 3 # 3: disable approximation; # enum ncdmfa_method {ncdmfa_mb,ncdmfa_hu,ncdmfa_CLASS,ncdmfa_none};
+            # enum ncdmfa_method {ncdmfa_mb,ncdmfa_hu,ncdmfa_CLASS,ncdmfa_none};
+            gparams.update(classpresets.neutrino_params(self.class_preset, self.nu_acc))
             #Does nothing unless ncdm_fluid_approximation = 2
             #Spend less time on neutrino power for smaller neutrino mass
             gparams['ncdm_fluid_trigger_tau_over_tau_k'] = 30000.* (self.m_nu / 0.4)
@@ -333,7 +404,6 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         #Initial cosmology
         pre_params.update(gparams)
 
-        maxk        = 2 * math.pi / self.box * self.npart * 8
         powerparams = {'output': 'dTk vTk mPk', 'P_k_max_h/Mpc' : maxk, 
             "z_max_pk" : self.redshift + 1}
         pre_params.update(powerparams)
@@ -346,6 +416,56 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
              1 / self.generate_times() - 1,
               [self.redend,] ] )
 
+        return pre_params, camb_zz, maxk
+
+    def _class_maxk(self) -> float:
+        """P_k_max_h/Mpc of the CLASS run"""
+        return 2 * math.pi / self.box * self.npart * 8
+
+    def _tune_nu_acc(self) -> None:
+        """
+        Set nu_acc to the loosest neutrino tolerance meeting nu_accuracy, from
+        a calibration table shared by the simulations in nu_mnu_bounds. Only
+        the first call does anything, so class_params() sees the tuned value.
+        """
+        if self.m_nu <= 0 or self.nu_accuracy is None or self._nu_acc_tuned:
+            return
+        table = nutolerance.NuToleranceTable(self.nu_mnu_bounds, self._class_maxk(),
+            cache_dir=self.nu_tolerance_cache, nu_hierarchy=self.nu_hierarchy,
+            label=self.class_preset)
+
+        def pklin(m_nu: float, tol_ncdm: float, kk: np.ndarray) -> np.ndarray:
+            #This cosmology with another neutrino mass and tolerance
+            sim = copy.copy(self)
+            sim.m_nu, sim.nu_acc, sim.nu_accuracy = m_nu, tol_ncdm, None
+            pre_params, _, _ = sim.class_params()
+
+            powspec = classworker.run_class(pre_params)
+            return np.concatenate([powspec.get_pklin(k=kk, z=zz)
+                for zz in (self.redshift, self.redend)])
+
+        table.load_or_calibrate(pklin)
+        self.nu_acc = table.choose(self.m_nu, self.nu_accuracy)
+        self._nu_acc_tuned = True
+        print("cambfile: neutrino tolerance {:.0e} for P(k) accuracy {:.0e}".format(
+            self.nu_acc, self.nu_accuracy))
+
+    def cambfile(self) -> str:
+        """
+        Generate the IC power spectrum using classylss.
+        
+        Basically is using pre_params feed into class and compute the powerspec
+        files based on the range of redshift and redend. All files are stored in
+        the directory camb_out: every redshift in class_output.npz, and the CLASS
+        text files for the initial redshift (or all, if all_class_text).
+
+        Return:
+        ----
+        camb_output (str) : power specs directory. default: "camb_linear/"
+        """
+        self._tune_nu_acc()
+        pre_params, camb_zz, maxk = self.class_params()
+
         cambpars  = os.path.join(self.outdir, "_class_params.ini")
         classconf = configobj.ConfigObj()
         classconf.filename = cambpars
@@ -353,18 +473,6 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         classconf['z_pk'] = camb_zz
         classconf.write()
 
-        # feed in the parameters and generate the powerspec object
-        print("cambfile: generating the powerspec object...")
-        engine  = CLASS.ClassEngine(pre_params)
-        powspec = CLASS.Spectra(engine) # powerspec is an object
-
-        # bg = CLASS.Background(engine)
-        # pre_params['Omega_fld'] = 1 - self.omega0 + bg.Omega0_lambda  # so that Omega0_lambda == 0 (forced)
-
-        # engine  = CLASS.ClassEngine(pre_params)
-        # powspec = CLASS.Spectra(engine) # powerspec is an object
-
-
         #Save directory
         camb_output = "camb_linear/" # actually class now
         camb_outdir = os.path.join(self.outdir, camb_output)
@@ -373,26 +481,113 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         except FileExistsError:
             pass
 
-        #Save directory
-        #Get and save the transfer functions
-        print("cambfile: getting and saving the transfer functions...")
-        for zz in camb_zz:
-            trans = powspec.get_transfer(z=zz)
+        #Text files needed by MP-GenIC and the IC power check
+        zstrs = [self._camb_zstr(zz) for zz in camb_zz]
+        text_zstrs = zstrs if self.all_class_text else [self._camb_zstr(self.redshift)]
+
+        #Wall time of each phase, in seconds
+        self.cambfile_timings = {"cache": 0., "class": 0., "extract": 0., "write": 0.}
+
+        #Dry run: predict the linear power without CLASS
+        if self.linear_emulator is not None:
+            self._emulate_cambfile(camb_outdir, text_zstrs)
+            print("cambfile: done.", datetime.datetime.now(),"\n")
+            return camb_output
+
+        #Another simulation of this cosmology may have run CLASS already
+        if self.class_cache is not None:
+            start = time.time()
+            cache = classcache.ClassCache(self.class_cache, max_gb=self.class_cache_size)
+            cache_key = cache.key(pre_params, camb_zz)
+            hit = cache.fetch(cache_key, maxk, camb_outdir)
+            if hit:
+                print("cambfile: CLASS cache hit {}.".format(cache_key[:12]))
+                class_output = classio.ClassOutput(os.path.join(camb_outdir, classio.class_npz))
+                classio.write_class_text(class_output, camb_outdir, zstrs=text_zstrs)
+            self.cambfile_timings["cache"] = time.time() - start
+            if hit:
+                print("cambfile: done.", datetime.datetime.now(),"\n")
+                return camb_output
+
+        # feed in the parameters and generate the powerspec object, in the
+        # CLASS worker if one is running
+        start = time.time()
+        worker = classworker.find_worker() if self.class_worker else None
+        if worker is not None:
+            print("cambfile: running CLASS in the worker at {}...".format(worker.address))
+            outputs = worker.compute(pre_params, camb_zz)
+            get_outputs = lambda i, zz: outputs[i]
+            self.camb_git = worker.version
+        else:
+            print("cambfile: generating the powerspec object...")
+            powspec = classworker.run_class(pre_params)
+            self.camb_git = classworker.class_version()
+            get_outputs = lambda i, zz: classworker.extract_outputs(powspec, zz)
+        self.cambfile_timings["class"] = time.time() - start
 
-            #fp-roundoff
-            trans['k'][-1] *= 0.9999
-            transferfile = os.path.join(
-                camb_outdir, "ics_transfer_" + self._camb_zstr(zz) + ".dat")
-            save_transfer(trans, transferfile)
+        # bg = CLASS.Background(engine)
+        # pre_params['Omega_fld'] = 1 - self.omega0 + bg.Omega0_lambda  # so that Omega0_lambda == 0 (forced)
 
-            pk_lin = powspec.get_pklin(k=trans['k'], z=zz)
-            pkfile = os.path.join(
-                camb_outdir, "ics_matterpow_" + self._camb_zstr(zz) + ".dat")
+        # engine  = CLASS.ClassEngine(pre_params)
+        # powspec = CLASS.Spectra(engine) # powerspec is an object
 
-            np.savetxt(pkfile, np.vstack([trans['k'], pk_lin]).T)
+        #Get and save the transfer functions. CLASS is queried in this thread,
+        # while the text files of the redshifts already extracted are written
+        # by the pool.
+        print("cambfile: getting and saving the transfer functions...")
+        start = time.time()
+        transfers = []
+        pklins    = []
+        with ThreadPoolExecutor(max_workers=self.class_write_workers) as pool:
+            writes = []
+            for i, (zz, zstr) in enumerate(zip(camb_zz, zstrs)):
+                trans, pk_lin = get_outputs(i, zz)
+                transfers.append(trans)
+                pklins.append(pk_lin)
+
+                #Text only where it is needed
+                if zstr in text_zstrs:
+                    writes.append(pool.submit(
+                        classio.save_class_text, camb_outdir, zstr, trans, pk_lin))
+            self.cambfile_timings["extract"] = time.time() - start
+
+            #All redshifts in one binary file
+            classio.save_class_npz(
+                os.path.join(camb_outdir, classio.class_npz), zstrs, transfers, pklins)
+            camb_files = [classio.class_npz]
+            for write in writes:
+                camb_files += write.result()
+        self.cambfile_timings["write"] = time.time() - start - self.cambfile_timings["extract"]
+
+        print("cambfile: timings (s)", ", ".join(
+            "{} {:.2f}".format(phase, tt) for phase, tt in self.cambfile_timings.items()))
+
+        if self.class_cache is not None:
+            cache.store(cache_key, maxk, camb_outdir, camb_files)
         print("cambfile: done.", datetime.datetime.now(),"\n")
         return camb_output
 
+    def _emulate_cambfile(self, camb_outdir: str, text_zstrs: List[str]) -> None:
+        """
+        Write the linear matter power files predicted by the linear emulator.
+        No transfer functions are written, so the folder is only for dry runs.
+        """
+        print("cambfile: predicting the linear power with {}...".format(self.linear_emulator))
+        emu = lemu.LinearPowerEmulator.load(self.linear_emulator)
+        if not emu.in_bounds(self.__dict__):
+            print("cambfile: Warning: outside the training range of the emulator")
+
+        for zstr in text_zstrs:
+            kk, pk_lin, err = emu.predict(self.__dict__, redshift=float(zstr))
+            classio.save_matterpow(kk, pk_lin,
+                os.path.join(camb_outdir, classio.matterpow_fn(zstr)))
+            print("cambfile: z = {}: max estimated P(k) error {:.1e}".format(zstr, np.max(err)))
+
+        #in the json, to compare with the Latin design
+        self.emulated_sigma8, self.emulated_sigma8_err = emu.sigma8(self.__dict__, redshift=0.)
+        print("cambfile: sigma8 = {:.4f} +- {:.4f}".format(
+            self.emulated_sigma8, self.emulated_sigma8_err))
+
     def _camb_zstr(self, zz : float) -> str:
         """Get the formatted redshift for CAMB output files."""
         if zz > 10:
@@ -414,6 +609,19 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         os.path.join(genicout, genicfile) (str) : path to genic file
         config.filename (str):  genicout filename
         """
+        config = self._genic_config(camb_output)
+
+        try:
+            os.mkdir(os.path.join(self.outdir, config['OutputDir']))
+        except FileExistsError:
+            pass
+
+        config.write()
+
+        return (os.path.join(config['OutputDir'], config['FileBase']), config.filename)
+
+    def _genic_config(self, camb_output : str) -> configobj.ConfigObj:
+        """The GenIC parameters, not yet written to disc"""
         config = configobj.ConfigObj(self.genicdefault)
         
         config.filename   = os.path.join(self.outdir, self.genicout)
@@ -421,11 +629,6 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
 
         genicout = "ICS"
 
-        try:
-            os.mkdir(os.path.join(self.outdir, genicout))
-        except FileExistsError:
-            pass
-
         config['OutputDir'] = genicout
 
         #Is this enough information, or should I add a short hash?
@@ -486,9 +689,8 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
 
         config = self._genicfile_child_options(config)
         config.update(self._cluster.cluster_runtime())
-        config.write()
 
-        return (os.path.join(genicout, genicfile), config.filename)
+        return config
 
     def _alter_power(self, camb_output: str) -> None:
         """
@@ -582,17 +784,24 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         g_config_filename = os.path.join(self.outdir, self.gadgetconfig)
 
         with open(g_config_filename,'w') as config:
-            config.write("MPICC = mpicc\nMPICXX = mpic++\n")
-            optimize = self._cluster.cluster_optimize()
-            config.write("OPTIMIZE = "+optimize+"\n")
-            config.write(str(
-                "GSL_INCL = $(shell gsl-config --cflags)\n"
-                "GSL_LIBS = $(shell gsl-config --libs)\n"))
-            self._cluster.cluster_config_options(config, prefix)
-            # self._gadget3_child_options(config, prefix)
+            config.write(self._gadget3config_str(prefix))
 
         return g_config_filename
 
+    def _gadget3config_str(self, prefix: str = "OPT += -D") -> str:
+        """The contents of the MP-Gadget Options.mk"""
+        config = io.StringIO()
+        config.write("MPICC = mpicc\nMPICXX = mpic++\n")
+        optimize = self._cluster.cluster_optimize()
+        config.write("OPTIMIZE = "+optimize+"\n")
+        config.write(str(
+            "GSL_INCL = $(shell gsl-config --cflags)\n"
+            "GSL_LIBS = $(shell gsl-config --libs)\n"))
+        self._cluster.cluster_config_options(config, prefix)
+        # self._gadget3_child_options(config, prefix)
+
+        return config.getvalue()
+
     # unknown function here
     # def _gadget3_child_options(self, _, __) ->:
     #     """Gadget-3 compilation options for Config.sh which should be written by
@@ -607,6 +816,19 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         ----
             genicfileout (str) - where the ICs are saved
         """
+        config = self._gadget_config(genicfileout)
+
+        try:
+            os.mkdir(os.path.join(self.outdir, config['OutputDir']))
+        except FileExistsError:
+            pass
+
+        config.write()
+
+        return
+
+    def _gadget_config(self, genicfileout: str) -> configobj.ConfigObj:
+        """The MP-Gadget parameters, not yet written to disc"""
         config   = configobj.ConfigObj()
         filename = os.path.join(self.outdir, self.gadgetparam)
         
@@ -615,11 +837,6 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         config['InitCondFile'] = genicfileout
         config['OutputDir']    = "output"
 
-        try:
-            os.mkdir(os.path.join(self.outdir, "output"))
-        except FileExistsError:
-            pass
-
         config['TimeLimitCPU'] = int(60 * 60 * self._cluster.timelimit - 300)
         config['TimeMax']      = 1. / (1 + self.redend)
         config['Omega0']       = self.omega0
@@ -665,7 +882,7 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         #In equilibrium with the CMB at early times.
         config['InitGasTemp'] = 2.7*(1+self.redshift)
         config['DensityIndependentSphOn'] = 1
-        config['PartAllocFactor'] = 2
+        config['PartAllocFactor'] = self._cluster.part_alloc_factor
         config['WindOn'] = 0
         config['WindModel'] = 'nowind'
         config['BlackHoleOn'] = 0
@@ -690,9 +907,8 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         #Add other config parameters
         config = self._other_params(config)
         config.update(self._cluster.cluster_runtime())
-        config.write()
 
-        return
+        return config
 
     # def _sfr_params(self, config):
     #     """Config parameters for the default Springel & Hernquist star formation model"""
@@ -710,15 +926,10 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
 
     def generate_times(self) -> np.ndarray:
         """List of output times for a simulation. Can be overridden."""
-        astart = 1. / (1 + self.redshift)
-        aend   = 1. / (1 + self.redend  )
-
-        times = np.array([0.02, 0.1, 0.2, 0.25, 0.3333, 0.5, 0.66667, 0.83333])
+        times = output_times(self.redshift, self.redend)
+        assert np.size(times) > 0
 
-        ii = np.where((times > astart) * (times < aend))
-        assert np.size(times[ii]) > 0
-
-        return times[ii]
+        return times
 
     def do_gadget_build(self, gadget_config: str) -> None:
         """Make a gadget build and check it succeeded."""
@@ -755,9 +966,7 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         
 
         #Generate an mpi_submit for genic
-        zstr = self._camb_zstr(self.redshift)
-        check_ics = "{} cambpower.py {} --czstr {} --mnu {}".format(
-            self.python, genicout, zstr, str(self.m_nu))
+        check_ics = self._check_ics_command(genicout)
 
         self._cluster.generate_mpi_submit_one(self.outdir, extracommand=check_ics)
         # if return_str:
@@ -767,83 +976,217 @@ n_s    = {}; rscatter = {}; m_nu = {}; nu_hierarchy = {}; w0 = {}; wa = {};
         # self._cluster.generate_mpi_submit_genic(
             # self.outdir, extracommand=check_ics)            
 
-        #Copy the power spectrum routine
-        shutil.copy(os.path.join(os.path.dirname(__file__), "cambpower.py"),
-            os.path.join(self.outdir, "cambpower.py"))
+        #Copy the power spectrum routine, unless it is there already
+        cambpower_src = os.path.join(os.path.dirname(__file__), "cambpower.py")
+        cambpower_dst = os.path.join(self.outdir, "cambpower.py")
+        if not (os.path.exists(cambpower_dst)
+                and filecmp.cmp(cambpower_src, cambpower_dst, shallow=False)):
+            shutil.copy(cambpower_src, cambpower_dst)
+
+    def _check_ics_command(self, genicout: str) -> Optional[str]:
+        """Command checking the power spectrum of the ICs at the end of the IC job, if any"""
+        if not self.check_ics_in_job:
+            return None
+        zstr = self._camb_zstr(self.redshift)
+        return "{} cambpower.py {} --czstr {} --mnu {}".format(
+            self.python, genicout, zstr, str(self.m_nu))
 
-    def make_simulation(self, pkaccuracy: float = 0.05,
-            do_build: bool = False) -> str:
-        """Wrapper function to make the simulation ICs."""
-        #First generate the input files for CAMB
-        print("Making simulation submission files,", datetime.datetime.now())
+    def _run_stage(self, stages: StageRecord, stage: str, inputs: dict,
+            run: Callable[[], Any], outputs: List[str], deps: Sequence[str] = (),
+            attrs: Sequence[str] = ()) -> Any:
+        """
+        Run a stage of make_simulation, unless its inputs are unchanged since
+        it was recorded in the output directory.
+
+        Parameters:
+        ----
+        stages (StageRecord) : the stages recorded in outdir
+        stage (str)     : name of the stage
+        inputs (dict)   : everything the outputs depend on, json-like
+        run (callable)  : run() makes the outputs
+        outputs (list)  : files written by run, relative to outdir
+        deps (list)     : stages whose outputs run reads
+        attrs (list)    : attributes set by run, restored when skipped
+
+        Returns:
+        ----
+        the return value of run, or the recorded one if skipped
+        """
+        key = stages.key(stage, inputs, deps)
+        if stages.up_to_date(stage, key):
+            print("Make simulation: {} is up to date, skipping.".format(stage))
+            self.__dict__.update(stages.attrs(stage))
+            return stages.result(stage)
+
+        result = run()
+        stages.record(stage, key, outputs, result=result,
+            attrs={attr: getattr(self, attr) for attr in attrs if hasattr(self, attr)})
+        return result
+
+    def _class_stage(self) -> str:
+        """Run CLASS and change the power spectrum file if we want to do that"""
         print("Make simulation: generating the input file for CAMB...")
         camb_output = self.cambfile()
 
-        #Then run CAMB
-        print("Make simulation: running CAMB...")
-        self.camb_git = classylss.__version__
-
-        #Change the power spectrum file on disc if we want to do that
+        #Change the power spectrum file on disc if we want to do that:
+        #it may be a hard link into the CLASS cache, which must not change
         print("Make simulation: changing the power spectrum file on disc...")
+        matterpow = os.path.join(self.outdir, camb_output, classio.matterpow_fn(self._camb_zstr(self.redshift)))
+        if os.path.exists(matterpow):
+            classio.detach_file(matterpow)
         self._alter_power(os.path.join(self.outdir,camb_output))
+        return camb_output
+
+    def make_simulation(self, pkaccuracy: float = 0.05,
+            do_build: bool = False, incremental: bool = True) -> str:
+        """
+        Wrapper function to make the simulation ICs.
+
+        Each stage records a hash of its inputs in outdir/_stages.json, and is
+        skipped when rerun with the same inputs (see stages.py). Changing the
+        walltime of an existing folder only rewrites mpgadget.param and
+        mpi_submit_one. incremental=False regenerates everything.
+        """
+        print("Making simulation submission files,", datetime.datetime.now())
+        stages = StageRecord(self.outdir, incremental=incremental)
+
+        #First run CLASS. Everything in the output depends on pre_params;
+        # the subclass may alter the power spectrum.
+        self._tune_nu_acc()
+        pre_params, camb_zz, _ = self.class_params()
+        zstr = self._camb_zstr(self.redshift)
+        class_files = [classio.matterpow_fn(zstr)]
+        if self.linear_emulator is None:
+            class_files.append(classio.transfer_fn(zstr))
+        class_inputs = {"pre_params": pre_params, "camb_zz": camb_zz,
+            "all_class_text": self.all_class_text, "class": type(self).__qualname__,
+            "linear_emulator": self.linear_emulator,
+            "linear_emulator_mtime": os.path.getmtime(self.linear_emulator)
+                if self.linear_emulator is not None else None}
+        camb_output = self._run_stage(stages, "class", class_inputs, self._class_stage,
+            outputs=[os.path.join("camb_linear", fn) for fn in class_files],
+            attrs=["camb_git", "cambfile_timings", "emulated_sigma8", "emulated_sigma8_err"])
 
         #Now generate the GenIC parameters
         print("Make simulation: generating the GenIC parameters...")
-        (genic_output, genic_param) = self.genicfile(camb_output)
+        genic_config = self._genic_config(camb_output)
+        genic_output = os.path.join(genic_config['OutputDir'], genic_config['FileBase'])
+        genic_param  = genic_config.filename
+        self._run_stage(stages, "genic", dict(genic_config),
+            lambda: self.genicfile(camb_output), outputs=[self.genicout], deps=["class"])
 
-        #Save a json of ourselves.
+        #Save a json of ourselves. Always rewritten: it records this run
         # self.json to get the json dict variable
         self.txt_description()
 
         #Check that the ICs have the right power spectrum
         #Generate Gadget makefile
         print("Make simulation: generating Gadget makefile...")
-        gadget_config = self.gadget3config()
+        gadget_config = os.path.join(self.outdir, self.gadgetconfig)
+        self._run_stage(stages, "gadget_config", {"options": self._gadget3config_str()},
+            self.gadget3config, outputs=[self.gadgetconfig])
 
         #Symlink the new gadget config to the source directory
         #Generate Gadget parameter file
         print("Make simulation: generating Gadget parameter file...")
-        self.gadget3params(genic_output)
+        self._run_stage(stages, "gadget_params", dict(self._gadget_config(genic_output)),
+            lambda: self.gadget3params(genic_output), outputs=[self.gadgetparam])
 
         #Generate mpi_submit file
         print("Make simulation: generate mpi_submit file...")
-        self.generate_mpi_submit(genic_output)
-        
+        with open(os.path.join(os.path.dirname(__file__), "cambpower.py"), "rb") as f:
+            cambpower_hash = hashlib.sha256(f.read()).hexdigest()
+        submit_inputs = {"cluster": type(self._cluster).__qualname__,
+            "settings": vars(self._cluster), "check_ics": self._check_ics_command(genic_output),
+            "cambpower": cambpower_hash}
+        self._run_stage(stages, "mpi_submit", submit_inputs,
+            lambda: self.generate_mpi_submit(genic_output),
+            outputs=["mpi_submit_one", "cambpower.py"])
 
         #Run MP-GenIC
         #Compile from source; usually not need
         if do_build:
-            subprocess.check_call(
-                [os.path.join(os.path.join(self.gadget_dir, "genic"),
-                                           self.genicexe), 
-                              genic_param],
-                cwd=self.outdir)
-
-            zstr = self._camb_zstr(self.redshift)
-            cambpower.check_ic_power_spectra(genic_output, camb_zstr=zstr,
-                m_nu=self.m_nu, outdir=self.outdir, accuracy=pkaccuracy)
-
-            self.do_gadget_build(gadget_config)
+            def run_genic() -> None:
+                subprocess.check_call(
+                    [os.path.join(os.path.join(self.gadget_dir, "genic"),
+                                               self.genicexe), 
+                                  genic_param],
+                    cwd=self.outdir)
+
+                # nbodykit and matplotlib are only needed to check the ICs
+                from . import cambpower
+
+                cambpower.check_ic_power_spectra(genic_output, camb_zstr=zstr,
+                    m_nu=self.m_nu, outdir=self.outdir, accuracy=pkaccuracy)
+
+            self._run_stage(stages, "genic_run", {"accuracy": pkaccuracy}, run_genic,
+                outputs=[genic_output], deps=["genic"])
+
+            gadget_binary = os.path.join(os.path.join(self.gadget_dir, "gadget"), self.gadgetexe)
+            self._run_stage(stages, "gadget_build",
+                {"gadget_dir": self.gadget_dir, "gadget_git": utils.get_git_hash(gadget_binary)},
+                lambda: self.do_gadget_build(gadget_config), outputs=[self.gadgetexe],
+                deps=["gadget_config"], attrs=["gadget_git", "make_output"])
         print("Make simulation: done.", datetime.datetime.now(),"\n")
         return gadget_config
         
 
-def save_transfer(transfer: np.ndarray, transferfile: str) -> None:
+def output_times(redshift: float, redend: float) -> np.ndarray:
+    """The default output scale factors between redshift and redend"""
+    astart = 1. / (1 + redshift)
+    aend   = 1. / (1 + redend  )
+
+    times = np.array([0.02, 0.1, 0.2, 0.25, 0.3333, 0.5, 0.66667, 0.83333])
+
+    ii = np.where((times > astart) * (times < aend))
+    return times[ii]
+
+def parameter_errors(params: dict) -> List[str]:
     """
-    Save a transfer function. Note we save the CLASS FORMATTED transfer functions.
-    The transfer functions differ from CAMB by:
-        T_CAMB(k) = -T_CLASS(k)/k^2
+    Check SimulationICs arguments without making anything.
+
+    Parameters:
+    ----
+    params (dict) : every argument of SimulationICs.__init__
+
+    Returns:
+    ----
+    errors (list) : what is wrong with the parameters; empty if they are fine
     """
-    header="""Transfer functions T_i(k) for adiabatic (AD) mode (normalized to initial curvature=1)
-d_i   stands for (delta rho_i/rho_i)(k,z) with above normalization
-d_tot stands for (delta rho_tot/rho_tot)(k,z) with rho_Lambda NOT included in rho_tot
-(note that this differs from the transfer function output from CAMB/CMBFAST, which gives the same
- quantities divided by -k^2 with k in Mpc^-1; use format=camb to match CAMB)
-t_i   stands for theta_i(k,z) with above normalization
-t_tot stands for (sum_i [rho_i+p_i] theta_i)/(sum_i [rho_i+p_i]))(k,z)
-%s""" % " ".join(f"{index}. {item} " for index, item in enumerate(transfer.dtype.names, start=1))
-    #This format matches the default output by CLASS command line.
-    np.savetxt(transferfile, transfer, header=header)
+    #Physically reasonable, with the units of SimulationICs
+    checks = [
+        ("box",         params["box"] < 20000, "< 20000"),
+        ("npart",       1 < params["npart"] < 16000, "in (1, 16000)"),
+        ("omega0",      0 < params["omega0"] <= 1, "in (0, 1]"),
+        ("omegab",      0 < params["omegab"] < 1, "in (0, 1)"),
+        ("redshift",    1 < params["redshift"] < 1100, "in (1, 1100)"),
+        ("redend",      0 <= params["redend"] < 1100, "in [0, 1100)"),
+        ("hubble",      0 < params["hubble"] < 1, "in (0, 1)"),
+        ("scalar_amp",  0 < params["scalar_amp"] < 1e-7, "in (0, 1e-7)"),
+        ("ns",          0 < params["ns"] < 2, "in (0, 2)"),
+        ("N_ur",        params["N_ur"] >= 0, ">= 0"),
+        ("alpha_s",     -1 < params["alpha_s"] < 1, "in (-1, 1)"),
+        ("MWDM_therm",  params["MWDM_therm"] >= 0, ">= 0"),
+        ("nu_accuracy", params["nu_accuracy"] is None or params["nu_accuracy"] > 0, "> 0"),
+        ("class_preset", params["class_preset"] in classpresets.class_presets,
+            "one of {}".format(list(classpresets.class_presets))),
+        # the other presets floor tol_ncdm: the candidates would all run alike
+        ("nu_accuracy", params["nu_accuracy"] is None or classpresets.class_nu_presets.get(
+            params["class_preset"], {}).get("tol_ncdm_min", 0) is None,
+            "None unless the class_preset has no tol_ncdm_min, e.g. production"),
+        ("linear_emulator", params["linear_emulator"] is None or params["class_preset"] == "preview",
+            "None unless class_preset is preview"),
+        ("class_write_workers", params["class_write_workers"] > 0, "> 0"),
+        ("uvb",         params["uvb"] in ("hm", "fg", "sh", "pu"), "one of hm, fg, sh, pu"),
+    ]
+    errors = ["{} = {} should be {}".format(name, params[name], requirement)
+        for name, ok, requirement in checks if not ok]
+
+    #MP-Gadget needs at least one output
+    if not errors and np.size(output_times(params["redshift"], params["redend"])) == 0:
+        errors.append("no output times between redshift {} and redend {}".format(
+            params["redshift"], params["redend"]))
+    return errors
 
 def get_neutrino_masses(total_mass: float, hierarchy: str) -> np.ndarray:
     """Get the three neutrino masses, including the mass splittings.
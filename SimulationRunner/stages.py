@@ -0,0 +1,89 @@
+"""
+Input hashes of the make_simulation() stages of a simulation folder, so a
+rerun of the driver over an existing suite only redoes the stages whose
+inputs changed.
+
+Each stage (CLASS, the GenIC parameters, the Gadget parameters, the
+submission script, ...) has a dict of everything its output depends on. The
+key of a stage is a hash of that dict and of the keys of the stages it
+depends on, so rerunning CLASS also reruns GenIC. A stage is up to date if
+its recorded key matches and its output files are all there.
+
+Layout:
+----
+<outdir>/_stages.json : {stage: {"key", "outputs", "result", "attrs"}}
+"""
+from typing import Any, Dict, List, Optional, Sequence
+import os
+import json
+from .classcache import canonical_hash
+
+stages_fn = "_stages.json"
+
+
+class StageRecord(object):
+    """
+    The stages recorded in a simulation folder.
+
+    Parameters:
+    ----
+    outdir (str)       : simulation folder
+    incremental (bool) : if False, no stage is ever up to date, so
+        everything is regenerated (and recorded again).
+    """
+
+    def __init__(self, outdir: str, incremental: bool = True) -> None:
+        self.outdir      = outdir
+        self.filename    = os.path.join(outdir, stages_fn)
+        self.incremental = incremental
+
+        self.records: Dict[str, dict] = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, "r") as f:
+                self.records = json.load(f)
+
+    def key(self, stage: str, inputs: dict, deps: Sequence[str] = ()) -> str:
+        """
+        Hash of the inputs of a stage and of the current keys of the stages
+        it depends on, which must have been recorded already.
+        """
+        return canonical_hash({"stage": stage, "inputs": inputs,
+            "deps": {dep: self.records[dep]["key"] for dep in deps}})
+
+    def up_to_date(self, stage: str, key: str) -> bool:
+        """Whether the stage was recorded with this key and its outputs exist"""
+        if not self.incremental or stage not in self.records:
+            return False
+        record = self.records[stage]
+        return record["key"] == key and all(
+            os.path.exists(os.path.join(self.outdir, fn)) for fn in record["outputs"])
+
+    def record(self, stage: str, key: str, outputs: List[str],
+            result: Any = None, attrs: Optional[dict] = None) -> None:
+        """
+        Record a stage which has just run.
+
+        Parameters:
+        ----
+        key (str)      : from StageRecord.key
+        outputs (list) : files the stage wrote, relative to outdir
+        result         : return value of the stage, given back when skipped.
+            Must be json-serializable.
+        attrs (dict)   : attributes the stage set, restored when skipped
+        """
+        self.records[stage] = {"key": key, "outputs": list(outputs),
+            "result": result, "attrs": {} if attrs is None else attrs}
+
+        #Atomic, so an interrupted run never leaves half a file
+        tmpfile = self.filename + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump(self.records, f, indent=2)
+        os.replace(tmpfile, self.filename)
+
+    def result(self, stage: str) -> Any:
+        """The recorded return value of a stage"""
+        return self.records[stage]["result"]
+
+    def attrs(self, stage: str) -> dict:
+        """The recorded attributes set by a stage"""
+        return self.records[stage]["attrs"]
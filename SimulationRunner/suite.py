@@ -0,0 +1,359 @@
+"""
+Build the simulation directories of a whole Latin hypercube on one node.
+
+SimulationSuite reads a Latin hypercube json (the format written by
+latin_design.matter_power_design and read by take_params_dict) and fans
+SimulationICs.make_simulation out over a bounded process pool, instead of
+submitting one job per Latin point.
+
+Command line:
+----
+python -m SimulationRunner.suite --json_file=matterLatin_11p_90x3.json
+    --box=100 --npart=75 --outdir_base=cosmo_11p --workers=32
+    --cluster_class=clusters.BIOClass --gadget_dir=~/bigdata/MP-Gadget/
+"""
+from typing import Dict, Generator, List, Optional, Tuple, Type
+import os
+import json
+import math
+import time
+import inspect
+import datetime
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import clusters
+from . import classpresets
+from . import costmodel
+from . import utils
+from .multi_sims import take_params_dict
+
+# Latin hypercube parameter names -> SimulationICs keyword arguments.
+# Same mapping as make_sub/make_gen_sub.py -> make_sub/make_sim_sub.py.
+latin_to_simulationics = {
+    "omega0"     : "omega0",
+    "omegab"     : "omegab",
+    "hubble"     : "hubble",
+    "scalar_amp" : "scalar_amp",
+    "ns"         : "ns",
+    "w0"         : "w0_fld",
+    "wa"         : "wa_fld",
+    "mnu"        : "m_nu",
+    "Neff"       : "N_ur",
+    "alphas"     : "alpha_s",
+}
+
+# outdir auto generated, since we will have many folders
+fn_suite_outdir = lambda base, box, npart, i: "{}_Box{}_Part{}_{}".format(
+    base, box, npart, str(i).zfill(4))
+
+
+def _make_one(index: int, sim_kwargs: dict, pkaccuracy: float,
+        incremental: bool = True) -> Tuple[int, float, Optional[str]]:
+    """
+    Make a single simulation directory, in a worker process.
+
+    Returns:
+    ----
+    (index, wall time in seconds, traceback string or None if it worked)
+    """
+    start = time.time()
+    try:
+        # imported here so the parent process never needs classylss
+        from .simulationics import SimulationICs
+
+        sim = SimulationICs(**sim_kwargs)
+        sim.make_simulation(pkaccuracy=pkaccuracy, incremental=incremental)
+    except Exception:
+        return index, time.time() - start, traceback.format_exc()
+
+    return index, time.time() - start, None
+
+
+class SimulationSuite(object):
+    """
+    A Latin hypercube of simulations at a single fidelity (box, npart).
+
+    Parameters:
+    ----
+    Latin_json (str)     : path to the Latin hypercube json file
+    box (int)            : box size in Mpc/h
+    npart (int)          : cube root of number of particles
+    outdir_base (str)    : prefix of the simulation directories, which are
+        named {outdir_base}_Box{box}_Part{npart}_{index:04d}
+    cluster_class (type) : a clusters.ClusterClass subclass
+    points (list)        : indices of the Latin points to build; all if None
+    **sim_kwargs         : other SimulationICs arguments shared by all points,
+        e.g. gadget_dir, nproc, cores, mpi_ranks, threads, class_cache.
+    """
+
+    def __init__(self, Latin_json: str, box: int, npart: int,
+            outdir_base: str = "cosmo",
+            cluster_class: Type[clusters.ClusterClass] = clusters.BIOClass,
+            points: Optional[List[int]] = None, **sim_kwargs) -> None:
+        self.Latin_json = Latin_json
+        with open(Latin_json, "r") as f:
+            self.Latin_dict = json.load(f)
+
+        self.param_dicts = list(take_params_dict(self.Latin_dict))
+
+        unknown = set(self.Latin_dict["parameter_names"]) - set(latin_to_simulationics)
+        if unknown:
+            print("Warning: parameters {} are not passed to SimulationICs".format(
+                sorted(unknown)))
+
+        if points is None:
+            points = list(range(len(self.param_dicts)))
+        assert all(0 <= i < len(self.param_dicts) for i in points)
+        self.points = list(points)
+
+        self.box           = box
+        self.npart         = npart
+        self.outdir_base   = os.path.expanduser(outdir_base)
+        self.cluster_class = cluster_class
+        self.sim_kwargs    = sim_kwargs
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def outdir(self, index: int) -> str:
+        """The simulation directory of a Latin point"""
+        return fn_suite_outdir(self.outdir_base, self.box, self.npart, index)
+
+    def simulation_kwargs(self, index: int) -> dict:
+        """SimulationICs arguments for a Latin point"""
+        kwargs = dict(self.sim_kwargs)
+        for name, val in self.param_dicts[index].items():
+            if name in latin_to_simulationics:
+                kwargs[latin_to_simulationics[name]] = val
+
+        #Tune the neutrino tolerance once for the whole mass range of the design
+        if kwargs.get("nu_accuracy") is not None and "nu_mnu_bounds" not in kwargs \
+                and "mnu" in self.Latin_dict["parameter_names"]:
+            ii = self.Latin_dict["parameter_names"].index("mnu")
+            kwargs["nu_mnu_bounds"] = tuple(self.Latin_dict["bounds"][ii])
+
+        kwargs["box"]           = self.box
+        kwargs["npart"]         = self.npart
+        kwargs["outdir"]        = self.outdir(index)
+        kwargs["cluster_class"] = self.cluster_class
+
+        return kwargs
+
+    def iter_simulation_kwargs(self) -> Generator:
+        """(index, SimulationICs arguments) for every point in the suite"""
+        for index in self.points:
+            yield index, self.simulation_kwargs(index)
+
+    def make_simulations(self, workers: Optional[int] = None,
+            omp_threads: int = 1, pkaccuracy: float = 0.07,
+            report: Optional[str] = None,
+            incremental: bool = True) -> Dict[int, Optional[str]]:
+        """
+        Make all the simulation directories with a pool of worker processes.
+        A failing point does not stop the others.
+
+        Parameters:
+        ----
+        workers (int)     : number of processes; defaults to the cores
+            available to this job.
+        omp_threads (int) : OpenMP threads for each CLASS run.
+        pkaccuracy (float): passed to make_simulation.
+        report (str)      : where to write a json summary of the run.
+            Default: {outdir_base}_Box{box}_Part{npart}_suite.json
+        incremental (bool): skip the stages of existing directories whose
+            inputs are unchanged; see make_simulation.
+
+        Returns:
+        ----
+        failures (dict) : Latin index -> traceback of every failed point
+        """
+        if workers is None:
+            workers = utils.available_cores()
+        workers = max(1, min(workers, len(self)))
+
+        print("SimulationSuite: making {} simulations with {} workers,".format(
+            len(self), workers), datetime.datetime.now())
+
+        start = time.time()
+        timings: Dict[int, float] = {}
+        failures: Dict[int, Optional[str]] = {}
+
+        # keep each CLASS run from spreading over the whole node
+        with ProcessPoolExecutor(max_workers=workers, initializer=utils.limit_threads,
+                initargs=(omp_threads,)) as pool:
+            futures = {
+                pool.submit(_make_one, index, kwargs, pkaccuracy, incremental): index
+                for index, kwargs in self.iter_simulation_kwargs()
+            }
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                index = futures[future]
+                try:
+                    _, elapsed, error = future.result()
+                except Exception:
+                    # e.g. the worker was killed: BrokenProcessPool
+                    elapsed, error = float("nan"), traceback.format_exc()
+
+                timings[index] = elapsed
+                if error is not None:
+                    failures[index] = error
+
+                # progress report
+                spent = time.time() - start
+                eta   = spent / done * (len(self) - done)
+                print("SimulationSuite: [{}/{}] {} {} in {:.1f}s; {} failed; ETA {:.0f}s".format(
+                    done, len(self), self.outdir(index),
+                    "FAILED" if error is not None else "done",
+                    elapsed, len(failures), eta))
+
+        for index in sorted(failures):
+            print("SimulationSuite: {} failed:\n{}".format(self.outdir(index), failures[index]))
+
+        if report is None:
+            report = "{}_Box{}_Part{}_suite.json".format(self.outdir_base, self.box, self.npart)
+        with open(report, "w") as f:
+            json.dump({
+                "Latin_json" : os.path.realpath(self.Latin_json),
+                "outdirs"    : {str(i): self.outdir(i) for i in self.points},
+                "wall_time"  : time.time() - start,
+                "timings"    : {str(i): t for i, t in sorted(timings.items())},
+                "failures"   : {str(i): e for i, e in sorted(failures.items())},
+            }, f, indent=2)
+
+        print("SimulationSuite: done, {} of {} failed,".format(len(failures), len(self)),
+            datetime.datetime.now())
+        return failures
+
+    def plan(self, verbose: bool = True, class_timings: Optional[str] = None) -> dict:
+        """
+        Dry run: check every point against the SimulationICs constraints and
+        predict what the suite costs, without writing anything or running
+        CLASS or GenIC. CLASS times ignore the CLASS cache, and are the
+        placeholders of classpresets.class_time_estimates unless
+        class_timings, measured by benchmarks/bench_class_presets.py, is given.
+
+        Returns:
+        ----
+        plan (dict) : "points" {index: cost of the point}, "invalid"
+            {index: what is wrong with it}, "total": class_hours,
+            genic_node_hours, gadget_node_hours, and disk_ics, disk_part,
+            disk_power in bytes, and "class_source", where the CLASS
+            times come from
+        """
+        # no classylss or nbodykit in there
+        from .simulationics import SimulationICs, parameter_errors, output_times
+
+        class_times, class_source = classpresets.class_times(class_timings)
+        signature = inspect.signature(SimulationICs.__init__)
+        points: Dict[int, dict] = {}
+        invalid: Dict[int, List[str]] = {}
+        for index, kwargs in self.iter_simulation_kwargs():
+            try:
+                bound = signature.bind_partial(**kwargs)
+            except TypeError as err:
+                invalid[index] = [str(err)]
+                continue
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            params.pop("self", None)
+
+            errors = parameter_errors(params)
+            if errors:
+                invalid[index] = errors
+                continue
+
+            model = costmodel.CostModel()
+            if params["cost_calibration"] is not None:
+                model = costmodel.CostModel.load(params["cost_calibration"])
+            cluster = params["cluster_class"](nproc=params["nproc"], cores=params["cores"],
+                mpi_ranks=params["mpi_ranks"], threads=params["threads"],
+                gadget_dir=params["gadget_dir"])
+            estimate = cluster.size_from_cost_model(model, params["box"], params["npart"],
+                params["redshift"], params["redend"], params["m_nu"])
+
+            nodes = cluster.nodes()
+            class_time = class_times[params["class_preset"]][
+                int(params["m_nu"] > 0)]
+            # the final snapshot at TimeMax is written as well
+            n_snapshots = len(output_times(params["redshift"], params["redend"])) + 1
+            disk = model.disk_usage(params["npart"], params["redshift"], params["redend"],
+                n_snapshots)
+
+            gadget_hours = estimate["walltime"] / model.wall_safety / 3600
+            points[index] = {
+                "class_hours"       : class_time / 3600,
+                "genic_node_hours"  : nodes * model.genic_walltime(params["npart"],
+                    params["nproc"]) / 3600,
+                "gadget_node_hours" : nodes * gadget_hours,
+                # jobs needed at the walltime the queue allows
+                "jobs"              : math.ceil(gadget_hours * model.wall_safety / cluster.timelimit),
+                "memory_per_node"   : estimate["memory_per_node"],
+                "disk_ics"          : disk["ics"],
+                "disk_part"         : disk["part"],
+                "disk_power"        : disk["power"],
+            }
+
+        total_keys = ["class_hours", "genic_node_hours", "gadget_node_hours",
+            "disk_ics", "disk_part", "disk_power"]
+        total = {key: sum(point[key] for point in points.values()) for key in total_keys}
+
+        if verbose:
+            print("Plan of {}_Box{}_Part{}: {} points, {} invalid".format(
+                self.outdir_base, self.box, self.npart, len(self), len(invalid)))
+            for index in sorted(invalid):
+                print("  {}: {}".format(self.outdir(index), "; ".join(invalid[index])))
+            print("  CLASS {:.2f} hours ({}); GenIC {:.1f} node-hours; Gadget {:.1f} node-hours".format(
+                total["class_hours"], class_source, total["genic_node_hours"],
+                total["gadget_node_hours"]))
+            print("  disk: ICs {:.1f} GB, PART {:.1f} GB, power {:.3f} GB".format(
+                total["disk_ics"] / 1e9, total["disk_part"] / 1e9, total["disk_power"] / 1e9))
+            if points:
+                print("  {:.0f} MB per node; up to {} jobs per simulation".format(
+                    max(point["memory_per_node"] for point in points.values()),
+                    max(point["jobs"] for point in points.values())))
+
+        return {"points": points, "invalid": invalid, "total": total,
+            "class_source": class_source}
+
+
+def get_cluster_class(name: str) -> Type[clusters.ClusterClass]:
+    """'clusters.BIOClass' or 'BIOClass' -> clusters.BIOClass"""
+    return getattr(clusters, name.split(".")[-1])
+
+
+def suite_from_args(args: argparse.Namespace, box: Optional[int] = None,
+        npart: Optional[int] = None) -> SimulationSuite:
+    """The suite of parsed command line options, at another fidelity if given"""
+    points = None
+    if args.points is not None:
+        points = [int(num) for num in args.points.split(",")]
+
+    return SimulationSuite(args.json_file,
+        box=args.box if box is None else box, npart=args.npart if npart is None else npart,
+        outdir_base=args.outdir_base,
+        cluster_class=get_cluster_class(args.cluster_class), points=points,
+        gadget_dir=args.gadget_dir, python=args.python,
+        nproc=args.nproc, cores=args.cores, mpi_ranks=args.mpi_ranks,
+        threads=args.threads, class_cache=args.class_cache,
+        class_preset=args.class_preset, nu_accuracy=args.nu_accuracy,
+        cost_model=args.cost_model, cost_calibration=args.cost_calibration,
+        check_ics_in_job=not args.no_check_ics)
+
+
+def main(args: argparse.Namespace) -> int:
+    """Make the suite from parsed command line options; returns the exit code"""
+    suite = suite_from_args(args)
+
+    failures = suite.make_simulations(workers=args.workers, omp_threads=args.omp_threads,
+        incremental=not args.regenerate)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    from .cli import add_suite_arguments
+
+    parser = argparse.ArgumentParser()
+    add_suite_arguments(parser)
+    raise SystemExit(main(parser.parse_args()))
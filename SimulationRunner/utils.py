@@ -11,3 +11,27 @@ def get_git_hash(path):
         rpath = os.path.dirname(rpath)
     commit_hash = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd = rpath, universal_newlines=True)
     return commit_hash
+
+# thread counts read by OpenMP and the BLAS libraries when they start
+thread_env_vars = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+def available_cores():
+    """Number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+def limit_threads(threads):
+    """Limit the OpenMP and BLAS threads of this process, e.g. a pool worker.
+
+    The environment variables only reach the libraries loaded after this
+    call: the thread pools of those already loaded, e.g. inherited from
+    the parent of a forked worker, are resized with threadpoolctl, if it
+    is installed."""
+    for var in thread_env_vars:
+        os.environ[var] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=threads)
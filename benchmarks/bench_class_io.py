@@ -0,0 +1,94 @@
+"""
+Benchmark loading the CLASS outputs of a simulation from the text files
+against the binary class_output.npz.
+
+Also times writing the text files of all redshifts serially and with the
+thread pool cambfile uses.
+
+python benchmarks/bench_class_io.py --nk=5000 --nz=10 --workers=4
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from SimulationRunner import classio
+
+# transfer columns CLASS gives with three massive neutrinos and extra metric
+# transfer functions
+transfer_names = ["k", "d_g", "d_b", "d_cdm", "d_ur", "d_ncdm[0]", "d_ncdm[1]",
+    "d_ncdm[2]", "d_tot", "phi", "psi", "h", "h_prime", "eta", "eta_prime",
+    "t_g", "t_b", "t_ur", "t_ncdm[0]", "t_ncdm[1]", "t_ncdm[2]", "t_tot"]
+
+
+def fake_transfer(nk: int, rng: np.random.Generator) -> np.ndarray:
+    """A structured array shaped like CLASS.Spectra.get_transfer"""
+    trans = np.zeros(nk, dtype=[(name, "f8") for name in transfer_names])
+    for name in transfer_names:
+        trans[name] = rng.standard_normal(nk)
+    trans["k"] = np.logspace(-5, 3, nk)
+    return trans
+
+
+def dir_size(path: str, suffix: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, fn))
+        for fn in os.listdir(path) if fn.endswith(suffix))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nk", type=int, default=5000, help="k modes per table")
+    parser.add_argument("--nz", type=int, default=10, help="output redshifts")
+    parser.add_argument("--workers", type=int, default=4, help="text writer threads")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    zstrs = [str(i) for i in range(args.nz)]
+    transfers = [fake_transfer(args.nk, rng) for _ in zstrs]
+    pklins = [np.abs(trans["d_tot"]) for trans in transfers]
+
+    with tempfile.TemporaryDirectory() as camb_outdir:
+        npzfile = os.path.join(camb_outdir, classio.class_npz)
+
+        start = time.perf_counter()
+        classio.save_class_npz(npzfile, zstrs, transfers, pklins)
+        t_write_npz = time.perf_counter() - start
+
+        start = time.perf_counter()
+        classio.write_class_text(classio.ClassOutput(npzfile), camb_outdir)
+        t_write_text = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            writes = [pool.submit(classio.save_class_text, camb_outdir, zstr, trans, pk_lin)
+                for zstr, trans, pk_lin in zip(zstrs, transfers, pklins)]
+            for write in writes:
+                write.result()
+        t_write_text_pool = time.perf_counter() - start
+
+        # what PowerSpec.read_camblinear and CLASSPowerSpectrum used to do
+        start = time.perf_counter()
+        for zstr in zstrs:
+            np.loadtxt(os.path.join(camb_outdir, classio.transfer_fn(zstr)))
+            np.loadtxt(os.path.join(camb_outdir, classio.matterpow_fn(zstr)))
+        t_read_text = time.perf_counter() - start
+
+        start = time.perf_counter()
+        class_output = classio.ClassOutput(npzfile)
+        for zstr in zstrs:
+            class_output.transfer_table(zstr)
+            class_output.matterpow(zstr)
+        t_read_npz = time.perf_counter() - start
+
+        print("{} redshifts x {} k modes x {} transfer columns".format(
+            args.nz, args.nk, len(transfer_names)))
+        print("text : {:8.1f} MB, write {:7.3f}s, read {:7.3f}s".format(
+            dir_size(camb_outdir, ".dat") / 1e6, t_write_text, t_read_text))
+        print("npz  : {:8.1f} MB, write {:7.3f}s, read {:7.3f}s".format(
+            dir_size(camb_outdir, ".npz") / 1e6, t_write_npz, t_read_npz))
+        print("text write with {} threads: {:7.3f}s".format(args.workers, t_write_text_pool))
+        print("read speedup: {:.0f}x".format(t_read_text / t_read_npz))
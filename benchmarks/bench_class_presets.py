@@ -0,0 +1,101 @@
+"""
+Benchmark the CLASS precision presets over a grid of cosmologies.
+
+For each cosmology and preset, run CLASS with the parameters cambfile would
+use and report the wall time, and the maximum fractional deviation of the
+linear P(k) and of the total matter transfer function from the production
+preset, up to the maxk of the run. Needs classylss.
+
+With --output, the mean wall time of each preset, without and with massive
+neutrinos, is saved with the machine it was measured on, for
+simrunner plan --class_timings.
+
+python benchmarks/bench_class_presets.py --box=100 --npart=75 --output=class_timings.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import argparse
+import tempfile
+import itertools
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import classylss.binding as CLASS
+from SimulationRunner import classpresets
+from SimulationRunner.simulationics import SimulationICs
+
+# (omega0, hubble, m_nu) corners of a typical Latin hypercube
+omega0s = [0.268, 0.308]
+hubbles = [0.65, 0.75]
+m_nus   = [0., 0.15]
+
+
+def run_class(pre_params: dict, zz: float, kk: np.ndarray):
+    """CLASS wall time, P_lin(k) and d_tot(k) at a redshift"""
+    start = time.perf_counter()
+    engine  = CLASS.ClassEngine(pre_params)
+    powspec = CLASS.Spectra(engine)
+    elapsed = time.perf_counter() - start
+
+    trans = powspec.get_transfer(z=zz)
+    d_tot = np.interp(np.log(kk), np.log(trans['k']), trans['d_tot'])
+    return elapsed, powspec.get_pklin(k=kk, z=zz), d_tot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--box", type=int, default=100)
+    parser.add_argument("--npart", type=int, default=75)
+    parser.add_argument("--redshift", type=float, default=0.,
+        help="redshift at which to compare the outputs")
+    parser.add_argument("--output", type=str, default=None,
+        help="json file to save the mean wall times of each preset to")
+    args = parser.parse_args()
+
+    presets = list(classpresets.class_presets)
+    assert presets[0] == "production"
+
+    print("{:>7s} {:>6s} {:>5s} {:>11s} {:>9s} {:>10s} {:>10s}".format(
+        "omega0", "hubble", "m_nu", "preset", "time (s)", "max dP/P", "max dT/T"))
+
+    # wall times of each preset, [massless, massive]
+    elapsed_times = {preset: ([], []) for preset in presets}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i, (omega0, hubble, m_nu) in enumerate(itertools.product(omega0s, hubbles, m_nus)):
+            results = {}
+            for preset in presets:
+                sim = SimulationICs(outdir=os.path.join(tmpdir, "{}_{}".format(i, preset)),
+                    box=args.box, npart=args.npart, omega0=omega0, hubble=hubble,
+                    m_nu=m_nu, class_preset=preset)
+                pre_params, _, maxk = sim.class_params()
+                pre_params["z_max_pk"] = max(pre_params["z_max_pk"], args.redshift)
+
+                # k in h/Mpc; the last CLASS k is rounded down in cambfile
+                kk = np.logspace(-4, np.log10(0.99 * maxk), 500)
+                results[preset] = run_class(pre_params, args.redshift, kk)
+
+            _, pk_ref, tk_ref = results["production"]
+            for preset in presets:
+                elapsed, pk, tk = results[preset]
+                elapsed_times[preset][int(m_nu > 0)].append(elapsed)
+                print("{:7.3f} {:6.2f} {:5.2f} {:>11s} {:9.2f} {:10.2e} {:10.2e}".format(
+                    omega0, hubble, m_nu, preset, elapsed,
+                    np.max(np.abs(pk / pk_ref - 1)), np.max(np.abs(tk / tk_ref - 1))))
+
+    if args.output is not None:
+        timings = {
+            "machine" : "{}, {}, {} cores".format(platform.node(), platform.processor()
+                or platform.machine(), os.cpu_count()),
+            "date"    : datetime.date.today().isoformat(),
+            "box"     : args.box,
+            "npart"   : args.npart,
+            "times"   : {preset: [float(np.mean(tt)) for tt in elapsed_times[preset]]
+                for preset in presets},
+        }
+        with open(args.output, "w") as f:
+            json.dump(timings, f, indent=1)
+        print("Saved the wall times to", args.output)
@@ -0,0 +1,67 @@
+"""
+Benchmark the start up of the simrunner command line.
+
+Runs `python -m SimulationRunner status` on an empty suite with
+`python -X importtime`, reports the wall time and the slowest imports, and
+exits with an error if the start up is over budget or loads one of the
+heavy compiled stacks only the make/power/hdf5 paths need.
+
+python benchmarks/bench_import_time.py --budget=0.5
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# must not be imported to check the status of a suite
+heavy_modules = ["classylss", "nbodykit", "matplotlib", "h5py", "scipy"]
+
+
+def parse_importtime(stderr: str) -> list:
+    """(cumulative microseconds, module) of every top level import"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [col.strip() for col in line[len("import time:"):].split("|")]
+        imports.append((int(cumulative), name))
+    return imports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=0.5, help="wall time budget in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to show")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as rundir:
+        os.mkdir(os.path.join(rundir, "sim_0000"))
+        cmd = [sys.executable, "-X", "importtime", "-m", "SimulationRunner", "status", rundir]
+
+        walls = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            proc = subprocess.run(cmd, cwd=root, capture_output=True, text=True, check=True)
+            walls.append(time.perf_counter() - start)
+
+    imports = parse_importtime(proc.stderr)
+    loaded  = {name.split(".")[0] for _, name in imports}
+
+    print("simrunner status: best {:.3f}s, median {:.3f}s over {} runs (budget {:.2f}s)".format(
+        min(walls), sorted(walls)[len(walls) // 2], len(walls), args.budget))
+    print("slowest imports (cumulative ms):")
+    for cumulative, name in sorted(imports, reverse=True)[:args.top]:
+        print("{:10.1f}  {}".format(cumulative / 1e3, name))
+
+    heavy = [name for name in heavy_modules if name in loaded]
+    if heavy:
+        print("FAIL: heavy modules imported:", heavy)
+    if min(walls) > args.budget:
+        print("FAIL: over budget")
+    if heavy or min(walls) > args.budget:
+        raise SystemExit(1)
@@ -0,0 +1,75 @@
+"""
+Benchmark cambpower.modecount_rebin against the loop it replaced, on a
+synthetic FFTPower output: linear k bins much finer than the fundamental
+mode, as check_ic_power_spectra makes with dk=5e-6, so most bins hold a few
+modes or none.
+
+python benchmarks/bench_modecount_rebin.py --nbins=1000000 --npart=300
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from SimulationRunner.cambpower import modecount_rebin
+
+
+def modecount_rebin_loop(kk, pk, modes, pkc, minmodes=250, ndesired=200):
+    """The original while loop over every k bin"""
+    logkk=np.log10(kk)
+    mdlogk = (np.max(logkk) - np.min(logkk))/ndesired
+    istart=iend=1
+    count=0
+    pk_div = pk /pkc(kk)
+    k_list=[kk[0]]
+    pk_list=[pk_div[0]]
+    targetlogk=mdlogk+logkk[istart]
+    while iend < np.size(logkk)-1:
+        count+=modes[iend]
+        iend+=1
+        if count >= minmodes and logkk[iend-1] >= targetlogk:
+            pk1 = np.sum(modes[istart:iend]*pk_div[istart:iend])/count
+            kk1 = np.sum(modes[istart:iend]*kk[istart:iend])/count
+            k_list.append(kk1)
+            pk_list.append(pk1)
+            istart=iend
+            targetlogk=mdlogk+logkk[istart]
+            count=0
+    k_list = np.array(k_list)
+    pk_list = np.array(pk_list) * pkc(k_list)
+    return (k_list, pk_list)
+
+
+def synthetic_power(nbins: int, rng: np.random.Generator):
+    """(k, P, modes) in h/Mpc, with modes ~ 4 pi k^2 dk / k_f^3"""
+    kk = np.linspace(1e-3, 10, nbins)
+    modes = rng.poisson(np.clip(kk**2 * 20. / nbins * 1e4, 0, None)).astype(np.float64)
+    pkc = lambda k: 1e4 * k / (1 + (k / 0.02)**2.5)
+    pk = pkc(kk) * (1 + rng.standard_normal(nbins) / np.sqrt(np.maximum(modes, 1)))
+    return kk, pk, modes, pkc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nbins", type=int, default=1000000)
+    parser.add_argument("--npart", type=int, default=300, help="sets ndesired = npart // 2")
+    args = parser.parse_args()
+
+    kk, pk, modes, pkc = synthetic_power(args.nbins, np.random.default_rng(42))
+
+    start = time.perf_counter()
+    k_loop, pk_loop = modecount_rebin_loop(kk, pk, modes, pkc, ndesired=args.npart // 2)
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    k_new, pk_new = modecount_rebin(kk, pk, modes, pkc, ndesired=args.npart // 2)
+    t_new = time.perf_counter() - start
+
+    assert np.shape(k_new) == np.shape(k_loop)
+    print("{} bins -> {} bins".format(args.nbins, np.size(k_new)))
+    print("max relative difference: k {:.1e}, P {:.1e}".format(
+        np.max(np.abs(k_new / k_loop - 1)), np.max(np.abs(pk_new / pk_loop - 1))))
+    print("loop {:.3f}s, searchsorted {:.4f}s: {:.0f}x faster".format(
+        t_loop, t_new, t_loop / t_new))
@@ -0,0 +1,75 @@
+"""
+Fixtures shared by the tests: fake simulation folders, as SimulationICs and
+MP-Gadget leave them
+"""
+import os
+import json
+from typing import Callable, List, Tuple
+import numpy as np
+import pytest
+import bigfile
+from SimulationRunner.multi_sims import fn_outdir, powerspec_fn
+
+
+def _write_part(path: str, npart: int, boxsize: float, time: float = 1., seed: int = 42,
+        position: np.ndarray = None) -> None:
+    """A PART folder with the positions given or uniform random positions, in kpc/h"""
+    if position is None:
+        position = np.random.default_rng(seed).uniform(0, boxsize, size=(npart**3, 3))
+    with bigfile.File(path, create=True) as bigf:
+        header = bigf.create("Header")
+        header.attrs["BoxSize"] = np.array([boxsize])
+        header.attrs["Time"] = np.array([time])
+        header.attrs["TotNumPart"] = np.array([0, npart**3], dtype=np.int64)
+        bigf.create_from_array("1/Position", position)
+
+
+def _write_simulation(submission_dir: str, npart: int = 16) -> None:
+    """A finished simulation folder with two PART snapshots, at a = 0.5 and 1"""
+    os.makedirs(os.path.join(submission_dir, "output"))
+    os.makedirs(os.path.join(submission_dir, "camb_linear"))
+    open(os.path.join(submission_dir, "mpgadget.param"), "w").close()
+    np.savetxt(os.path.join(submission_dir, "output", "powerspectrum-1.0000.txt"), np.ones((4, 4)))
+    np.savetxt(os.path.join(submission_dir, "camb_linear", "ics_matterpow_0.dat"), np.ones((4, 2)))
+    with open(os.path.join(submission_dir, "SimulationICs.json"), "w") as f:
+        json.dump({"box": 100, "npart": npart}, f)
+    np.savetxt(os.path.join(submission_dir, "output", "Snapshots.txt"), [[0, 0.5], [1, 1.]])
+    for number, time in enumerate((0.5, 1.)):
+        _write_part(os.path.join(submission_dir, "output", "PART_{:03d}".format(number)),
+            npart, 100000., time=time, seed=number)
+
+
+@pytest.fixture
+def write_part() -> Callable:
+    """write_part(path, npart, boxsize, time=1., seed=42, position=None): a PART folder"""
+    return _write_part
+
+
+@pytest.fixture
+def write_simulation() -> Callable:
+    """write_simulation(submission_dir, npart=16): a finished simulation folder"""
+    return _write_simulation
+
+
+@pytest.fixture
+def write_suite(tmp_path) -> Callable[[int], Tuple[List[str], str]]:
+    """
+    write_suite(n_simulations): simulation folders in tmp_path whose
+    powerspectrum-1.0000.txt is all i in the folder i, and their Latin json.
+    Folders already there are kept.
+    """
+    def write(n_simulations: int) -> Tuple[List[str], str]:
+        all_submission_dirs = []
+        for i in range(n_simulations):
+            submission_dir = str(tmp_path / fn_outdir(i, 16, 100))
+            if not os.path.exists(submission_dir):
+                _write_simulation(submission_dir)
+                np.savetxt(os.path.join(submission_dir, "output", powerspec_fn(1)),
+                    i * np.ones((4, 4)))
+            all_submission_dirs.append(submission_dir)
+        Latin_json = str(tmp_path / "Latin.json")
+        with open(Latin_json, "w") as f:
+            json.dump({"parameter_names": ["omega0"],
+                "omega0": list(np.linspace(0.2, 0.4, n_simulations))}, f)
+        return all_submission_dirs, Latin_json
+    return write
@@ -46,6 +46,24 @@ if __name__ == "__main__":
 
     parser.add_argument("--python", type=str, default="python")
 
+    # share CLASS outputs between fidelities of the same cosmology
+    parser.add_argument("--class_cache", type=str, default=None)
+    parser.add_argument("--class_cache_size", type=float, default=10.)
+    # CLASS precision: production, lowres or preview
+    parser.add_argument("--class_preset", type=str, default="production")
+    # tune the CLASS neutrino tolerance for this P(k) accuracy over mnu_bounds
+    parser.add_argument("--nu_accuracy", type=float, default=None)
+    parser.add_argument("--mnu_bounds", type=float, nargs=2, default=None)
+    # run CLASS in the running classworker.py worker, if there is one
+    parser.add_argument("--class_worker", action="store_true")
+    # remake every file, even those whose inputs are unchanged
+    parser.add_argument("--regenerate", action="store_true")
+    # memory and walltime requests from the cost model, optionally calibrated
+    parser.add_argument("--cost_model", action="store_true")
+    parser.add_argument("--cost_calibration", type=str, default=None)
+    # leave the IC power check to simrunner validate, outside the IC job
+    parser.add_argument("--no_check_ics", action="store_true")
+
     args = parser.parse_args()
 
     # make the cluster class to be a str so can put in argparser
@@ -99,8 +117,14 @@ Sim = simulationics.SimulationICs(
     outdir = outdir,
     gadget_dir = gadget_dir,
     python = python,
-    cluster_class = cluster_class)
-
-Sim.make_simulation(pkaccuracy=0.07)
+    cluster_class = cluster_class,
+    class_cache = args.class_cache, class_cache_size = args.class_cache_size,
+    class_preset = args.class_preset,
+    nu_accuracy = args.nu_accuracy, nu_mnu_bounds = args.mnu_bounds,
+    class_worker = args.class_worker,
+    cost_model = args.cost_model, cost_calibration = args.cost_calibration,
+    check_ics_in_job = not args.no_check_ics)
+
+Sim.make_simulation(pkaccuracy=0.07, incremental=not args.regenerate)
 outdir = os.path.expanduser(outdir)
 assert os.path.exists(outdir)
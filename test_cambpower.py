@@ -0,0 +1,104 @@
+"""
+Test the standalone IC power spectrum check script
+"""
+import os
+import json
+import numpy as np
+import pytest
+from SimulationRunner.cambpower import modecount_rebin, folded_mesh_sizes, mesh_memory, \
+    particle_memory
+from SimulationRunner.cambpower import CLASSPowerSpectrum
+
+
+def _modecount_rebin_loop(kk, pk, modes, pkc, minmodes=250, ndesired=200):
+    """The original loop over every k bin, as reference"""
+    logkk = np.log10(kk)
+    mdlogk = (np.max(logkk) - np.min(logkk)) / ndesired
+    istart = iend = 1
+    count = 0
+    pk_div = pk / pkc(kk)
+    k_list, pk_list = [kk[0]], [pk_div[0]]
+    targetlogk = mdlogk + logkk[istart]
+    while iend < np.size(logkk) - 1:
+        count += modes[iend]
+        iend += 1
+        if count >= minmodes and logkk[iend - 1] >= targetlogk:
+            pk_list.append(np.sum(modes[istart:iend] * pk_div[istart:iend]) / count)
+            k_list.append(np.sum(modes[istart:iend] * kk[istart:iend]) / count)
+            istart = iend
+            targetlogk = mdlogk + logkk[istart]
+            count = 0
+    k_list = np.array(k_list)
+    return k_list, np.array(pk_list) * pkc(k_list)
+
+
+def test_modecount_rebin() -> None:
+    """Same bins as the loop, including empty input bins and short inputs"""
+    rng = np.random.default_rng(3)
+    pkc = lambda k: 1e4 * k / (1 + (k / 0.02)**2.5)
+    for nbins in (2, 3, 50, 20000):
+        for minmodes in (1, 250, 10**6):
+            kk = np.sort(rng.uniform(1e-3, 10, nbins))
+            modes = rng.integers(0, 40, nbins).astype(np.float64)
+            pk = pkc(kk) * rng.uniform(0.9, 1.1, nbins)
+
+            k_ref, pk_ref = _modecount_rebin_loop(kk, pk, modes, pkc, minmodes=minmodes)
+            k_new, pk_new = modecount_rebin(kk, pk, modes, pkc, minmodes=minmodes)
+
+            assert np.shape(k_new) == np.shape(k_ref)
+            assert np.allclose(k_new, k_ref, rtol=1e-12)
+            assert np.allclose(pk_new, pk_ref, rtol=1e-12)
+
+
+def test_folded_mesh_sizes() -> None:
+    """The folded check stays within the memory budget, particles included, and reaches npart/4 k_f"""
+    for npart, memory_gb, subsample in ((1024, 8., 1.), (15000, 8., 1.), (75, 8., 1.),
+            (300, 0.5, 1.), (1024, 8., 0.1)):
+        nmesh, fold = folded_mesh_sizes(npart, memory_gb, subsample=subsample)
+        assert mesh_memory(nmesh) + particle_memory(npart, subsample) <= memory_gb
+        assert nmesh <= 2 * npart
+        # half the Nyquist frequency of the folded mesh, in units of k_f
+        assert fold * nmesh / 4 >= npart / 4
+    # a divisor of npart keeps the folded particle grid regular
+    assert folded_mesh_sizes(1024, 1.)[1] == 4
+    # the painted chunk does not fit
+    with pytest.raises(ValueError):
+        folded_mesh_sizes(300, 0.3)
+    # the mask of a subsample is one byte per particle
+    assert particle_memory(1024, 0.1) > particle_memory(1024) + 1.
+
+
+def _write_class_files(camb_outdir: str, zstr: str) -> np.ndarray:
+    """Power law CLASS tables: P = k^-2, and transfer functions equal for all species"""
+    os.makedirs(camb_outdir, exist_ok=True)
+    kk = np.logspace(-4, 2, 300)
+    np.savetxt(os.path.join(camb_outdir, "ics_matterpow_" + zstr + ".dat"), np.column_stack([kk, kk**-2]))
+    transfer = np.column_stack([kk] + [np.ones_like(kk)] * 6)
+    np.savetxt(os.path.join(camb_outdir, "ics_transfer_" + zstr + ".dat"), transfer)
+    return kk
+
+
+def test_class_splines(tmp_path) -> None:
+    """The log-log splines are exact for a power law, and are saved and reused"""
+    camb_outdir = str(tmp_path / "camb_linear")
+    _write_class_files(camb_outdir, "99")
+    with open(str(tmp_path / "SimulationICs.json"), "w") as f:
+        json.dump({"redshift": 99, "omega0": 0.3, "omegab": 0.05, "hubble": 0.7, "m_nu": 0}, f)
+
+    pkc = CLASSPowerSpectrum.from_simulation_dir(str(tmp_path))
+    kk = np.logspace(-3, 1, 100000)
+    for species in (-1, 0, 1, 3):
+        assert np.allclose(pkc.get_class_power(species)(kk), kk**-2, rtol=1e-8)
+    assert np.isnan(pkc.get_class_power()(1e3))
+    cachefile = os.path.join(camb_outdir, "ic_splines_99.npz")
+    assert os.path.exists(cachefile)
+
+    mtime = os.stat(cachefile).st_mtime_ns
+    cached = CLASSPowerSpectrum.from_simulation_dir(str(tmp_path))
+    assert os.stat(cachefile).st_mtime_ns == mtime
+    assert np.array_equal(cached.get_class_power(1)(kk), pkc.get_class_power(1)(kk))
+
+    # new parameters refit
+    CLASSPowerSpectrum(os.path.join(camb_outdir, "ics_matterpow_99.dat"),
+        os.path.join(camb_outdir, "ics_transfer_99.dat"), omega0=0.31, omegab=0.05)
+    assert os.stat(cachefile).st_mtime_ns != mtime
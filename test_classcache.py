@@ -0,0 +1,101 @@
+"""
+Test the content-addressed cache of CLASS outputs
+"""
+import os
+import numpy as np
+from SimulationRunner.classcache import ClassCache, canonical_hash
+
+
+def _write_class_files(outdir: str, nbytes: int = 1000) -> list:
+    """Fake a camb_linear/ folder"""
+    os.makedirs(outdir, exist_ok=True)
+    files = ["ics_transfer_99.dat", "ics_matterpow_99.dat"]
+    for fn in files:
+        with open(os.path.join(outdir, fn), "w") as f:
+            f.write("1" * nbytes)
+    return files
+
+
+def test_canonical_hash() -> None:
+    """Ordering and numpy types should not change the key, the cosmology should."""
+    params = {"h": 0.7, "Omega_cdm": 0.25, "N_ncdm": 3, "P_k_max_h/Mpc": 10.}
+    reordered = {"N_ncdm": np.int64(3), "Omega_cdm": np.float64(0.25), "h": 0.7,
+        "P_k_max_h/Mpc": 20.}
+    zz = np.array([99, 0.])
+
+    assert canonical_hash(params, zz) == canonical_hash(reordered, [99., 0.])
+    assert canonical_hash(params, zz) != canonical_hash(params, [99., 1.])
+    assert canonical_hash(params, zz) != canonical_hash(dict(params, h=0.71), zz)
+
+
+def test_fetch_store(tmp_path) -> None:
+    """An entry with a larger maxk serves a smaller maxk, but not the reverse."""
+    cache = ClassCache(str(tmp_path / "cache"))
+    key = cache.key({"h": 0.7}, [99, 0])
+
+    lf = str(tmp_path / "LF" / "camb_linear")
+    files = _write_class_files(lf)
+    assert not cache.fetch(key, 10., lf)
+
+    cache.store(key, 10., lf, files)
+
+    hf = str(tmp_path / "HF" / "camb_linear")
+    os.makedirs(hf)
+    assert not cache.fetch(key, 40., hf)
+    assert cache.fetch(key, 5., hf)
+    for fn in files:
+        assert os.path.exists(os.path.join(hf, fn))
+
+    # a larger run replaces the entry
+    cache.store(key, 40., lf, files)
+    assert cache.fetch(key, 40., hf)
+    assert len(cache.entries()) == 1
+
+
+def test_evict(tmp_path) -> None:
+    """The least recently used entries are evicted first"""
+    cache = ClassCache(str(tmp_path / "cache"), max_gb=2500 / 1024**3)
+
+    outdir = str(tmp_path / "camb_linear")
+    files = _write_class_files(outdir, nbytes=500)
+
+    keys = [cache.key({"h": h}) for h in (0.6, 0.7, 0.8)]
+    for i, key in enumerate(keys):
+        cache.store(key, 10., outdir, files)
+        # make the access times distinct
+        meta = os.path.join(cache.cache_dir, key, "cache_meta.json")
+        os.utime(meta, (1000 + i, 1000 + i))
+
+    # 3 x 1000 bytes of data is over the bound
+    cache.evict()
+    remaining = [ee["key"] for ee in cache.entries()]
+    assert keys[0] not in remaining
+    assert keys[2] in remaining
+    assert cache.size() <= cache.max_bytes
+
+
+def test_rewrite_fetched(tmp_path) -> None:
+    """Rewriting or editing a fetched file leaves the cached entry alone"""
+    from SimulationRunner import classio
+
+    cache = ClassCache(str(tmp_path / "cache"))
+    key = cache.key({"h": 0.7}, [99, 0])
+    lf = str(tmp_path / "LF" / "camb_linear")
+    files = _write_class_files(lf)
+    cache.store(key, 10., lf, files)
+
+    hf = str(tmp_path / "HF" / "camb_linear")
+    os.makedirs(hf)
+    assert cache.fetch(key, 5., hf)
+    # a rerun with another preset, and an _alter_power editing in place
+    classio.save_matterpow(np.ones(3), np.ones(3), os.path.join(hf, "ics_matterpow_99.dat"))
+    classio.detach_file(os.path.join(hf, "ics_transfer_99.dat"))
+    with open(os.path.join(hf, "ics_transfer_99.dat"), "w") as f:
+        f.write("2")
+
+    other = str(tmp_path / "other" / "camb_linear")
+    os.makedirs(other)
+    assert cache.fetch(key, 5., other)
+    for fn in files:
+        with open(os.path.join(other, fn), "r") as f:
+            assert f.read() == "1" * 1000
@@ -0,0 +1,83 @@
+"""
+Test the binary store of the CLASS outputs
+"""
+import os
+import numpy as np
+from SimulationRunner import cambpower, classio, classworker, clusters
+from SimulationRunner.simulationics import SimulationICs
+
+# the transfer columns CLASS gives for a massless neutrino cosmology
+transfer_names = ["k", "d_g", "d_b", "d_cdm", "d_ur", "d_tot", "phi", "psi",
+    "t_g", "t_b", "t_ur", "t_tot"]
+
+
+def fake_transfer(nk: int = 300, seed: int = 0) -> np.ndarray:
+    """A structured array shaped like CLASS.Spectra.get_transfer"""
+    rng = np.random.default_rng(seed)
+    trans = np.zeros(nk, dtype=[(name, "f8") for name in transfer_names])
+    for name in transfer_names:
+        trans[name] = rng.standard_normal(nk)
+    trans["k"] = np.logspace(-5, 2, nk)
+    return trans
+
+
+def test_npz_matches_text(tmp_path) -> None:
+    """The binary store reads back exactly what the text files contain"""
+    camb_outdir = str(tmp_path)
+    zstrs = ["99", "1", "0"]
+    transfers = [fake_transfer(seed=i) for i in range(3)]
+    pklins = [np.abs(trans["d_tot"]) for trans in transfers]
+
+    classio.save_class_npz(os.path.join(camb_outdir, classio.class_npz),
+        zstrs, transfers, pklins)
+    class_output = classio.ClassOutput(os.path.join(camb_outdir, classio.class_npz))
+    assert class_output.redshifts == [99., 1., 0.]
+
+    # only the initial redshift as text, as cambfile does
+    files = classio.write_class_text(class_output, camb_outdir, zstrs=["99"])
+    assert files == [classio.transfer_fn("99"), classio.matterpow_fn("99")]
+    assert not os.path.exists(os.path.join(camb_outdir, classio.matterpow_fn("0")))
+
+    tk_text = np.loadtxt(os.path.join(camb_outdir, classio.transfer_fn("99")))
+    pk_text = np.loadtxt(os.path.join(camb_outdir, classio.matterpow_fn("99")))
+    assert np.all(tk_text == class_output.transfer_table("99"))
+    assert np.all(pk_text == class_output.matterpow("99"))
+    assert np.all(pk_text == classio.load_matterpow(camb_outdir, "99"))
+
+    # ordered from high to low redshift, as PowerSpec.read_camblinear
+    redshifts, out = classio.read_all_matterpow(camb_outdir)
+    assert redshifts == [99., 1., 0.]
+    assert out.shape == (3, 300, 2)
+    assert np.all(out[2, :, 1] == pklins[2])
+
+
+class DoubledPowerICs(SimulationICs):
+    """Doubles the IC power, as a subclass changing the power would"""
+    def _alter_power(self, camb_output: str) -> None:
+        pkfile = os.path.join(camb_output, classio.matterpow_fn(self._camb_zstr(self.redshift)))
+        pk = np.loadtxt(pkfile)
+        classio.save_matterpow(pk[:, 0], 2 * pk[:, 1], pkfile)
+
+
+def test_altered_power(tmp_path, monkeypatch) -> None:
+    """The readers see the power _alter_power gave MP-GenIC, not the one in the npz"""
+    monkeypatch.setattr(classworker, "run_class", lambda pre_params: None)
+    monkeypatch.setattr(classworker, "class_version", lambda: "fake")
+    monkeypatch.setattr(classworker, "extract_outputs",
+        lambda powspec, zz: (fake_transfer(), np.logspace(4, 0, 300) / (1 + zz)))
+
+    sim = DoubledPowerICs(outdir=str(tmp_path / "sim"), box=100, npart=16,
+        cluster_class=clusters.BIOClass)
+    camb_outdir = os.path.join(sim.outdir, sim._class_stage())
+    class_output = classio.ClassOutput(os.path.join(camb_outdir, classio.class_npz))
+    pk_class = class_output.matterpow("99")
+
+    pk = classio.load_matterpow(camb_outdir, "99")
+    assert np.array_equal(pk[:, 1], 2 * pk_class[:, 1])
+    assert np.array_equal(cambpower.load_class_table(
+        os.path.join(camb_outdir, classio.matterpow_fn("99"))), pk)
+
+    # the other redshifts have no text file: from the npz
+    redshifts, out = classio.read_all_matterpow(camb_outdir)
+    assert redshifts[0] == 99. and np.array_equal(out[0], pk)
+    assert np.array_equal(out[-1], class_output.matterpow("0"))
@@ -0,0 +1,27 @@
+"""
+Test the CLASS precision presets
+"""
+import pytest
+from SimulationRunner import classpresets
+
+
+def test_presets() -> None:
+    """production keeps the old settings; the others only loosen them"""
+    production = classpresets.precision_params("production")
+    assert production["k_per_decade_for_bao"] == 200
+    assert production["tol_perturb_integration"] == 1e-7
+
+    # a copy, so cambfile can update it
+    production["h"] = 0.7
+    assert "h" not in classpresets.class_presets["production"]
+
+    nu = classpresets.neutrino_params("production", 1e-5)
+    assert nu["tol_ncdm_synchronous"] == 1e-5
+    assert nu["ncdm_fluid_approximation"] == 3
+
+    nu = classpresets.neutrino_params("lowres", 1e-5)
+    assert nu["tol_ncdm_synchronous"] == 1e-4
+    assert classpresets.neutrino_params("lowres", 1e-3)["tol_ncdm_synchronous"] == 1e-3
+
+    with pytest.raises(ValueError):
+        classpresets.precision_params("fast")
@@ -0,0 +1,54 @@
+"""
+Test the protocol of the persistent CLASS worker
+"""
+import os
+import threading
+import numpy as np
+import pytest
+from SimulationRunner import classworker
+
+
+def fake_outputs(pre_params: dict, redshifts: list) -> list:
+    """(transfer, P_lin) shaped like compute_outputs, without running CLASS"""
+    outputs = []
+    for zz in redshifts:
+        trans = np.zeros(10, dtype=[("k", "f8"), ("d_tot", "f8")])
+        trans["k"] = np.logspace(-3, 1, 10)
+        trans["d_tot"] = pre_params["h"] / (1 + zz)
+        outputs.append((trans, trans["k"]**-1))
+    return outputs
+
+
+def test_worker(tmp_path, monkeypatch) -> None:
+    """Jobs go through the socket, errors come back, and the worker stops"""
+    address = str(tmp_path / "worker.sock")
+    assert classworker.find_worker(address) is None
+
+    # stub jobs: the protocol does not need classylss
+    monkeypatch.setattr(classworker, "compute_outputs", fake_outputs)
+    monkeypatch.setattr(classworker, "class_version", lambda: "fake")
+    server = threading.Thread(target=classworker.serve, args=(address,))
+    server.start()
+    try:
+        for _ in range(100):
+            client = classworker.find_worker(address)
+            if client is not None:
+                break
+            server.join(0.05)
+        assert client is not None
+
+        outputs = client.compute({"h": 0.7}, [99., 0.])
+        assert len(outputs) == 2
+        assert np.all(outputs[1][0]["d_tot"] == 0.7)
+        assert client.version == "fake"
+
+        # a failing job does not kill the worker
+        with pytest.raises(RuntimeError):
+            client.compute({}, [0.])
+        assert client.running()
+    finally:
+        classworker.ClassWorkerClient(address).stop()
+        server.join()
+
+    assert not os.path.exists(address)
+    assert classworker.find_worker(address) is None
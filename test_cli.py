@@ -0,0 +1,35 @@
+"""
+Test the simrunner command line starts without the heavy dependencies
+"""
+import os
+import sys
+import subprocess
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_lazy_imports() -> None:
+    """Importing the package modules does not load classylss, nbodykit, matplotlib or h5py"""
+    code = "\n".join([
+        "import sys",
+        "import SimulationRunner.cli, SimulationRunner.remake, SimulationRunner.suite",
+        "import SimulationRunner.simulationics, SimulationRunner.multi_sims",
+        "import SimulationRunner.cambpower, SimulationRunner.icvalidation",
+        "heavy = ['classylss', 'nbodykit', 'matplotlib', 'h5py']",
+        "print(','.join(name for name in heavy if name in sys.modules))",
+    ])
+    out = subprocess.run([sys.executable, "-c", code], cwd=root,
+        capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
+
+
+def test_status(tmp_path) -> None:
+    """simrunner status on a suite which has not started"""
+    os.mkdir(str(tmp_path / "cosmo_0000"))
+    out = subprocess.run([sys.executable, "-m", "SimulationRunner", "status", str(tmp_path)],
+        cwd=root, capture_output=True, text=True, check=True)
+    assert "NOT COMPLETE" in out.stdout
+
+    out = subprocess.run([sys.executable, "-m", "SimulationRunner", "status", "--ics", str(tmp_path)],
+        cwd=root, capture_output=True, text=True, check=True)
+    assert "NO ICS" in out.stdout
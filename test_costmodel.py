@@ -0,0 +1,80 @@
+"""
+Test the memory and walltime cost model and the cluster requests it sizes
+"""
+import os
+import json
+import pytest
+from SimulationRunner import clusters
+from SimulationRunner.costmodel import CostModel, read_run
+
+
+def _write_run(submission_dir: str, elapsed: float, a_reached: float = 1.) -> None:
+    os.makedirs(os.path.join(submission_dir, "output"))
+    with open(os.path.join(submission_dir, "SimulationICs.json"), "w") as f:
+        json.dump({"box": 100, "npart": 75, "redshift": 99, "m_nu": 0.1}, f)
+    # a restart: two files, each with its own elapsed time
+    with open(os.path.join(submission_dir, "output", "cpu.txt"), "w") as f:
+        f.write("Step 0, Time: 0.01, MPIs: 8 Threads: 4 Elapsed: 0.1\n")
+        f.write("total           10.0  100.0%\n")
+        f.write("Step 900, Time: 0.5, MPIs: 8 Threads: 4 Elapsed: {}\n".format(elapsed / 2))
+    with open(os.path.join(submission_dir, "output", "cpu.txt-1"), "w") as f:
+        f.write("Step 1000, Time: {}, MPIs: 8 Threads: 4 Elapsed: {}\n".format(a_reached, elapsed / 2))
+
+
+def test_calibrate(tmp_path) -> None:
+    """The calibration recovers the measured wall time"""
+    submission_dir = str(tmp_path / "sim")
+    _write_run(submission_dir, elapsed=3600.)
+
+    run = read_run(submission_dir, peak_memory_mb=500.)
+    assert run["walltime"] == pytest.approx(3600.)
+    assert run["a_reached"] == 1. and run["mpi_ranks"] == 8 and run["threads"] == 4
+
+    model = CostModel()
+    model.calibrate([run])
+    assert model.walltime(100, 75, 99, 0, 0.1, nproc=32) == pytest.approx(3600.)
+    assert model.memory_per_rank(75, 8) == pytest.approx(500.)
+
+    model.save(str(tmp_path / "calibration.json"))
+    loaded = CostModel.load(str(tmp_path / "calibration.json"))
+    assert loaded.wall_scale == pytest.approx(model.wall_scale)
+    assert loaded.n_runs == 1
+
+
+def test_scaling() -> None:
+    """More particles cost more memory per rank and more time"""
+    model = CostModel()
+    assert model.memory_per_rank(300, 8) > model.memory_per_rank(75, 8)
+    assert model.memory_per_rank(300, 64) < model.memory_per_rank(300, 8)
+    assert model.walltime(100, 300, 99, 0, 0, 256) > model.walltime(100, 75, 99, 0, 0, 256)
+    assert model.walltime(100, 75, 99, 0, 0, 256) < model.walltime(100, 75, 99, 0, 0, 32)
+
+
+def test_bio_requests() -> None:
+    """BIOClass asks for what MaxMemSizePerNode needs, within the short partition"""
+    cluster = clusters.BIOClass(nproc=32, cores=32, mpi_ranks=8)
+    estimate = cluster.size_from_cost_model(CostModel(), box=100, npart=75,
+        redshift=99, redend=0, m_nu=0.)
+
+    assert cluster.cluster_runtime()["MaxMemSizePerNode"] >= estimate["memory_per_node"]
+    assert cluster.memory < 115
+    assert cluster.timelimit * 3600 >= min(estimate["walltime"], 2 * 3600)
+    assert cluster.timelimit <= cluster.max_timelimit
+    assert cluster.part_alloc_factor == estimate["part_alloc_factor"]
+
+
+def test_timelimit_warning(capsys) -> None:
+    """A walltime over max_timelimit asks for max_timelimit, and says how many resubmissions"""
+    cluster = clusters.BIOClass(nproc=32, cores=32, mpi_ranks=8)
+    estimate = cluster.size_from_cost_model(CostModel(), box=100, npart=75,
+        redshift=99, redend=0, m_nu=0.)
+    assert estimate["resubmissions"] == 0 and "Warning" not in capsys.readouterr().out
+
+    estimate = cluster.size_from_cost_model(CostModel(), box=100, npart=300,
+        redshift=99, redend=0, m_nu=0.)
+    assert cluster.timelimit == cluster.max_timelimit
+    # enough jobs at the timelimit, and no more
+    hours = estimate["walltime"] / 3600
+    assert 0 < estimate["resubmissions"] * cluster.max_timelimit < hours
+    assert (estimate["resubmissions"] + 1) * cluster.max_timelimit >= hours
+    assert "{} resubmission".format(estimate["resubmissions"]) in capsys.readouterr().out
@@ -0,0 +1,55 @@
+"""
+Test the numpy power spectrum engine, against known spectra and against nbodykit
+"""
+import numpy as np
+import pytest
+from SimulationRunner.fftpower import fftpower
+
+boxsize = 100.
+
+
+def _lattice(npart: int) -> np.ndarray:
+    return np.indices((npart,) * 3).reshape(3, -1).T * (boxsize / npart)
+
+
+@pytest.mark.parametrize("resampler", ["cic", "tsc"])
+@pytest.mark.parametrize("interlaced", [False, True])
+def test_known_spectra(resampler: str, interlaced: bool) -> None:
+    """A lattice has no power, random particles have the shot noise, and a plane wave is where it should be"""
+    power = fftpower(_lattice(32), 32, boxsize, resampler=resampler, interlaced=interlaced)
+    assert np.nanmax(power["power"][1:]) < 1e-8
+
+    pos = np.random.default_rng(42).uniform(0, boxsize, size=(200000, 3))
+    power = fftpower(pos, 64, boxsize, resampler=resampler, interlaced=interlaced)
+    assert np.nanmean(power["power"][1:30]) == pytest.approx(power["shotnoise"], rel=0.05)
+    # k = 0 is the mean: P = V, one mode
+    assert power["power"][0] == pytest.approx(boxsize**3) and power["modes"][0] == 1
+
+    # Zel'dovich displacement of 3 fundamental modes: delta = -0.05 cos(k0 x)
+    k0 = 2 * np.pi * 3 / boxsize
+    pos = _lattice(32)
+    pos[:, 0] = (pos[:, 0] + 0.05 / k0 * np.sin(k0 * pos[:, 0])) % boxsize
+    power = fftpower(pos, 64, boxsize, resampler=resampler, interlaced=interlaced, dtype="f8")
+    ii = np.nanargmin(np.abs(power["k"] - k0))
+    # two modes, +-k0, with |delta_k|^2 = 0.025^2
+    assert power["power"][ii] * power["modes"][ii] == pytest.approx(2 * boxsize**3 * 0.025**2, rel=0.03)
+
+
+@pytest.mark.parametrize("interlaced", [False, True])
+def test_nbodykit_regression(interlaced: bool) -> None:
+    """The same bins, modes and power as nbodykit's FFTPower"""
+    pytest.importorskip("nbodykit")
+    from nbodykit.lab import ArrayCatalog, FFTPower
+
+    pos = np.random.default_rng(42).uniform(0, boxsize, size=(50000, 3))
+    cat = ArrayCatalog({"Position": pos})
+    mesh = cat.to_mesh(resampler="cic", Nmesh=32, BoxSize=boxsize, compensated=True,
+        interlaced=interlaced)
+    expected = FFTPower(mesh, mode="1d").power
+
+    power = fftpower(pos, 32, boxsize, resampler="cic", interlaced=interlaced)
+    ii = np.isfinite(expected["k"])
+    assert np.array_equal(ii, np.isfinite(power["k"]))
+    assert np.allclose(power["modes"], expected["modes"])
+    assert np.allclose(power["k"][ii], expected["k"][ii])
+    assert np.allclose(power["power"][ii], expected["power"].real[ii], rtol=1e-3)
@@ -0,0 +1,64 @@
+"""
+Test the suite-wide IC validation and its summary table
+"""
+import os
+import csv
+import json
+import h5py
+import numpy as np
+from SimulationRunner import cambpower, icvalidation
+
+
+def test_validate_suite(tmp_path) -> None:
+    """A folder which cannot be checked fails without stopping the others, and is in the summary"""
+    submission_dirs = [str(tmp_path / "cosmo_0000"), str(tmp_path / "cosmo_0001")]
+    for submission_dir in submission_dirs:
+        os.mkdir(submission_dir)
+
+    rows = icvalidation.validate_suite(submission_dirs, workers=2)
+    assert [row["submission_dir"] for row in rows] == submission_dirs
+    assert all(not row["passed"] and row["species"] == -1 and row["error"] for row in rows)
+
+    icvalidation.write_summary(rows, str(tmp_path / "summary.csv"))
+    with open(str(tmp_path / "summary.csv"), "r") as f:
+        table = list(csv.DictReader(f))
+    assert [row["submission_dir"] for row in table] == submission_dirs
+    assert list(table[0].keys()) == icvalidation.summary_columns
+
+    icvalidation.write_summary(rows, str(tmp_path / "summary.hdf5"))
+    with h5py.File(str(tmp_path / "summary.hdf5"), "r") as f:
+        assert [name.decode() for name in f["submission_dir"][:]] == submission_dirs
+        assert not any(f["passed"][:])
+
+
+def test_validate_simulation(tmp_path, monkeypatch) -> None:
+    """A row per particle type, passing with at most max_failing_bins bins over the accuracy"""
+    submission_dir = str(tmp_path / "cosmo_0000")
+    os.mkdir(submission_dir)
+    with open(os.path.join(submission_dir, "SimulationICs.json"), "w") as f:
+        json.dump({"redshift": 99, "m_nu": 0.06}, f)
+    with open(os.path.join(submission_dir, "_genic_params.ini"), "w") as f:
+        f.write("OutputDir = output\nFileBase = IC\n")
+
+    calls = []
+    def ic_power_errors(genicfileout: str, camb_zstr: str, **kwargs) -> dict:
+        calls.append((genicfileout, camb_zstr, kwargs))
+        failing = cambpower.max_failing_bins + 1
+        return {1: np.array([0.01, 0.08, 0.02]), 2: np.full(failing, 0.1)}
+    monkeypatch.setattr(cambpower, "ic_power_errors", ic_power_errors)
+
+    rows = icvalidation.validate_simulation(submission_dir, accuracy=0.07)
+    assert calls == [(os.path.join("output", "IC"), "99",
+        {"outdir": submission_dir, "m_nu": 0.06, "plot": False})]
+
+    assert [row["species"] for row in rows] == [1, 2]
+    assert rows[0]["max_error"] == 0.08 and rows[0]["n_failing"] == 1
+    assert rows[0]["n_bins"] == 3 and rows[0]["passed"] and rows[0]["error"] == ""
+    assert rows[1]["max_error"] == 0.1 and rows[1]["n_failing"] == cambpower.max_failing_bins + 1
+    assert not rows[1]["passed"]
+
+    icvalidation.write_summary(rows, str(tmp_path / "summary.csv"))
+    with open(str(tmp_path / "summary.csv"), "r") as f:
+        table = list(csv.DictReader(f))
+    assert [row["passed"] for row in table] == ["True", "False"]
+    assert float(table[0]["max_error"]) == 0.08 and table[0]["n_failing"] == "1"
@@ -0,0 +1,61 @@
+"""
+Test the interpolator of the linear power over cosmological parameters
+"""
+import os
+import json
+import numpy as np
+from SimulationRunner import classio
+from SimulationRunner.linear_emulator import LinearPowerEmulator, tophat_sigma
+
+
+def fake_pklin(kk: np.ndarray, omega0: float, ns: float, zz: float) -> np.ndarray:
+    """A smooth P(k) with a turn over, standing in for CLASS"""
+    k_eq = 0.02 * omega0 / 0.3
+    return 2e4 * (kk / k_eq)**ns / (1 + (kk / k_eq)**2)**2 / (1 + zz)**2
+
+
+def write_simulation(outdir: str, omega0: float, ns: float) -> None:
+    """A simulation folder with SimulationICs.json and camb_linear/class_output.npz"""
+    camb_outdir = os.path.join(outdir, "camb_linear")
+    os.makedirs(camb_outdir)
+    with open(os.path.join(outdir, "SimulationICs.json"), "w") as f:
+        json.dump({"omega0": omega0, "ns": ns, "hubble": 0.7}, f)
+
+    zstrs = ["99", "0"]
+    transfers, pklins = [], []
+    for zstr in zstrs:
+        trans = np.zeros(300, dtype=[("k", "f8"), ("d_tot", "f8")])
+        trans["k"] = np.logspace(-4, 1, 300)
+        transfers.append(trans)
+        pklins.append(fake_pklin(trans["k"], omega0, ns, float(zstr)))
+    classio.save_class_npz(os.path.join(camb_outdir, classio.class_npz), zstrs, transfers, pklins)
+
+
+def test_emulator(tmp_path) -> None:
+    """Predictions inside the design match the truth within the error estimate"""
+    rng = np.random.default_rng(0)
+    points = rng.uniform([0.25, 0.9], [0.35, 1.0], size=(20, 2))
+    dirs = []
+    for i, (omega0, ns) in enumerate(points):
+        dirs.append(str(tmp_path / "sim_{}".format(i)))
+        write_simulation(dirs[-1], omega0, ns)
+
+    emu = LinearPowerEmulator.from_simulation_dirs(dirs)
+    # hubble does not vary, so it is not a parameter
+    assert emu.parameter_names == ["omega0", "ns"]
+    assert list(emu.redshifts) == [99., 0.]
+
+    new = {"omega0": 0.3, "ns": 0.95}
+    kk, pk, err = emu.predict(new, redshift=0)
+    truth = fake_pklin(kk, 0.3, 0.95, 0.)
+    assert np.max(np.abs(pk / truth - 1)) < 0.01
+    assert np.max(err) < 0.05
+
+    sigma8, sigma8_err = emu.sigma8(new)
+    assert abs(sigma8 / tophat_sigma(kk, truth) - 1) < 0.01
+    assert sigma8_err >= 0
+
+    # saved and reloaded to the same predictions
+    emu.save(str(tmp_path / "emu.npz"))
+    loaded = LinearPowerEmulator.load(str(tmp_path / "emu.npz"))
+    assert np.allclose(loaded.predict(new, redshift=0)[1], pk)
@@ -0,0 +1,181 @@
+"""
+Test the bigfile readers of load_nbodykit_power and the cache of their results
+"""
+import glob
+import shutil
+import numpy as np
+import pytest
+from SimulationRunner import fftpower
+from SimulationRunner.multi_nbodykit import (load_nbodykit_power, rebin_power, NbodyKitPowerSpec,
+    HDF5Holder, folded_mesh_plan, load_folded_power)
+
+
+def test_streaming(tmp_path, write_part) -> None:
+    """Chunks smaller than the particles paint the same mesh as reading them all"""
+    pytest.importorskip("nbodykit")
+    path = str(tmp_path / "PART_000")
+    write_part(path, 16, 100000.)
+
+    k_full, ps_full = load_nbodykit_power(path, 1., chunk_size=None)
+    k_chunk, ps_chunk = load_nbodykit_power(path, 1., chunk_size=1000)
+    ii = np.isfinite(k_full)
+    assert np.allclose(k_full[ii], k_chunk[ii])
+    assert np.allclose(ps_full[ii], ps_chunk[ii], rtol=1e-4)
+
+
+def test_numpy_engine(tmp_path, write_part) -> None:
+    """The numpy engine streams too, and random particles have the shot noise power"""
+    path = str(tmp_path / "PART_000")
+    write_part(path, 32, 100000.)
+
+    k_full, ps_full = load_nbodykit_power(path, 1., chunk_size=None, engine="numpy",
+        subtract_shotnoise=False)
+    k_chunk, ps_chunk = load_nbodykit_power(path, 1., chunk_size=1000, engine="numpy",
+        subtract_shotnoise=False)
+    ii = np.isfinite(k_full)
+    assert np.allclose(k_full[ii], k_chunk[ii])
+    assert np.allclose(ps_full[ii], ps_chunk[ii], rtol=1e-4)
+    # V / N, in (Mpc/h)^3
+    assert np.mean(ps_full[ii][1:]) == pytest.approx(100.**3 / 32**3, rel=0.05)
+
+
+def test_read_powerspecs(tmp_path, write_simulation) -> None:
+    """All the redshifts in one call, as one call per redshift"""
+    submission_dir = str(tmp_path / "sim")
+    write_simulation(submission_dir)
+
+    ps = NbodyKitPowerSpec(submission_dir, z0=0., Ng=16, kmax=2., engine="numpy")
+    k0, powerspecs = ps.read_powerspecs([1., 0.], Ng=16, kmax=2., engine="numpy")
+    assert powerspecs.shape == (2, len(k0))
+    assert np.allclose(powerspecs[1], ps.powerspecs) and np.allclose(k0, ps.k0)
+
+    k1, ps1 = ps.read_powerspec(1., Ng=16, kmax=2., engine="numpy")
+    assert np.allclose(powerspecs[0], ps1)
+    assert not np.allclose(powerspecs[0], powerspecs[1])
+
+
+def test_power_cache(tmp_path, monkeypatch, write_part) -> None:
+    """A second read comes from the cache, until the snapshot or the settings change"""
+    path = str(tmp_path / "PART_000")
+    write_part(path, 16, 100000.)
+
+    k0, ps = load_nbodykit_power(path, 1., engine="numpy", cache=True)
+    assert len(glob.glob(path + ".power-*.npz")) == 1
+
+    def no_paint(*args, **kwargs):
+        raise AssertionError("painted a cached snapshot")
+    monkeypatch.setattr(fftpower.Mesh, "paint", no_paint)
+    k1, ps1 = load_nbodykit_power(path, 1., engine="numpy", cache=True)
+    assert np.array_equal(ps, ps1, equal_nan=True) and np.array_equal(k0, k1, equal_nan=True)
+    monkeypatch.undo()
+
+    # other settings: another entry
+    load_nbodykit_power(path, 1., engine="numpy", cache=True, Ng=8)
+    assert len(glob.glob(path + ".power-*.npz")) == 2
+
+    # a rewritten snapshot is measured again
+    shutil.rmtree(path)
+    write_part(path, 16, 100000., seed=1)
+    _, ps2 = load_nbodykit_power(path, 1., engine="numpy", cache=True)
+    assert not np.allclose(ps, ps2)
+
+
+def test_rebin(tmp_path, write_simulation) -> None:
+    """Mode weighted re-binning, of one simulation and of a whole catalogue"""
+    submission_dir = str(tmp_path / "sim")
+    write_simulation(submission_dir)
+    ps = NbodyKitPowerSpec(submission_dir, z0=0., Ng=16, kmax=2., engine="numpy")
+    assert len(ps.fine_k0) == len(ps.fine_powerspecs) == len(ps.fine_modes) > len(ps.k0)
+
+    edges = np.linspace(0., 0.6, 4)
+    k, pk, modes = ps.rebin(edges)
+    for i in range(3):
+        ind = (ps.fine_k0 >= edges[i]) & (ps.fine_k0 < edges[i + 1]) & (ps.fine_modes > 0)
+        assert modes[i] == np.sum(ps.fine_modes[ind])
+        assert pk[i] == pytest.approx(np.average(ps.fine_powerspecs[ind], weights=ps.fine_modes[ind]))
+        assert k[i] == pytest.approx(np.average(ps.fine_k0[ind], weights=ps.fine_modes[ind]))
+
+    # fine bins of different lengths, padded, and an empty bin
+    filename = str(tmp_path / "test.hdf5")
+    with HDF5Holder(filename, mode="w") as f:
+        for i, n in enumerate((len(ps.fine_k0), 4)):
+            sim = f.create_group("simulation_{}".format(i))
+            sim.create_dataset("fine_k0", data=ps.fine_k0[:n])
+            sim.create_dataset("fine_powerspecs", data=(i + 1) * ps.fine_powerspecs[:n])
+            sim.create_dataset("fine_modes", data=ps.fine_modes[:n])
+    with HDF5Holder(filename) as f:
+        k_all, pk_all, modes_all = f.rebin(edges)
+    assert pk_all.shape == (2, 3)
+    assert np.allclose(pk_all[0], pk)
+    assert modes_all[1, 2] == 0 and np.isnan(pk_all[1, 2]) and np.all(modes_all[1] <= modes_all[0])
+
+    # vectorized over leading axes as a loop over rows
+    stacked = rebin_power(ps.fine_k0, np.array([ps.fine_powerspecs, 2 * ps.fine_powerspecs]),
+        ps.fine_modes, edges)[1]
+    assert np.allclose(stacked, [pk, 2 * pk])
+
+
+def test_folded_power(tmp_path, write_part) -> None:
+    """Folded boxes reach the k of a finer mesh, with the same power and shot noise"""
+    # 5 times the trusted k of a 512^3 mesh: boxes of L, L / 3, L / 9
+    assert folded_mesh_plan(16., 256., memory_gb=16., max_Ng=512) == (512, 3, 2)
+    assert folded_mesh_plan(1., 100., memory_gb=16., max_Ng=512) == (64, 1, 0)
+    # the chunk of particles painted at a time counts in the budget
+    assert folded_mesh_plan(16., 256., memory_gb=0.25)[0] == 170
+    assert folded_mesh_plan(16., 256., memory_gb=0.25, chunk_size=2**16)[0] == 248
+    with pytest.raises(ValueError):
+        folded_mesh_plan(16., 256., memory_gb=0.1)
+
+    # a lattice of 32^3 with a plane wave of 12 k_f, periodic in L / 4
+    npart, boxsize, m = 32, 100000., 12
+    x = (np.indices((npart,) * 3).reshape(3, -1).T + 0.5) * boxsize / npart
+    x[:, 0] += 200. * np.sin(2 * np.pi * m * x[:, 0] / boxsize)
+    path = str(tmp_path / "PART_000")
+    write_part(path, npart, boxsize, position=x % boxsize)
+
+    # 16^3 mesh trusted to 0.25 h/Mpc, in boxes of L, L / 2, L / 4
+    k0, ps, modes = load_folded_power(path, 1., k_max=1., Ng=16, fold=2, n_folds=2,
+        engine="numpy", subtract_shotnoise=False, return_modes=True)
+    assert np.all(np.diff(k0) > 0) and k0[-1] <= 1.
+    k_full, ps_full, modes_full = load_nbodykit_power(path, 1., Ng=64, engine="numpy",
+        subtract_shotnoise=False, return_modes=True)
+
+    # the total power of the wave and its aliases, in the box of L / 4
+    ind, ind_full = (k0 > 0.5) & (k0 < 1.), (k_full > 0.5) & (k_full < 1.)
+    assert np.sum(ps[ind] * modes[ind]) > 0
+    assert np.sum(ps[ind] * modes[ind]) == pytest.approx(
+        np.sum(ps_full[ind_full] * modes_full[ind_full]), rel=0.02)
+
+    # random particles: V / N shot noise in every box
+    write_part(path + "_random", 32, 100000.)
+    k0, ps = load_folded_power(path + "_random", 1., k_max=1., Ng=16, fold=2, n_folds=2,
+        engine="numpy", subtract_shotnoise=False)
+    for k_low, k_high in ((0.05, 0.25), (0.25, 0.5), (0.5, 1.)):
+        ind = (k0 > k_low) & (k0 < k_high)
+        assert np.mean(ps[ind]) == pytest.approx(100.**3 / 32**3, rel=0.15)
+
+
+def test_power_cache_concurrent(tmp_path, write_part) -> None:
+    """Several processes filling the same cache entry at once all succeed"""
+    from concurrent.futures import ProcessPoolExecutor
+    from SimulationRunner import powercache
+
+    path = str(tmp_path / "PART_000")
+    write_part(path, 4, 100000.)
+    with ProcessPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(_cached_ones, [path] * 16))
+    assert all(np.array_equal(result[0], np.ones(3)) for result in results)
+    assert len(glob.glob(path + ".power-*")) == 1
+    assert powercache.load_cached(powercache.cache_filename(path, {}),
+        powercache.snapshot_fingerprint(path), "{}") is not None
+
+
+def _cached_ones(path: str):
+    """A cache entry of a PART folder, slow to compute so the writers overlap"""
+    import time
+    from SimulationRunner import powercache
+
+    def compute():
+        time.sleep(0.05)
+        return (np.ones(3),)
+    return powercache.cached_power(path, {}, compute)
@@ -4,6 +4,7 @@ using the powerspecs computed from nbodykit
 """
 from typing import List, Optional
 import os
+import json
 import numpy as np
 import h5py
 from SimulationRunner.multi_sims import fn_outdir
@@ -96,3 +97,29 @@ def test_create_hdf5(
     # output the txt files
     f = HDF5Holder("test_dmonly.hdf5")
     f.to_txt(srgan_output=srgan)
+
+
+def test_columnar_holder(tmp_path, monkeypatch, write_suite) -> None:
+    """HDF5Holder reads the columnar layout as the groups layout, in one slice"""
+    all_submission_dirs, Latin_json = write_suite(3)
+    with open(Latin_json, "r") as f:
+        Latin_dict = json.load(f)
+    Latin_dict["bounds"] = [[0.2, 0.4]]
+    with open(Latin_json, "w") as f:
+        json.dump(Latin_dict, f)
+
+    multips = MultiNbodyKitPowerSpec(all_submission_dirs, Latin_json, None, Ng=16, kmax=1., engine="numpy")
+    multips.create_hdf5(str(tmp_path / "groups.hdf5"))
+    multips.create_hdf5(str(tmp_path / "columnar.hdf5"), layout="columnar")
+
+    # to_txt writes kf.txt and input_limits.txt in the working directory
+    monkeypatch.chdir(tmp_path)
+    outputs = []
+    for filename in ("groups.hdf5", "columnar.hdf5"):
+        with HDF5Holder(filename) as f:
+            assert f.num_simulations == 3
+            f.to_txt(srgan_output=False, output_filename=filename + ".txt")
+            outputs.append((np.loadtxt(filename + ".txt"), np.loadtxt("kf.txt"),
+                f.rebin([0., 0.5, 1.])[1], f.simulation_arrays("camb_matters")))
+    for groups, columnar in zip(*outputs):
+        assert np.array_equal(groups, columnar)
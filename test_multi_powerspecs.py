@@ -3,7 +3,9 @@ Test file for creating hdf5 catalogue from multiple simulations
 """
 from typing import List, Optional
 import os
+import json
 import numpy as np
+import pytest
 import h5py
 from SimulationRunner.multi_sims import powerspec_fn, fn_outdir
 from SimulationRunner.multi_sims import MultiPowerSpec
@@ -232,3 +234,101 @@ def test_create_hdf5(
         hubble_endend = test_hdf5["simulation_{}".format(length)].attrs["hubble"]
 
         assert np.abs(hubble_end - hubble_endend) < 1e-6
+
+
+def test_create_hdf5_workers(tmp_path, write_suite) -> None:
+    """A pool of loaders writes the same catalogue, in the same order, as one"""
+    all_submission_dirs, Latin_json = write_suite(5)
+
+    multips = MultiPowerSpec(all_submission_dirs, Latin_json=Latin_json)
+    multips.create_hdf5(str(tmp_path / "serial.hdf5"))
+    multips.create_hdf5(str(tmp_path / "pool.hdf5"), workers=2, queue_depth=2)
+
+    with h5py.File(str(tmp_path / "serial.hdf5"), "r") as serial, \
+            h5py.File(str(tmp_path / "pool.hdf5"), "r") as pool:
+        for i in range(5):
+            name = "simulation_{}".format(i)
+            assert np.all(pool[name]["powerspecs"][()] == i)
+            assert np.array_equal(pool[name]["powerspecs"][()], serial[name]["powerspecs"][()])
+
+
+def test_update_hdf5(tmp_path, write_suite) -> None:
+    """Only new, changed or unfinished simulations are written again"""
+    hdf5_name = str(tmp_path / "catalogue.hdf5")
+    all_submission_dirs, Latin_json = write_suite(3)
+    MultiPowerSpec(all_submission_dirs, Latin_json=Latin_json).create_hdf5(hdf5_name)
+    assert MultiPowerSpec(all_submission_dirs, Latin_json=Latin_json).update_hdf5(hdf5_name) == []
+
+    # a rerun simulation
+    np.savetxt(os.path.join(all_submission_dirs[1], "output", powerspec_fn(1)), 10 * np.ones((4, 4)))
+    # a group interrupted before it was complete
+    with h5py.File(hdf5_name, "a") as f:
+        del f["simulation_0"].attrs["complete"]
+    assert MultiPowerSpec(all_submission_dirs, Latin_json=Latin_json).update_hdf5(hdf5_name) == [0, 1]
+
+    # a follow-up batch
+    all_submission_dirs, Latin_json = write_suite(5)
+    assert MultiPowerSpec(all_submission_dirs, Latin_json=Latin_json).update_hdf5(hdf5_name) == [3, 4]
+
+    with h5py.File(hdf5_name, "r") as f:
+        assert len(f["omega0"]) == 5
+        assert [f["simulation_{}".format(i)]["powerspecs"][0, 0, 0] for i in range(5)] == [0, 10, 2, 3, 4]
+        assert all(f["simulation_{}".format(i)].attrs["complete"] for i in range(5))
+
+
+def test_columnar_layout(tmp_path, write_suite) -> None:
+    """The columnar layout holds the arrays of the groups, aligned on the scale factors, and a params table"""
+    all_submission_dirs, Latin_json = write_suite(3)
+    # one more redshift in the last simulation
+    np.savetxt(os.path.join(all_submission_dirs[2], "output", powerspec_fn(0.5)), np.ones((4, 4)))
+
+    multips = MultiPowerSpec(all_submission_dirs, Latin_json=Latin_json)
+    multips.create_hdf5(str(tmp_path / "groups.hdf5"))
+    multips.create_hdf5(str(tmp_path / "columnar.hdf5"), layout="columnar", compression="gzip")
+
+    with h5py.File(str(tmp_path / "groups.hdf5"), "r") as groups, \
+            h5py.File(str(tmp_path / "columnar.hdf5"), "r") as columnar:
+        assert columnar.attrs["layout"] == 2
+        assert columnar["powerspecs"].shape == (3, 2, 4, 4)
+        assert columnar["powerspecs"].chunks[1] == 1
+        assert np.array_equal(columnar["scale_factors"][()], [0.5, 1.])
+        # all the simulations at a = 1 in one slice, and a = 0.5 only in the last
+        at_one = columnar["powerspecs"][:, 1]
+        for i in range(3):
+            powerspecs = groups["simulation_{}".format(i)]["powerspecs"][()]
+            assert np.array_equal(at_one[i], powerspecs[-1])
+            assert np.all(at_one[i] == i)
+        assert np.all(np.isnan(columnar["powerspecs"][:2, 0]))
+        assert np.array_equal(columnar["powerspecs"][2, 0],
+            groups["simulation_2"]["powerspecs"][0])
+        assert np.array_equal(columnar["omega0"][()], groups["omega0"][()])
+
+        params = columnar["params"][()]
+        assert params["box"].tolist() == [100] * 3
+        assert [name.decode() for name in params["submission_dir"]] == [
+            os.path.abspath(submission_dir) for submission_dir in all_submission_dirs]
+
+    # the groups layout only
+    with pytest.raises(ValueError):
+        multips.update_hdf5(str(tmp_path / "columnar.hdf5"))
+
+
+def test_simulationics_attrs(tmp_path, write_suite) -> None:
+    """The SimulationICs.json written by txt_description, with its None and dict values, goes into the attrs"""
+    from SimulationRunner import clusters
+    from SimulationRunner.simulationics import SimulationICs
+
+    all_submission_dirs, Latin_json = write_suite(2)
+    for submission_dir in all_submission_dirs:
+        sim = SimulationICs(outdir=submission_dir, box=100, npart=16, cluster_class=clusters.BIOClass)
+        sim.cost_estimate = {"walltime": 3600., "memory_per_rank": 500.}
+        sim.txt_description()
+
+    hdf5_name = str(tmp_path / "catalogue.hdf5")
+    MultiPowerSpec(all_submission_dirs, Latin_json=Latin_json).create_hdf5(hdf5_name)
+    with h5py.File(hdf5_name, "r") as f:
+        attrs = f["simulation_0"].attrs
+        assert attrs["box"] == 100 and attrs["npart"] == 16
+        assert "class_cache" not in attrs
+        assert json.loads(attrs["cost_estimate"])["walltime"] == 3600.
+        assert json.loads(attrs["nu_mnu_bounds"]) == [0, 0]
@@ -0,0 +1,87 @@
+"""
+Test the calibration table of the CLASS neutrino tolerance
+"""
+import os
+import numpy as np
+import pytest
+from SimulationRunner import classworker, clusters
+from SimulationRunner.nutolerance import NuToleranceTable, tolerances, reference_tolerance
+from SimulationRunner.simulationics import SimulationICs
+
+
+def fake_pklin(m_nu: float, tol_ncdm: float, kk: np.ndarray) -> np.ndarray:
+    """P(k) error growing with the neutrino mass and the tolerance"""
+    return kk**-1 * (1 + 10 * m_nu * tol_ncdm)
+
+
+def test_choose(tmp_path) -> None:
+    """The loosest tolerance meeting the accuracy, calibrated once"""
+    table = NuToleranceTable((0.06, 0.15), kmax=10., cache_dir=str(tmp_path))
+    table.load_or_calibrate(fake_pklin)
+    assert os.path.exists(table.filename)
+    assert not os.path.exists(table.filename + ".lock")
+
+    # error = 10 * m_nu * tol at the heaviest bracketing mass
+    assert table.choose(0.06, 1e-3) == 1e-3
+    assert table.choose(0.15, 1e-3) == 3e-4
+    assert table.choose(0.15, 1e-10) == table.reference
+
+    # a second simulation of the suite loads it
+    def fail(*args):
+        raise AssertionError("should not calibrate again")
+    cached = NuToleranceTable((0.06, 0.15), kmax=10., cache_dir=str(tmp_path))
+    cached.load_or_calibrate(fail)
+    assert np.all(cached.errors == table.errors)
+
+    # another kmax is another table
+    assert NuToleranceTable((0.06, 0.15), kmax=20., cache_dir=str(tmp_path)).filename != table.filename
+
+
+class FakeSpectra(object):
+    """The P(k) of fake_pklin at the mass and tolerance of the CLASS parameters"""
+    def __init__(self, pre_params: dict) -> None:
+        self.m_nu = sum(float(mm) for mm in pre_params["m_ncdm"].split(","))
+        self.tol_ncdm = pre_params["tol_ncdm_synchronous"]
+
+    def get_pklin(self, k: np.ndarray, z: float) -> np.ndarray:
+        return fake_pklin(self.m_nu, self.tol_ncdm, k)
+
+
+def test_tune_nu_acc(tmp_path, monkeypatch) -> None:
+    """class_params does not tune; the tuning calibrates once and sets nu_acc"""
+    runs = []
+    def run_class(pre_params: dict) -> FakeSpectra:
+        runs.append(pre_params)
+        return FakeSpectra(pre_params)
+    monkeypatch.setattr(classworker, "run_class", run_class)
+
+    def make_sim(nu_accuracy: float, class_preset: str = "production") -> SimulationICs:
+        return SimulationICs(outdir=str(tmp_path / "sim"), box=100, npart=16, m_nu=0.1,
+            nu_accuracy=nu_accuracy, nu_mnu_bounds=(0.06, 0.15),
+            nu_tolerance_cache=str(tmp_path), class_preset=class_preset,
+            cluster_class=clusters.BIOClass)
+
+    sim = make_sim(1e-3)
+    before = sim.class_params()[0]
+    assert sim.class_params()[0] == before
+    assert sim.nu_acc == 1e-5 and not runs
+
+    # error = 10 * m_nu * tol at the heavier calibrated mass bracketing 0.1, 0.105
+    sim._tune_nu_acc()
+    assert runs and sim.nu_acc == 3e-4
+    n_runs = len(runs)
+    sim._tune_nu_acc()
+    assert len(runs) == n_runs
+    assert sim.class_params()[0]["tol_ncdm_synchronous"] == 3e-4
+    # the calibration runs CLASS at the tolerances it compares
+    assert sorted({pre_params["tol_ncdm_synchronous"] for pre_params in runs}) == \
+        sorted(tolerances + [reference_tolerance])
+
+    # a tighter accuracy, from the same table, is a tighter tolerance
+    tight = make_sim(1e-4)
+    tight._tune_nu_acc()
+    assert len(runs) == n_runs and tight.nu_acc == 3e-5
+
+    # the lowres and preview presets floor the tolerance: nothing to tune
+    with pytest.raises(AssertionError, match="nu_accuracy"):
+        make_sim(1e-3, class_preset="lowres")
@@ -0,0 +1,82 @@
+"""
+Test that make_simulation skips the stages whose inputs are unchanged
+"""
+import os
+from SimulationRunner import clusters
+from SimulationRunner import classio
+from SimulationRunner.simulationics import SimulationICs
+from SimulationRunner.stages import StageRecord
+
+
+class CountingSimulationICs(SimulationICs):
+    """Writes placeholder CLASS files instead of running CLASS, and counts the runs"""
+    class_runs = 0
+
+    def _class_stage(self) -> str:
+        CountingSimulationICs.class_runs += 1
+        camb_outdir = os.path.join(self.outdir, "camb_linear")
+        os.makedirs(camb_outdir, exist_ok=True)
+        zstr = self._camb_zstr(self.redshift)
+        for fn in (classio.matterpow_fn(zstr), classio.transfer_fn(zstr)):
+            with open(os.path.join(camb_outdir, fn), "w") as f:
+                f.write("0 0\n")
+        self.camb_git = "test"
+        return "camb_linear/"
+
+
+def _mtimes(outdir: str) -> dict:
+    files = ["_genic_params.ini", "Options.mk", "mpgadget.param", "mpi_submit_one", "cambpower.py"]
+    return {fn: os.stat(os.path.join(outdir, fn)).st_mtime_ns for fn in files}
+
+
+def test_incremental(tmp_path) -> None:
+    """A rerun does nothing; a new timelimit only rewrites the Gadget parameters and the submission"""
+    outdir = str(tmp_path / "sim")
+    sim = CountingSimulationICs(outdir=outdir, box=100, npart=75, cluster_class=clusters.BIOClass)
+
+    sim.make_simulation()
+    assert CountingSimulationICs.class_runs == 1
+    mtimes = _mtimes(outdir)
+
+    # a fresh object, as in a rerun of the driver
+    sim = CountingSimulationICs(outdir=outdir, box=100, npart=75, cluster_class=clusters.BIOClass)
+    sim.make_simulation()
+    assert CountingSimulationICs.class_runs == 1
+    assert sim.camb_git == "test"
+    assert _mtimes(outdir) == mtimes
+
+    sim.cluster.timelimit = 12
+    sim.make_simulation()
+    assert CountingSimulationICs.class_runs == 1
+    changed = [fn for fn, mtime in _mtimes(outdir).items() if mtimes[fn] != mtime]
+    assert sorted(changed) == ["mpgadget.param", "mpi_submit_one"]
+
+    # a new cosmology reruns CLASS and GenIC
+    sim.hubble = 0.69
+    sim.make_simulation()
+    assert CountingSimulationICs.class_runs == 2
+
+    sim.make_simulation(incremental=False)
+    assert CountingSimulationICs.class_runs == 3
+
+
+def test_stage_record(tmp_path) -> None:
+    """Keys depend on the upstream stages and missing outputs invalidate a stage"""
+    stages = StageRecord(str(tmp_path))
+    key = stages.key("a", {"x": 1})
+    assert not stages.up_to_date("a", key)
+
+    (tmp_path / "a.txt").write_text("a")
+    stages.record("a", key, ["a.txt"], result="res")
+    key_b = stages.key("b", {}, deps=["a"])
+
+    stages = StageRecord(str(tmp_path))
+    assert stages.up_to_date("a", key)
+    assert stages.result("a") == "res"
+    assert not stages.up_to_date("a", stages.key("a", {"x": 2}))
+
+    stages.record("a", stages.key("a", {"x": 2}), ["a.txt"])
+    assert stages.key("b", {}, deps=["a"]) != key_b
+
+    os.remove(str(tmp_path / "a.txt"))
+    assert not stages.up_to_date("a", stages.key("a", {"x": 2}))
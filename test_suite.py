@@ -0,0 +1,85 @@
+"""
+Test the process-pool driver for a Latin hypercube of simulations
+"""
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+from SimulationRunner import clusters, utils
+from SimulationRunner.suite import SimulationSuite, get_cluster_class
+
+Latin_json = os.path.join(
+    os.path.dirname(__file__), "latin_design", "matterLatin_10p_4x3.json")
+
+
+def test_simulation_kwargs() -> None:
+    """Latin parameters map onto SimulationICs arguments and directories are deterministic"""
+    suite = SimulationSuite(Latin_json, box=100, npart=75, outdir_base="cosmo",
+        cluster_class=clusters.BIOClass, points=[0, 3], nproc=16)
+
+    with open(Latin_json, "r") as f:
+        Latin_dict = json.load(f)
+
+    assert len(suite) == 2
+    kwargs = suite.simulation_kwargs(3)
+    assert kwargs["outdir"] == "cosmo_Box100_Part75_0003"
+    assert kwargs["hubble"] == Latin_dict["hubble"][3]
+    assert kwargs["m_nu"] == Latin_dict["mnu"][3]
+    assert kwargs["w0_fld"] == Latin_dict["w0"][3]
+    assert kwargs["N_ur"] == Latin_dict["Neff"][3]
+    assert kwargs["nproc"] == 16
+    assert kwargs["cluster_class"] is clusters.BIOClass
+
+    assert [i for i, _ in suite.iter_simulation_kwargs()] == [0, 3]
+    assert get_cluster_class("clusters.FronteraClass") is clusters.FronteraClass
+
+
+def test_failure_isolation(tmp_path) -> None:
+    """A bad point is reported and does not stop the suite"""
+    suite = SimulationSuite(Latin_json, box=100, npart=75,
+        outdir_base=str(tmp_path / "cosmo"), points=[0])
+    # SimulationICs asserts hubble < 1
+    suite.param_dicts[0]["hubble"] = 70.
+
+    report = str(tmp_path / "report.json")
+    failures = suite.make_simulations(workers=1, report=report)
+
+    assert list(failures) == [0]
+    with open(report, "r") as f:
+        assert "0" in json.load(f)["failures"]
+
+
+def test_plan(tmp_path) -> None:
+    """The dry run flags bad points, predicts the cost and writes nothing"""
+    suite = SimulationSuite(Latin_json, box=100, npart=75,
+        outdir_base=str(tmp_path / "cosmo"), points=[0, 1, 2], nproc=32, cores=32)
+    suite.param_dicts[1]["hubble"] = 70.
+
+    plan = suite.plan()
+
+    assert list(plan["invalid"]) == [1]
+    assert "hubble" in plan["invalid"][1][0]
+    assert sorted(plan["points"]) == [0, 2]
+    assert plan["total"]["gadget_node_hours"] > 0
+    assert plan["total"]["disk_part"] > plan["total"]["disk_ics"] > 0
+    assert plan["class_source"].startswith("placeholder")
+    assert os.listdir(str(tmp_path)) == []
+
+    # CLASS times measured by bench_class_presets.py
+    timings = str(tmp_path / "class_timings.json")
+    with open(timings, "w") as f:
+        json.dump({"machine": "node1", "date": "2026-01-01",
+            "times": {preset: [7200., 7200.] for preset in ("production", "lowres", "preview")}}, f)
+    measured = suite.plan(class_timings=timings)
+    assert measured["class_source"] == "measured on node1 (2026-01-01)"
+    assert measured["total"]["class_hours"] == 2 * 2.
+
+
+def _thread_limits() -> list:
+    return [os.environ[var] for var in utils.thread_env_vars]
+
+
+def test_limit_threads() -> None:
+    """The pool workers of the suite run with the thread limit they are given"""
+    with ProcessPoolExecutor(max_workers=2, initializer=utils.limit_threads,
+            initargs=(3,)) as pool:
+        assert pool.submit(_thread_limits).result() == ["3"] * len(utils.thread_env_vars)